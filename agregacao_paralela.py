@@ -0,0 +1,116 @@
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Abaixo disso (ou com um processo só) a agregação roda no próprio processo
+MIN_REGISTROS = int(os.getenv("AGREGACAO_MIN_REGISTROS", "1000000"))
+PROCESSOS = int(os.getenv("AGREGACAO_PROCESSOS", "0")) or os.cpu_count() or 1
+# Acima desse número de células possíveis, as chaves são agrupadas por ordenação em vez de bincount
+LIMITE_DENSO = 50_000_000
+
+_pool = None
+_lock_pool = threading.Lock()
+
+
+def agregar_codigos(dias, categorias, tipos, valores, n_dias, n_categorias, n_tipos):
+    """Soma, contagem e soma dos quadrados de `valores` por (dia, categoria, tipo) já codificados.
+
+    `dias` vai de 0 a n_dias (0 = sem data) e `categorias`/`tipos` de -1 (ausente) a n - 1. Retorna
+    (chaves, soma, contagem, soma_quadrados) só das células presentes; a chave se decodifica com
+    decodificar_chaves(). Valores ausentes contam como registro mas não entram nas somas.
+    """
+    chaves = (dias.astype(np.int64) * (n_categorias + 1) + (categorias.astype(np.int64) + 1)) * (n_tipos + 1) \
+        + (tipos.astype(np.int64) + 1)
+    presentes = ~np.isnan(valores)
+    valores = np.where(presentes, valores, 0.0)
+    espaco = (n_dias + 1) * (n_categorias + 1) * (n_tipos + 1)
+    if espaco <= LIMITE_DENSO:
+        contagem = np.bincount(chaves, minlength=espaco)
+        celulas = np.flatnonzero(contagem)
+        soma = np.bincount(chaves, weights=valores, minlength=espaco)[celulas]
+        quadrados = np.bincount(chaves, weights=valores * valores, minlength=espaco)[celulas]
+        return celulas, soma, contagem[celulas], quadrados
+    celulas, inversa = np.unique(chaves, return_inverse=True)
+    return (celulas, np.bincount(inversa, weights=valores), np.bincount(inversa),
+            np.bincount(inversa, weights=valores * valores))
+
+
+def decodificar_chaves(chaves, n_categorias, n_tipos):
+    """Inverso da chave de agregar_codigos(): (dias, categorias, tipos) com os mesmos códigos."""
+    chaves, tipos = np.divmod(chaves, n_tipos + 1)
+    dias, categorias = np.divmod(chaves, n_categorias + 1)
+    return dias, categorias - 1, tipos - 1
+
+
+def _agregar_fatia(memorias, tamanho, inicio, fim, n_dias, n_categorias, n_tipos):
+    # Executado nos processos do pool: lê a fatia direto da memória compartilhada, sem cópia
+    blocos = [shared_memory.SharedMemory(name=nome) for nome, _ in memorias]
+    colunas = []
+    try:
+        colunas = [np.ndarray((tamanho,), dtype=tipo, buffer=bloco.buf)[inicio:fim]
+                   for bloco, (_, tipo) in zip(blocos, memorias)]
+        return agregar_codigos(*colunas, n_dias, n_categorias, n_tipos)
+    finally:
+        del colunas
+        for bloco in blocos:
+            bloco.close()
+
+
+def _obter_pool():
+    """Pool do processo, criado no primeiro uso. Usa spawn: o Streamlit tem várias threads e fork não é seguro."""
+    global _pool
+    with _lock_pool:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PROCESSOS, mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+
+def agregar(dias, categorias, tipos, valores, n_dias, n_categorias, n_tipos, processos=None, min_registros=None):
+    """Agrega no próprio processo ou, para conjuntos grandes, em fatias paralelas no pool.
+
+    As fatias são intervalos contíguos de linhas, não de tempo: os registros ficam na ordem de
+    inserção, que não é a ordem das datas (registros retroativos, importações, convert_csv.py).
+    Como somas e contagens são associativas, as células parciais de cada fatia são somadas depois,
+    e o resultado não depende da ordem. Retorna o mesmo formato de agregar_codigos().
+    """
+    processos = processos or PROCESSOS
+    min_registros = MIN_REGISTROS if min_registros is None else min_registros
+    tamanho = len(dias)
+    if processos <= 1 or tamanho < max(min_registros, 2):
+        return agregar_codigos(dias, categorias, tipos, valores, n_dias, n_categorias, n_tipos)
+
+    blocos = []
+    try:
+        memorias = []
+        for coluna in (dias, categorias, tipos, valores):
+            bloco = shared_memory.SharedMemory(create=True, size=max(coluna.nbytes, 1))
+            blocos.append(bloco)
+            np.ndarray(coluna.shape, dtype=coluna.dtype, buffer=bloco.buf)[:] = coluna
+            memorias.append((bloco.name, coluna.dtype.str))
+        # Duas fatias por processo equilibram processos mais lentos sem multiplicar as células parciais
+        limites = np.linspace(0, tamanho, 2 * processos + 1).astype(int)
+        pool = _obter_pool()
+        futuros = [pool.submit(_agregar_fatia, memorias, tamanho, int(inicio), int(fim), n_dias, n_categorias, n_tipos)
+                   for inicio, fim in zip(limites[:-1], limites[1:]) if fim > inicio]
+        parciais = [futuro.result() for futuro in futuros]
+    finally:
+        for bloco in blocos:
+            bloco.close()
+            bloco.unlink()
+    return _juntar(parciais)
+
+
+def _juntar(parciais):
+    """Soma as células repetidas entre fatias (um mesmo dia pode aparecer em várias fatias)."""
+    chaves = np.concatenate([parcial[0] for parcial in parciais])
+    celulas, inversa = np.unique(chaves, return_inverse=True)
+    return (celulas,
+            np.bincount(inversa, weights=np.concatenate([parcial[1] for parcial in parciais])),
+            np.bincount(inversa, weights=np.concatenate([parcial[2] for parcial in parciais])).astype(np.int64),
+            np.bincount(inversa, weights=np.concatenate([parcial[3] for parcial in parciais])))
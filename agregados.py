@@ -0,0 +1,339 @@
+import sys
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from agregacao_paralela import agregar, decodificar_chaves
+
+# Diferença aceitável entre os totais incrementais e uma soma completa (arredondamento de float)
+TOLERANCIA = 0.005
+# Dias de sobra ao estender as árvores de Fenwick do cubo (evita refazê-las a cada dia novo)
+FOLGA_DIAS = 366
+
+
+def valores_em_reais(valores):
+    """Valores em float64 arredondados aos centavos (desfaz o ruído de somas e conversões)."""
+    return pd.to_numeric(valores, errors="coerce").astype("float64").round(2)
+
+
+def valor_registro(registro):
+    """Valor numérico de um registro (0.0 se ausente ou inválido)."""
+    try:
+        valor = float(registro.get("Valor"))
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if pd.isna(valor) else valor
+
+
+class EstadoAgregado:
+    """Totais corridos por Tipo e contagem por Categoria, atualizados em O(1) a cada registro."""
+
+    def __init__(self):
+        self.total_por_tipo = defaultdict(float)
+        self.registros_por_categoria = defaultdict(int)
+        self.total_registros = 0
+
+    @classmethod
+    def construir(cls, df):
+        """Varredura completa do DataFrame (usada na carga e na reconciliação)."""
+        estado = cls()
+        estado.total_registros = len(df)
+        if df.empty:
+            return estado
+        if "Tipo" in df.columns and "Valor" in df.columns:
+            valores = valores_em_reais(df["Valor"])
+            for tipo, total in valores.groupby(df["Tipo"], observed=True).sum().items():
+                estado.total_por_tipo[tipo] = float(total)
+        if "Categoria" in df.columns:
+            for categoria, quantidade in df.groupby("Categoria", observed=True).size().items():
+                estado.registros_por_categoria[categoria] = int(quantidade)
+        return estado
+
+    def aplicar(self, registro):
+        self.total_por_tipo[registro.get("Tipo")] += valor_registro(registro)
+        self.registros_por_categoria[registro.get("Categoria")] += 1
+        self.total_registros += 1
+
+    def aplicar_lote(self, registros):
+        """Aplica vários registros com uma única agregação."""
+        parcial = EstadoAgregado.construir(pd.DataFrame(list(registros), columns=["Categoria", "Valor", "Tipo"]))
+        for tipo, total in parcial.total_por_tipo.items():
+            self.total_por_tipo[tipo] += total
+        for categoria, quantidade in parcial.registros_por_categoria.items():
+            self.registros_por_categoria[categoria] += quantidade
+        self.total_registros += parcial.total_registros
+
+    def copiar(self):
+        copia = EstadoAgregado()
+        copia.total_por_tipo.update(self.total_por_tipo)
+        copia.registros_por_categoria.update(self.registros_por_categoria)
+        copia.total_registros = self.total_registros
+        return copia
+
+    @property
+    def total_despesas(self):
+        return self.total_por_tipo.get("Despesa", 0.0)
+
+    @property
+    def total_receitas(self):
+        return self.total_por_tipo.get("Receita", 0.0)
+
+    @property
+    def saldo(self):
+        return self.total_receitas - self.total_despesas
+
+    def divergencias(self, outro):
+        """Lista os campos em que dois estados diferem (vazia se forem equivalentes)."""
+        diferencas = []
+        if self.total_registros != outro.total_registros:
+            diferencas.append("total_registros")
+        for tipo in set(self.total_por_tipo) | set(outro.total_por_tipo):
+            if abs(self.total_por_tipo.get(tipo, 0.0) - outro.total_por_tipo.get(tipo, 0.0)) > TOLERANCIA:
+                diferencas.append(f"total_por_tipo[{tipo}]")
+        for categoria in set(self.registros_por_categoria) | set(outro.registros_por_categoria):
+            if self.registros_por_categoria.get(categoria, 0) != outro.registros_por_categoria.get(categoria, 0):
+                diferencas.append(f"registros_por_categoria[{categoria}]")
+        return diferencas
+
+
+class CuboAgregado:
+    """Rollup por dia x Categoria x Tipo com soma, contagem e soma dos quadrados de Valor.
+
+    Totais de um período qualquer vêm de árvores de Fenwick sobre os dias (somas e contagens
+    acumuladas, uma coluna por par Categoria x Tipo): um intervalo custa O(séries x log dias) e
+    uma inserção, mesmo com data retroativa, atualiza O(log dias) nós. As estatísticas por
+    categoria vêm dos totais de cada série. Recebe DataFrames no esquema em memória (Data em datetime64).
+    """
+
+    def __init__(self):
+        # (categoria, tipo) -> coluna da série nas árvores e nos totais; None no lugar de valores ausentes
+        self._series = {}
+        self._chaves_series = []
+        # Por série: soma, contagem e soma dos quadrados de todos os registros (com e sem data)
+        self._totais = np.zeros((0, 3))
+        # Nó i (1..n) x [soma, contagem] x série; o nó 0 não é usado. Posição i = dia _dia_base + i - 1
+        self._fenwick = np.zeros((1, 2, 0))
+        self._dia_base = 0
+        # Primeiro e último dia (dias desde 1970-01-01) com registros
+        self._primeiro_dia = None
+        self._ultimo_dia = None
+
+    @classmethod
+    def construir(cls, df, processos=None, min_registros=None):
+        cubo = cls()
+        cubo.aplicar_lote(df, processos, min_registros)
+        return cubo
+
+    def aplicar_lote(self, df, processos=None, min_registros=None):
+        """Soma as células de df ao cubo; conjuntos grandes são agregados em paralelo (ver agregacao_paralela)."""
+        if df.empty:
+            return
+        datas = df["Data"].to_numpy(dtype="datetime64[ns]")
+        sem_data = np.isnat(datas)
+        dias = datas.astype("datetime64[D]").view("int64")
+        primeiro_dia = int(dias[~sem_data].min()) if not sem_data.all() else 0
+        # Dia 0 fica reservado para registros sem data
+        dias = np.where(sem_data, 0, dias - primeiro_dia + 1).astype(np.int32)
+        categorias, rotulos_categorias = pd.factorize(df["Categoria"])
+        tipos, rotulos_tipos = pd.factorize(df["Tipo"])
+        rotulos_categorias = np.asarray(rotulos_categorias, dtype=object).tolist()
+        rotulos_tipos = np.asarray(rotulos_tipos, dtype=object).tolist()
+        valores = valores_em_reais(df["Valor"]).to_numpy(dtype="float64")
+
+        chaves, somas, contagens, quadrados = agregar(
+            dias, categorias.astype(np.int32), tipos.astype(np.int32), valores,
+            int(dias.max()), len(rotulos_categorias), len(rotulos_tipos), processos, min_registros)
+        dias_celulas, categorias_celulas, tipos_celulas = decodificar_chaves(
+            chaves, len(rotulos_categorias), len(rotulos_tipos))
+        series = self._colunas_series(categorias_celulas, tipos_celulas, rotulos_categorias, rotulos_tipos)
+        np.add.at(self._totais, series, np.column_stack([somas, contagens, quadrados]))
+        com_data = dias_celulas > 0
+        self._atualizar_fenwick(dias_celulas[com_data].astype(np.int64) + primeiro_dia - 1, series[com_data],
+                                somas[com_data], contagens[com_data])
+
+    # ---------- Árvores de Fenwick ----------
+    def _colunas_series(self, categorias, tipos, rotulos_categorias, rotulos_tipos):
+        """Coluna de cada célula, criando as séries (Categoria x Tipo) que ainda não existem."""
+        # Código -1 (ausente) cai na última linha/coluna, reservada para None
+        colunas = np.zeros((len(rotulos_categorias) + 1, len(rotulos_tipos) + 1), dtype=np.int64)
+        for categoria, tipo in set(zip(categorias.tolist(), tipos.tolist())):
+            chave = (rotulos_categorias[categoria] if categoria >= 0 else None,
+                     rotulos_tipos[tipo] if tipo >= 0 else None)
+            if chave not in self._series:
+                self._series[chave] = len(self._chaves_series)
+                self._chaves_series.append(chave)
+            colunas[categoria, tipo] = self._series[chave]
+        novas = len(self._chaves_series) - self._totais.shape[0]
+        if novas:
+            self._totais = np.concatenate([self._totais, np.zeros((novas, 3))])
+            self._fenwick = np.concatenate([self._fenwick, np.zeros(self._fenwick.shape[:2] + (novas,))], axis=2)
+        return colunas[categorias, tipos]
+
+    def _acumulados(self, posicoes):
+        """Somas e contagens acumuladas até cada posição (0..n), por série: O(len(posicoes) x log n)."""
+        posicoes = np.array(posicoes, dtype=np.int64)
+        acumulados = np.zeros((len(posicoes),) + self._fenwick.shape[1:])
+        ativas = posicoes > 0
+        while ativas.any():
+            acumulados[ativas] += self._fenwick[posicoes[ativas]]
+            posicoes[ativas] -= posicoes[ativas] & -posicoes[ativas]
+            ativas = posicoes > 0
+        return acumulados
+
+    @staticmethod
+    def _fenwick_de_diarios(diarios):
+        # Nó i guarda a soma dos dias (i - i & -i, i]: diferença de duas somas acumuladas
+        acumulados = np.concatenate([np.zeros((1,) + diarios.shape[1:]), np.cumsum(diarios, axis=0)])
+        posicoes = np.arange(1, len(acumulados))
+        arvore = np.zeros_like(acumulados)
+        arvore[1:] = acumulados[posicoes] - acumulados[posicoes - (posicoes & -posicoes)]
+        return arvore
+
+    def _garantir_dominio(self, primeiro, ultimo):
+        """Estende os dias cobertos pelas árvores (com FOLGA_DIAS de sobra) e as refaz, se preciso."""
+        n = self._fenwick.shape[0] - 1
+        if n and self._dia_base <= primeiro and ultimo < self._dia_base + n:
+            return
+        base = primeiro - FOLGA_DIAS if not n or primeiro < self._dia_base else self._dia_base
+        fim = ultimo + FOLGA_DIAS if not n or ultimo >= self._dia_base + n else self._dia_base + n - 1
+        diarios = np.zeros((fim - base + 1,) + self._fenwick.shape[1:])
+        if n:
+            deslocamento = self._dia_base - base
+            diarios[deslocamento:deslocamento + n] = np.diff(self._acumulados(np.arange(n + 1)), axis=0)
+        self._fenwick = self._fenwick_de_diarios(diarios)
+        self._dia_base = base
+
+    def _atualizar_fenwick(self, dias, series, somas, contagens):
+        if not len(dias):
+            return
+        primeiro, ultimo = int(dias.min()), int(dias.max())
+        self._garantir_dominio(primeiro, ultimo)
+        self._primeiro_dia = primeiro if self._primeiro_dia is None else min(self._primeiro_dia, primeiro)
+        self._ultimo_dia = ultimo if self._ultimo_dia is None else max(self._ultimo_dia, ultimo)
+        n = self._fenwick.shape[0] - 1
+        posicoes = dias - self._dia_base + 1
+        # Sobe todas as células juntas, um nível da árvore por iteração: O(log n) iterações
+        while len(posicoes):
+            np.add.at(self._fenwick[:, 0, :], (posicoes, series), somas)
+            np.add.at(self._fenwick[:, 1, :], (posicoes, series), contagens)
+            posicoes = posicoes + (posicoes & -posicoes)
+            dentro = posicoes <= n
+            posicoes, series, somas, contagens = posicoes[dentro], series[dentro], somas[dentro], contagens[dentro]
+
+    def _posicao(self, dia):
+        """Posição na árvore do último dia <= dia (0 se anterior ao domínio)."""
+        return int(np.clip(dia - self._dia_base + 1, 0, self._fenwick.shape[0] - 1))
+
+    @staticmethod
+    def _dia(data):
+        return int(np.datetime64(pd.Timestamp(data), "D").astype("int64"))
+
+    # ---------- Consultas ----------
+    def __len__(self):
+        """Número de séries (Categoria x Tipo) no cubo."""
+        return len(self._chaves_series)
+
+    def memoria_bytes(self):
+        """Estimativa do espaço ocupado pelas árvores, pelos totais e pelo índice das séries."""
+        return (self._fenwick.nbytes + self._totais.nbytes
+                + sys.getsizeof(self._series) + sys.getsizeof(self._chaves_series))
+
+    def _intervalo(self, inicio=None, fim=None):
+        """(somas, contagens) por série dos registros no intervalo [inicio, fim] (dias inteiros).
+        Sem nenhum limite, inclui os registros sem data."""
+        if inicio is None and fim is None:
+            return self._totais[:, 0], self._totais[:, 1]
+        n = self._fenwick.shape[0] - 1
+        ate = n if fim is None else self._posicao(self._dia(pd.Timestamp(fim).floor("D")))
+        antes = 0 if inicio is None else self._posicao(self._dia(pd.Timestamp(inicio).ceil("D")) - 1)
+        if ate <= antes:
+            return np.zeros(len(self._chaves_series)), np.zeros(len(self._chaves_series))
+        acumulados = self._acumulados([ate, antes])
+        return acumulados[0, 0] - acumulados[1, 0], acumulados[0, 1] - acumulados[1, 1]
+
+    def _colunas_categoria(self, tipo=None):
+        """Colunas das séries com categoria (e do tipo pedido) e a categoria de cada uma."""
+        colunas = [coluna for coluna, (categoria, tipo_serie) in enumerate(self._chaves_series)
+                   if categoria is not None and (tipo is None or tipo_serie == tipo)]
+        return colunas, [self._chaves_series[coluna][0] for coluna in colunas]
+
+    def totais_por_categoria(self, inicio=None, fim=None, tipo=None):
+        """Soma de Valor por Categoria no intervalo [inicio, fim] (dias inteiros), em ordem decrescente."""
+        somas, contagens = self._intervalo(inicio, fim)
+        totais = {}
+        for coluna, categoria in zip(*self._colunas_categoria(tipo)):
+            # Contagem acumulada em float: > 0.5 = ao menos um registro no intervalo
+            if contagens[coluna] > 0.5:
+                totais[categoria] = totais.get(categoria, 0.0) + float(somas[coluna])
+        totais = pd.Series(dict(sorted(totais.items(), key=lambda item: str(item[0]))), dtype="float64", name="Valor")
+        totais.index.name = "Categoria"
+        return totais.round(2).sort_values(ascending=False)
+
+    def tendencia_mensal(self, inicio=None, fim=None, tipo=None):
+        """Soma de Valor por mês e Categoria no intervalo [inicio, fim] (ver tabela_mensal()):
+        duas somas acumuladas por mês, O(meses x séries x log dias)."""
+        if self._primeiro_dia is None:
+            return tabela_mensal({}, inicio, fim)
+        primeiro = pd.Timestamp(inicio).ceil("D") if inicio is not None else _data_do_dia(self._primeiro_dia)
+        ultimo = pd.Timestamp(fim).floor("D") if fim is not None else _data_do_dia(self._ultimo_dia)
+        meses = meses_do_intervalo(primeiro, ultimo)
+        if meses.empty:
+            return tabela_mensal({}, inicio, fim)
+        # Somas acumuladas até a véspera do intervalo e até o último dia de cada mês
+        fins = [min(mes + pd.offsets.MonthEnd(0), ultimo) for mes in meses]
+        posicoes = [self._posicao(self._dia(primeiro) - 1)] + [self._posicao(self._dia(dia)) for dia in fins]
+        por_mes = np.diff(self._acumulados(posicoes), axis=0)
+        totais = {}
+        for coluna, categoria in zip(*self._colunas_categoria(tipo)):
+            for mes, soma, contagem in zip(meses, por_mes[:, 0, coluna], por_mes[:, 1, coluna]):
+                if contagem > 0.5:
+                    totais[(mes, categoria)] = totais.get((mes, categoria), 0.0) + float(soma)
+        return tabela_mensal(totais, inicio, fim)
+
+    def estatisticas(self, categorias=None):
+        """Quantidade, soma, média e desvio padrão de Valor (opcionalmente só das categorias dadas)."""
+        colunas = [coluna for coluna, (categoria, _) in enumerate(self._chaves_series)
+                   if not categorias or categoria in categorias]
+        soma, contagem, soma_quadrados = self._totais[colunas].sum(axis=0)
+        return estatisticas_de_somas(round(contagem), soma, soma_quadrados)
+
+
+def _data_do_dia(dia):
+    return pd.Timestamp(np.datetime64(dia, "D"))
+
+
+def meses_do_intervalo(inicio, fim):
+    """Primeiro dia de cada mês que cruza [inicio, fim]."""
+    return pd.date_range(pd.Timestamp(inicio).to_period("M").to_timestamp(), fim, freq="MS", name="Mês")
+
+
+def tabela_mensal(totais, inicio=None, fim=None):
+    """Tendência mensal a partir de {(início do mês, categoria): soma}: um mês por linha (de inicio
+    a fim; sem limite, do primeiro ao último mês com registros, incluindo meses vazios no meio) e
+    uma categoria por coluna, em ordem decrescente de total."""
+    meses_com_registros = sorted({mes for mes, _ in totais})
+    if inicio is None or fim is None:
+        if not meses_com_registros:
+            return pd.DataFrame(index=pd.DatetimeIndex([], name="Mês"), dtype="float64")
+        inicio = inicio if inicio is not None else meses_com_registros[0]
+        fim = fim if fim is not None else meses_com_registros[-1]
+    meses = meses_do_intervalo(pd.Timestamp(inicio).ceil("D"), pd.Timestamp(fim).floor("D"))
+    if not totais:
+        return pd.DataFrame(index=meses, dtype="float64")
+    tabela = pd.Series(totais, dtype="float64").unstack(fill_value=0.0).reindex(meses, fill_value=0.0)
+    tabela = tabela[tabela.sum().sort_values(ascending=False, kind="stable").index]
+    tabela.index.name = "Mês"
+    tabela.columns.name = "Categoria"
+    return tabela.round(2)
+
+
+def estatisticas_de_somas(registros, soma, soma_quadrados=None):
+    """Média e desvio padrão (amostral) a partir de contagem, soma e soma dos quadrados."""
+    registros = int(registros)
+    soma = round(float(soma), 2)
+    media = soma / registros if registros else 0.0
+    desvio = None
+    if soma_quadrados is not None and registros > 1:
+        desvio = float(np.sqrt(max(float(soma_quadrados) - soma * soma / registros, 0.0) / (registros - 1)))
+    return {"registros": registros, "soma": soma, "media": media, "desvio": desvio}
@@ -0,0 +1,444 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from armazenamento import FORMATO_DATA, obter_repositorio
+from exportacao import FORMATOS, TAMANHO_BLOCO, exportar, nome_exportacao
+from importacao import COLUNAS_OBRIGATORIAS, exportacao_do_banco, normalizar_registros
+from log_estruturado import StructuredLogger
+from telemetria import get_or_create_counter, get_or_create_histogram
+
+CSV_FILE = os.getenv("DESPESAS_CSV", "despesas_br.csv")
+CORPO_MAX = int(os.getenv("API_CORPO_MAX", str(10 * 1024 * 1024)))
+POR_PAGINA_MAX = 1000
+ORDENACOES = {"Data", "Valor", "Categoria", "Descrição", "Tipo"}
+
+requisicoes_api = get_or_create_counter('api_requisicoes_total', 'Requisições recebidas pela API', ['rota', 'status'])
+duracao_api = get_or_create_histogram('api_requisicao_duracao_segundos', 'Tempo de resposta da API', ['rota'])
+lote_gravacao_api = get_or_create_histogram('api_lote_gravacao_registros', 'Registros por gravação agrupada',
+                                            buckets=(1, 10, 50, 100, 500, 1000, 5000, 10000, 50000))
+
+logger = StructuredLogger(__name__, contexto={"service": os.getenv("DD_SERVICE", "gerenciador-despesas"),
+                                              "componente": "api"})
+
+
+class ErroRequisicao(Exception):
+    def __init__(self, status, mensagem):
+        super().__init__(mensagem)
+        self.status = status
+
+
+class RespostaEmBlocos:
+    """Corpo enviado com Transfer-Encoding: chunked a partir de um gerador síncrono de bytes; cada
+    bloco é produzido fora do loop de eventos."""
+
+    def __init__(self, partes, tipo, nome_arquivo=None):
+        self.partes = partes
+        self.tipo = tipo
+        self.nome_arquivo = nome_arquivo
+
+
+class AgrupadorGravacoes:
+    """Junta os lotes que chegam enquanto uma gravação está em andamento em uma única gravação.
+
+    Cada lote é validado (normalizar_registros) separadamente, fora do loop de eventos, antes de
+    entrar no grupo: um lote que não pode ser validado recusa só a sua requisição. Os registros
+    válidos de todos os lotes agrupados são gravados com um único anexar_lote. Sob carga, milhares
+    de pequenos lotes viram poucas gravações (um fsync e uma atualização dos agregados cada).
+    """
+
+    def __init__(self, repositorio, janela=0.002):
+        self.repositorio = repositorio
+        self.janela = janela
+        self._pendentes = []
+        self._evento = asyncio.Event()
+
+    async def gravar(self, registros):
+        """Retorna (gravados, [(posição no lote, motivo), ...]); ErroRequisicao(400) se o lote for inválido."""
+        validos, erros = await asyncio.to_thread(self._validar, registros)
+        if not validos:
+            return 0, erros
+        futuro = asyncio.get_running_loop().create_future()
+        self._pendentes.append((validos, futuro))
+        self._evento.set()
+        await futuro
+        return len(validos), erros
+
+    async def executar(self):
+        while True:
+            await self._evento.wait()
+            if self.janela:
+                # Dá tempo para outros lotes chegarem antes de gravar
+                await asyncio.sleep(self.janela)
+            self._evento.clear()
+            pedidos, self._pendentes = self._pendentes, []
+            try:
+                await asyncio.to_thread(self._gravar, [registro for validos, _ in pedidos for registro in validos])
+            except Exception as e:
+                # Falha da gravação em si (os lotes já foram validados): nenhum registro do grupo foi gravado
+                logger.error("Erro ao gravar lote da API: %s", e, requisicoes=len(pedidos))
+                for _, futuro in pedidos:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                continue
+            for _, futuro in pedidos:
+                if not futuro.done():
+                    futuro.set_result(None)
+
+    @staticmethod
+    def _validar(registros):
+        # Exportações do banco são convertidas dentro de normalizar_registros
+        try:
+            validos, erros = normalizar_registros(pd.DataFrame(registros))
+        except Exception as e:
+            raise ErroRequisicao(400, f"Lote inválido: {e}")
+        # normalizar_registros numera como linhas de arquivo, a partir de 2
+        return validos.to_dict("records"), [(linha - 2, motivo) for linha, motivo in erros]
+
+    def _gravar(self, registros):
+        self.repositorio.anexar_lote(registros)
+        lote_gravacao_api.observe(len(registros))
+
+
+def _data(texto, nome):
+    if not texto:
+        return None
+    for formato in (FORMATO_DATA, "%Y-%m-%d"):
+        try:
+            return pd.to_datetime(texto, format=formato)
+        except ValueError:
+            pass
+    raise ErroRequisicao(400, f"Parâmetro '{nome}' deve estar em dd/mm/aaaa ou aaaa-mm-dd")
+
+
+def _tamanho_corpo(texto):
+    """Content-Length como inteiro não negativo (0 se ausente); None se o cabeçalho for inválido."""
+    texto = texto.strip()
+    if not texto:
+        return 0
+    if not (texto.isascii() and texto.isdigit()):
+        return None
+    return int(texto)
+
+
+def _texto(valor):
+    return None if pd.isna(valor) else str(valor)
+
+
+def _inteiro(parametros, nome, padrao, minimo=1, maximo=None):
+    try:
+        valor = int(parametros.get(nome, [padrao])[0])
+    except ValueError:
+        raise ErroRequisicao(400, f"Parâmetro '{nome}' deve ser um número inteiro")
+    if valor < minimo or (maximo is not None and valor > maximo):
+        raise ErroRequisicao(400, f"Parâmetro '{nome}' fora do intervalo permitido")
+    return valor
+
+
+class ApiDespesas:
+    """Rotas JSON sobre o mesmo repositório (armazenamento, diário e agregados) usado pelo app.py."""
+
+    def __init__(self, repositorio, janela_gravacao=0.002):
+        self.repositorio = repositorio
+        self.agrupador = AgrupadorGravacoes(repositorio, janela_gravacao)
+        self.rotas = {
+            ("GET", "/saude"): self.saude,
+            ("GET", "/metrics"): self.metricas,
+            ("POST", "/registros"): self.inserir,
+            ("GET", "/registros"): self.listar,
+            ("GET", "/resumo"): self.resumo,
+            ("GET", "/tendencia"): self.tendencia,
+            ("GET", "/exportar"): self.exportar,
+        }
+
+    async def saude(self, parametros, corpo):
+        return 200, {"status": "ok"}
+
+    async def metricas(self, parametros, corpo):
+        return 200, generate_latest()
+
+    async def inserir(self, parametros, corpo):
+        """Aceita uma lista de registros ou {"registros": [...]}; grava os válidos e devolve os erros por posição."""
+        try:
+            dados = json.loads(corpo or b"null")
+        except ValueError:
+            raise ErroRequisicao(400, "Corpo não é um JSON válido")
+        if isinstance(dados, dict):
+            dados = dados.get("registros")
+        if not isinstance(dados, list) or not all(isinstance(registro, dict) for registro in dados):
+            raise ErroRequisicao(400, "Esperada uma lista de registros")
+        if not dados:
+            return 200, {"gravados": 0, "invalidos": 0, "erros": []}
+        colunas = set().union(*dados)
+        if not exportacao_do_banco(colunas):
+            faltantes = [coluna for coluna in COLUNAS_OBRIGATORIAS if coluna not in colunas]
+            if faltantes:
+                raise ErroRequisicao(400, "Colunas obrigatórias ausentes: " + ", ".join(faltantes))
+        gravados, erros = await self.agrupador.gravar(dados)
+        return 200, {"gravados": gravados, "invalidos": len(erros),
+                     "erros": [{"posicao": posicao, "motivo": motivo} for posicao, motivo in erros[:100]]}
+
+    @staticmethod
+    def _selecao(parametros):
+        """(categorias, ordenação, busca) dos parâmetros de GET /registros e GET /exportar."""
+        ordenar = parametros.get("ordenar", ["Data"])[0]
+        if ordenar not in ORDENACOES:
+            raise ErroRequisicao(400, "Parâmetro 'ordenar' deve ser uma das colunas: " + ", ".join(sorted(ORDENACOES)))
+        ascendente = parametros.get("ascendente", ["0"])[0] in ("1", "true")
+        return parametros.get("categoria") or None, (ordenar, ascendente), parametros.get("busca", [""])[0]
+
+    async def listar(self, parametros, corpo):
+        pagina = _inteiro(parametros, "pagina", 1)
+        por_pagina = _inteiro(parametros, "por_pagina", 50, maximo=POR_PAGINA_MAX)
+        categorias, ordenacao, busca = self._selecao(parametros)
+
+        df, total = await asyncio.to_thread(self.repositorio.pagina_registros, categorias,
+                                            ordenacao, pagina, por_pagina, busca)
+        registros = [{
+            "Data": data.strftime(FORMATO_DATA) if not pd.isna(data) else None,
+            "Descrição": _texto(descricao),
+            "Categoria": _texto(categoria),
+            "Valor": round(float(valor), 2) if not pd.isna(valor) else None,
+            "Tipo": _texto(tipo),
+        } for data, descricao, categoria, valor, tipo in zip(
+            df["Data"], df["Descrição"], df["Categoria"], df["Valor"], df["Tipo"])]
+        return 200, {"total": total, "pagina": pagina, "por_pagina": por_pagina, "registros": registros}
+
+    async def resumo(self, parametros, corpo):
+        """Totais por tipo e por categoria no período [inicio, fim] (datas inclusivas; sem datas, tudo)."""
+        inicio = _data(parametros.get("inicio", [None])[0], "inicio")
+        fim = _data(parametros.get("fim", [None])[0], "fim")
+        categorias = set(parametros.get("categoria", []))
+
+        def calcular():
+            por_tipo = {}
+            for tipo in ("Despesa", "Receita"):
+                totais = self.repositorio.totais_por_categoria(inicio, fim, tipo)
+                if categorias:
+                    totais = totais[totais.index.isin(categorias)]
+                por_tipo[tipo] = {str(categoria): round(float(valor), 2) for categoria, valor in totais.items()}
+            return por_tipo
+
+        por_tipo = await asyncio.to_thread(calcular)
+        total_despesas = round(sum(por_tipo["Despesa"].values()), 2)
+        total_receitas = round(sum(por_tipo["Receita"].values()), 2)
+        return 200, {
+            "inicio": inicio.strftime(FORMATO_DATA) if inicio is not None else None,
+            "fim": fim.strftime(FORMATO_DATA) if fim is not None else None,
+            "total_despesas": total_despesas,
+            "total_receitas": total_receitas,
+            "saldo": round(total_receitas - total_despesas, 2),
+            "despesas_por_categoria": por_tipo["Despesa"],
+            "receitas_por_categoria": por_tipo["Receita"],
+        }
+
+    async def tendencia(self, parametros, corpo):
+        """Totais por mês e categoria no período [inicio, fim] (sem datas, do primeiro ao último mês com registros)."""
+        inicio = _data(parametros.get("inicio", [None])[0], "inicio")
+        fim = _data(parametros.get("fim", [None])[0], "fim")
+        tipo = parametros.get("tipo", ["Despesa"])[0]
+        if tipo not in ("Despesa", "Receita"):
+            raise ErroRequisicao(400, "Parâmetro 'tipo' deve ser Despesa ou Receita")
+
+        tabela = await asyncio.to_thread(self.repositorio.tendencia_mensal, inicio, fim, tipo)
+        return 200, {
+            "tipo": tipo,
+            "meses": [mes.strftime("%Y-%m") for mes in tabela.index],
+            "categorias": {str(categoria): [round(float(valor), 2) for valor in tabela[categoria]]
+                           for categoria in tabela.columns},
+        }
+
+    async def exportar(self, parametros, corpo):
+        """A seleção inteira de GET /registros (sem paginação) em CSV ou Parquet, enviada em blocos."""
+        formato = parametros.get("formato", ["csv"])[0]
+        if formato not in FORMATOS:
+            raise ErroRequisicao(400, "Parâmetro 'formato' deve ser um de: " + ", ".join(FORMATOS))
+        categorias, ordenacao, busca = self._selecao(parametros)
+        blocos = self.repositorio.blocos_registros(categorias, ordenacao, busca, TAMANHO_BLOCO)
+        return 200, RespostaEmBlocos(exportar(blocos, formato, "api"), FORMATOS[formato][0], nome_exportacao(formato))
+
+    # ---------- HTTP/1.1 mínimo (keep-alive, Content-Length) ----------
+    async def atender(self, leitor, escritor):
+        try:
+            while True:
+                try:
+                    cabecalho = await leitor.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    return
+                linhas = cabecalho.decode("latin-1").split("\r\n")
+                try:
+                    # Clientes mandam a query em UTF-8 sem codificar (?busca=metrô); %XX também é lido como UTF-8
+                    metodo, alvo, versao = linhas[0].encode("latin-1").decode("utf-8", "replace").split(" ", 2)
+                except ValueError:
+                    return
+                cabecalhos = {}
+                for linha in linhas[1:]:
+                    nome, _, valor = linha.partition(":")
+                    if nome:
+                        cabecalhos[nome.strip().lower()] = valor.strip()
+                tamanho = _tamanho_corpo(cabecalhos.get("content-length", ""))
+                if tamanho is None:
+                    await self._responder(escritor, 400, {"erro": "Content-Length inválido"}, False)
+                    return
+                if tamanho > CORPO_MAX:
+                    await self._responder(escritor, 413, {"erro": "Corpo da requisição muito grande"}, False)
+                    return
+                corpo = await leitor.readexactly(tamanho) if tamanho else b""
+                manter = cabecalhos.get("connection", "").lower() != "close" and versao == "HTTP/1.1"
+                status, resposta = await self._processar(metodo, alvo, corpo)
+                manter = await self._responder(escritor, status, resposta, manter)
+                if not manter:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            escritor.close()
+
+    async def _processar(self, metodo, alvo, corpo):
+        url = urlsplit(alvo)
+        rota = self.rotas.get((metodo, url.path))
+        nome_rota = url.path if any(caminho == url.path for _, caminho in self.rotas) else "desconhecida"
+        inicio = time.perf_counter()
+        try:
+            if rota is None:
+                if nome_rota != "desconhecida":
+                    raise ErroRequisicao(405, "Método não permitido")
+                raise ErroRequisicao(404, "Rota não encontrada")
+            status, resposta = await rota(parse_qs(url.query), corpo)
+        except ErroRequisicao as e:
+            status, resposta = e.status, {"erro": str(e)}
+        except Exception as e:
+            logger.error("Erro na API em %s %s: %s", metodo, url.path, e)
+            status, resposta = 500, {"erro": "Erro interno"}
+        requisicoes_api.labels(rota=nome_rota, status=str(status)).inc()
+        duracao_api.labels(rota=nome_rota).observe(time.perf_counter() - inicio)
+        return status, resposta
+
+    @staticmethod
+    async def _responder(escritor, status, resposta, manter):
+        """Envia a resposta; retorna se a conexão pode continuar aberta."""
+        if isinstance(resposta, RespostaEmBlocos):
+            return await ApiDespesas._responder_em_blocos(escritor, status, resposta, manter)
+        if isinstance(resposta, bytes):
+            corpo, tipo = resposta, CONTENT_TYPE_LATEST
+        else:
+            corpo, tipo = json.dumps(resposta, ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8"
+        razoes = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                  413: "Payload Too Large", 500: "Internal Server Error"}
+        escritor.write((f"HTTP/1.1 {status} {razoes.get(status, '')}\r\n"
+                        f"Content-Type: {tipo}\r\nContent-Length: {len(corpo)}\r\n"
+                        f"Connection: {'keep-alive' if manter else 'close'}\r\n\r\n").encode("latin-1") + corpo)
+        await escritor.drain()
+        return manter
+
+    @staticmethod
+    async def _responder_em_blocos(escritor, status, resposta, manter):
+        disposicao = f"Content-Disposition: attachment; filename=\"{resposta.nome_arquivo}\"\r\n" \
+            if resposta.nome_arquivo else ""
+        escritor.write((f"HTTP/1.1 {status} OK\r\nContent-Type: {resposta.tipo}\r\n{disposicao}"
+                        f"Transfer-Encoding: chunked\r\n"
+                        f"Connection: {'keep-alive' if manter else 'close'}\r\n\r\n").encode("latin-1"))
+        try:
+            while True:
+                # Leitura do armazenamento e serialização fora do loop; drain() segura o próximo
+                # bloco até o cliente consumir o anterior, então só um bloco fica em memória
+                parte = await asyncio.to_thread(next, resposta.partes, None)
+                if parte is None:
+                    break
+                if parte:
+                    escritor.write(f"{len(parte):X}\r\n".encode("latin-1") + parte + b"\r\n")
+                    await escritor.drain()
+        except ConnectionError:
+            raise
+        except Exception as e:
+            # O status já foi enviado: sem o bloco final, o cliente vê a resposta incompleta
+            logger.error("Erro durante a exportação em blocos: %s", e)
+            return False
+        finally:
+            resposta.partes.close()
+        escritor.write(b"0\r\n\r\n")
+        await escritor.drain()
+        return manter
+
+
+async def servir(host, porta, janela_gravacao):
+    api = ApiDespesas(obter_repositorio(CSV_FILE, logger=logger), janela_gravacao)
+    # Carrega dados e agregados antes de aceitar conexões
+    await asyncio.to_thread(api.repositorio.obter_agregados)
+    gravacoes = asyncio.create_task(api.agrupador.executar())
+    servidor = await asyncio.start_server(api.atender, host, porta, backlog=1024)
+    logger.info("API iniciada em %s:%d", host, porta, csv=CSV_FILE)
+    async with servidor:
+        try:
+            await servidor.serve_forever()
+        finally:
+            gravacoes.cancel()
+
+
+# ========== Teste de carga local ==========
+async def _cliente_carga(host, porta, requisicoes, lote, latencias, contador):
+    leitor, escritor = await asyncio.open_connection(host, porta)
+    try:
+        for _ in range(requisicoes):
+            n = contador[0]
+            contador[0] += lote
+            corpo = json.dumps([{"Data": "01/01/2024", "Descrição": f"Carga {n + i}", "Categoria": "Outros",
+                                 "Valor": 1 + (n + i) % 100, "Tipo": "Despesa"} for i in range(lote)]).encode("utf-8")
+            inicio = time.perf_counter()
+            escritor.write(f"POST /registros HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                           f"Content-Length: {len(corpo)}\r\n\r\n".encode("latin-1") + corpo)
+            await escritor.drain()
+            cabecalho = await leitor.readuntil(b"\r\n\r\n")
+            tamanho = next(int(linha.split(b":", 1)[1]) for linha in cabecalho.split(b"\r\n")
+                           if linha.lower().startswith(b"content-length:"))
+            resposta = await leitor.readexactly(tamanho)
+            if not cabecalho.startswith(b"HTTP/1.1 200"):
+                raise RuntimeError(f"Resposta inesperada: {cabecalho.splitlines()[0]!r} {resposta[:200]!r}")
+            latencias.append(time.perf_counter() - inicio)
+    finally:
+        escritor.close()
+
+
+async def carga(host, porta, conexoes, requisicoes, lote):
+    """Dispara `conexoes` clientes simultâneos, cada um com `requisicoes` POSTs de `lote` registros."""
+    latencias, contador = [], [0]
+    inicio = time.perf_counter()
+    await asyncio.gather(*(_cliente_carga(host, porta, requisicoes, lote, latencias, contador)
+                           for _ in range(conexoes)))
+    duracao = time.perf_counter() - inicio
+    latencias.sort()
+    total = conexoes * requisicoes * lote
+    print(f"{total} registros em {conexoes * requisicoes} requisições e {duracao:.2f}s: "
+          f"{total / duracao:,.0f} registros/s, {conexoes * requisicoes / duracao:,.0f} requisições/s")
+    print(f"latência p50 {latencias[len(latencias) // 2] * 1000:.1f} ms, "
+          f"p99 {latencias[int(len(latencias) * 0.99)] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API JSON do Gerenciador de Despesas")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+    servidor = subcomandos.add_parser("servir", help="Iniciar a API")
+    servidor.add_argument("--host", default=os.getenv("API_HOST", "0.0.0.0"))
+    servidor.add_argument("--porta", type=int, default=int(os.getenv("API_PORTA", "8080")))
+    servidor.add_argument("--janela-gravacao-ms", type=float, default=float(os.getenv("API_JANELA_GRAVACAO_MS", "2")),
+                          help="Espera para agrupar lotes antes de cada gravação")
+    teste = subcomandos.add_parser("carga", help="Teste de carga contra uma API em execução")
+    teste.add_argument("--host", default="127.0.0.1")
+    teste.add_argument("--porta", type=int, default=int(os.getenv("API_PORTA", "8080")))
+    teste.add_argument("--conexoes", type=int, default=50)
+    teste.add_argument("--requisicoes", type=int, default=100, help="Requisições por conexão")
+    teste.add_argument("--lote", type=int, default=10, help="Registros por requisição")
+    args = parser.parse_args()
+
+    if args.comando == "servir":
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        asyncio.run(servir(args.host, args.porta, args.janela_gravacao_ms / 1000))
+    else:
+        asyncio.run(carga(args.host, args.porta, args.conexoes, args.requisicoes, args.lote))
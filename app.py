@@ -1,25 +1,28 @@
+import time
+# Marca o início da execução: na primeira execução do processo mede o custo das importações
+INICIO_SCRIPT = time.perf_counter()
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
 import os
+import functools
 from datetime import datetime
 import locale
-import numpy as np
-import time
-import threading
-import logging
-import json
+import math
 import socket
-from prometheus_client import Counter, Histogram, Gauge, Info, start_http_server, REGISTRY
-from opentelemetry import trace, metrics
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
-from opentelemetry.sdk.metrics import MeterProvider
-from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
-from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
-from opentelemetry.sdk.resources import Resource
-from opentelemetry.instrumentation.logging import LoggingInstrumentor
+from opentelemetry import trace
+from graficos import cache_graficos, gerar_analise
+from exportacao import FORMATOS, TAMANHO_BLOCO, exportar_arquivo, nome_exportacao
+from importacao import importar, ler_arquivo
+from log_estruturado import StructuredLogger
+from inquilinos import identificador_seguro, obter_gerenciador
+from metricas import ColetorAgregados, ColetorInquilinos, registrar_coletor
+from perfil import iniciar_execucao, medir_fase
+from armazenamento import COLUNAS, obter_armazenamento, obter_repositorio, repositorio_existente, tipar_dados
+from telemetria import (concluir_inicializacao, configurar_telemetria, get_or_create_counter, get_or_create_gauge,
+                        get_or_create_histogram, get_or_create_info, iniciar_servidor_metricas, registrar_fase,
+                        sanitize_otlp_endpoint, uma_vez)
+
+registrar_fase("importacoes", time.perf_counter() - INICIO_SCRIPT)
 
 # ========== Configuração de Tags Unificadas ==========
 SERVICE_NAME = os.getenv("DD_SERVICE", "gerenciador-despesas")
@@ -28,176 +31,61 @@ VERSION = os.getenv("DD_VERSION", "0.2")
 HOSTNAME = os.getenv("HOSTNAME", socket.gethostname())
 NAMESPACE = os.getenv("KUBE_NAMESPACE", "gerenciador-despesas")
 POD_NAME = os.getenv("POD_NAME", HOSTNAME)
-
-# ========== Configuração de Logging (JSON para Loki) ==========
-# Emitir sempre uma única linha JSON para stdout (facilita scraping por promtail)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(message)s",
-    handlers=[logging.StreamHandler()]
-)
-# Não deixar o LoggingInstrumentor alterar o formato do logging (evita KeyError)
-# iremos enriquecer logs manualmente
-LoggingInstrumentor().instrument(set_logging_format=False)
-
-class StructuredLogger:
-    """Logger que emite JSON com metadata + trace ids quando disponíveis."""
-    def __init__(self, name):
-        self.logger = logging.getLogger(name)
-
-    def _current_trace_fields(self):
-        try:
-            span = trace.get_current_span()
-            ctx = span.get_span_context()
-            if ctx is None:
-                return {}
-            trace_id = getattr(ctx, "trace_id", 0)
-            span_id = getattr(ctx, "span_id", 0)
-            fields = {}
-            if trace_id:
-                fields["dd.trace_id"] = format(trace_id, "032x")
-            if span_id:
-                fields["dd.span_id"] = format(span_id, "016x")
-            return fields
-        except Exception:
-            return {}
-
-    def _log(self, level, message, **kwargs):
-        # accept `extra` key to be compatible with previous calls
-        extra = kwargs.pop("extra", {})
-        if not isinstance(extra, dict):
-            extra = {}
-
-        log_data = {
-            "timestamp": datetime.utcnow().isoformat() + "Z",
-            "service": SERVICE_NAME,
-            "env": ENV_NAME,
-            "version": VERSION,
-            "pod": POD_NAME,
-            "namespace": NAMESPACE,
-            "level": level.upper(),
-            "logger": self.logger.name,
-            "message": message,
-        }
-        log_data.update(self._current_trace_fields())
-        log_data.update(extra)
-        log_data.update(kwargs)
-        # Emitir JSON (uma linha)
-        getattr(self.logger, level)(json.dumps(log_data, default=str))
-
-    def info(self, message, **kwargs):
-        self._log("info", message, **kwargs)
-
-    def error(self, message, **kwargs):
-        self._log("error", message, **kwargs)
-
-    def warning(self, message, **kwargs):
-        self._log("warning", message, **kwargs)
-
-    def debug(self, message, **kwargs):
-        self._log("debug", message, **kwargs)
-
-logger = StructuredLogger(__name__)
-
-# ========== OpenTelemetry (traces + optional metrics export via OTLP) ==========
-def sanitize_otlp_endpoint(raw: str) -> str:
-    if not raw:
-        return ""
-    # OTLP gRPC exporter expects host:port; strip scheme if present
-    if raw.startswith("http://") or raw.startswith("https://"):
-        return raw.split("://", 1)[1]
-    return raw
-
+CSV_FILE = os.getenv("DESPESAS_CSV", "despesas_br.csv")
+# "desligado": um livro para todos; "cabecalho"/"parametro": um livro por usuário, identificado pelo
+# cabeçalho do proxy de autenticação (INQUILINOS_CABECALHO) ou por ?usuario= na URL
+INQUILINOS_MODO = os.getenv("INQUILINOS_MODO", "desligado")
+INQUILINOS_CABECALHO = os.getenv("INQUILINOS_CABECALHO", "X-Forwarded-Email")
+# ?usuario= não autentica ninguém (qualquer um abre o livro de outro usuário trocando a URL): só para
+# desenvolvimento, e só com INQUILINOS_PERMITIR_PARAMETRO=1
+INQUILINOS_PERMITIR_PARAMETRO = os.getenv("INQUILINOS_PERMITIR_PARAMETRO", "0") == "1"
+INQUILINOS_DIRETORIO = os.getenv("INQUILINOS_DIRETORIO", "inquilinos")
+# Exportações da aba Registros (uma subpasta por inquilino); acima do limite não há botão de download
+EXPORTACAO_DIRETORIO = os.getenv("EXPORTACAO_DIRETORIO", "exportacoes")
+EXPORTACAO_MAX_DOWNLOAD_MB = float(os.getenv("EXPORTACAO_MAX_DOWNLOAD_MB", "200"))
+
+logger = StructuredLogger(__name__, contexto={
+    "service": SERVICE_NAME,
+    "env": ENV_NAME,
+    "version": VERSION,
+    "pod": POD_NAME,
+    "namespace": NAMESPACE,
+})
+
+# ========== Logging (JSON para Loki) e OpenTelemetry ==========
+# Configurados uma vez por processo em telemetria.py; por padrão o SDK e os exportadores OTLP
+# carregam em segundo plano (TELEMETRIA_INICIALIZACAO)
 OTLP_ENDPOINT = sanitize_otlp_endpoint(
     os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", os.getenv("OTLP_GRPC_ENDPOINT", "tempo.monitoring.svc.cluster.local:4317"))
 )
 
-if 'otel_configured' not in st.session_state:
-    try:
-        resource = Resource.create({
-            "service.name": SERVICE_NAME,
-            "service.version": VERSION,
-            "service.namespace": NAMESPACE,
-            "deployment.environment": ENV_NAME,
-            "service.instance.id": POD_NAME,
-            "host.name": HOSTNAME,
-            "k8s.namespace.name": NAMESPACE,
-            "k8s.pod.name": POD_NAME,
-            "k8s.cluster.name": os.getenv("K8S_CLUSTER_NAME", "gke-test-1"),
-            "cloud.provider": "gcp",
-            "cloud.platform": "gcp_kubernetes_engine",
-        })
-
-        # Tracing
-        trace.set_tracer_provider(TracerProvider(resource=resource))
-        if OTLP_ENDPOINT:
-            try:
-                otlp_trace_exporter = OTLPSpanExporter(endpoint=OTLP_ENDPOINT, insecure=True)
-                span_processor = BatchSpanProcessor(otlp_trace_exporter)
-                trace.get_tracer_provider().add_span_processor(span_processor)
-                logger.info("OTLP trace exporter configurado", otlp_endpoint=OTLP_ENDPOINT)
-            except Exception as e:
-                logger.warning("Falha ao configurar OTLP trace exporter, continuando sem exporter", error=str(e))
-        else:
-            logger.warning("OTLP endpoint vazio — traces serão coletados localmente sem exportação")
-
-        # Metrics (optional OTLP export); we still expose Prometheus via start_http_server
-        if OTLP_ENDPOINT:
-            try:
-                otlp_metric_exporter = OTLPMetricExporter(endpoint=OTLP_ENDPOINT, insecure=True)
-                metric_reader = PeriodicExportingMetricReader(otlp_metric_exporter)
-                metrics.set_meter_provider(MeterProvider(resource=resource, metric_readers=[metric_reader]))
-                logger.info("OTLP metric exporter configurado", otlp_endpoint=OTLP_ENDPOINT)
-            except Exception as me:
-                logger.warning("Não foi possível configurar OTLP metric exporter", error=str(me))
-
-    except Exception as e:
-        logger.error("Erro ao configurar OpenTelemetry", error=str(e))
-
-    st.session_state.otel_configured = True
+configurar_telemetria({
+    "service.name": SERVICE_NAME,
+    "service.version": VERSION,
+    "service.namespace": NAMESPACE,
+    "deployment.environment": ENV_NAME,
+    "service.instance.id": POD_NAME,
+    "host.name": HOSTNAME,
+    "k8s.namespace.name": NAMESPACE,
+    "k8s.pod.name": POD_NAME,
+    "k8s.cluster.name": os.getenv("K8S_CLUSTER_NAME", "gke-test-1"),
+    "cloud.provider": "gcp",
+    "cloud.platform": "gcp_kubernetes_engine",
+}, OTLP_ENDPOINT, logger)
 
 tracer = trace.get_tracer(__name__)
 
-# ========== Métricas Prometheus (criação segura) ==========
-def safe_get(name):
-    try:
-        return REGISTRY._names_to_collectors.get(name)
-    except Exception:
-        return None
-
-def get_or_create_counter(name, description, labelnames=None):
-    existing = safe_get(name)
-    if existing:
-        return existing
-    return Counter(name, description, labelnames or [])
-
-def get_or_create_histogram(name, description, labelnames=None):
-    existing = safe_get(name)
-    if existing:
-        return existing
-    return Histogram(name, description, labelnames or [])
-
-def get_or_create_gauge(name, description, labelnames=None):
-    existing = safe_get(name)
-    if existing:
-        return existing
-    return Gauge(name, description, labelnames or [])
-
-def get_or_create_info(name, description):
-    existing = safe_get(name)
-    if existing:
-        return existing
-    return Info(name, description)
+# Tempos por fase desta execução (execucao_fase_segundos e eventos do span execucao_script);
+# com PERFIL_AMOSTRAGEM > 0, parte das execuções também roda sob o cProfile
+execucao = iniciar_execucao(INICIO_SCRIPT)
 
+# ========== Métricas Prometheus (criação segura) ==========
 despesas_adicionadas = get_or_create_counter('despesas_adicionadas_total', 'Total de despesas adicionadas', ['categoria', 'tipo'])
 receitas_adicionadas = get_or_create_counter('receitas_adicionadas_total', 'Total de receitas adicionadas', ['categoria'])
 tempo_processamento = get_or_create_histogram('operacao_duracao_segundos', 'Tempo de processamento de operações', ['operacao'])
+registros_importados = get_or_create_counter('registros_importados_total', 'Registros processados na importação em lote', ['resultado'])
+cache_graficos_consultas = get_or_create_counter('cache_graficos_consultas_total', 'Consultas ao cache de gráficos da aba Análise', ['resultado'])
 tempo_carregamento_dados = get_or_create_histogram('carregamento_dados_segundos', 'Tempo de carregamento de dados do CSV')
-saldo_atual = get_or_create_gauge('saldo_atual_reais', 'Saldo atual em reais')
-total_despesas_gauge = get_or_create_gauge('total_despesas_reais', 'Total de despesas em reais')
-total_receitas_gauge = get_or_create_gauge('total_receitas_reais', 'Total de receitas em reais')
-registros_totais = get_or_create_gauge('registros_totais', 'Total de registros no sistema')
-registros_por_categoria = get_or_create_gauge('registros_por_categoria', 'Registros por categoria', ['categoria'])
 app_info = get_or_create_info('aplicacao', 'Informações da aplicação')
 
 try:
@@ -215,21 +103,8 @@ app_health = get_or_create_gauge('app_health', 'Status de saúde da aplicação
 app_health.set(1)
 
 # ========== Iniciar Servidor de Métricas Prometheus ==========
-def iniciar_metricas():
-    try:
-        port = int(os.getenv("METRICS_PORT", "8000"))
-        start_http_server(port)
-        logger.info("Servidor de métricas Prometheus iniciado", metrics_port=port)
-    except Exception as e:
-        logger.error("Erro ao iniciar servidor de métricas: " + str(e))
-        try:
-            app_health.set(0)
-        except Exception:
-            pass
-
-if 'metricas_iniciadas' not in st.session_state:
-    threading.Thread(target=iniciar_metricas, daemon=True).start()
-    st.session_state.metricas_iniciadas = True
+iniciar_servidor_metricas(logger, ao_falhar=lambda: app_health.set(0))
+execucao.marcar("configuracao")
 
 # ========== Configurações de locale, css e funções de negócio ==========
 try:
@@ -245,64 +120,106 @@ def load_css(css_file):
         try:
             with open(css_file, 'r') as f:
                 st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
-            logger.info(f"CSS carregado: {css_file}")
+            logger.info("CSS carregado: %s", css_file)
         except Exception as e:
-            logger.error(f"Erro ao carregar CSS: {e}")
+            logger.error("Erro ao carregar CSS: %s", e)
 
-if os.path.exists('style.css'):
-    load_css('style.css')
-else:
-    logger.warning("Arquivo style.css não encontrado")
+with medir_fase("css"):
+    if os.path.exists('style.css'):
+        load_css('style.css')
+    else:
+        logger.warning("Arquivo style.css não encontrado")
 
-def carregar_dados():
+def carregar_dados(colunas=None, caminho=CSV_FILE):
     with tracer.start_as_current_span("carregar_dados") as span:
-        csv_file = "despesas_br.csv"
         start_time = time.time()
         try:
-            if os.path.exists(csv_file):
-                df = pd.read_csv(csv_file)
-                span.set_attribute("registros_carregados", len(df))
-                logger.info(f"Dados carregados: {len(df)} registros")
-                tempo_carregamento_dados.observe(time.time() - start_time)
-                return df
-            else:
+            # O diário recupera compactações interrompidas e devolve arquivo principal + registros pendentes
+            armazenamento = obter_armazenamento(caminho, logger=logger)
+            span.set_attribute("formato", armazenamento.base.formato)
+            span.set_attribute("colunas", ",".join(colunas or COLUNAS))
+            df = armazenamento.carregar(colunas)
+            if df.empty and not armazenamento.base.existe():
                 span.set_attribute("novo_arquivo", True)
-                logger.info("Arquivo CSV não encontrado, criando novo DataFrame")
-                return pd.DataFrame(columns=["Data", "Descrição", "Categoria", "Valor", "Tipo"])
+                logger.info("Arquivo de dados não encontrado, criando novo DataFrame")
+                return df
+            span.set_attribute("registros_carregados", len(df))
+            logger.info("Dados carregados: %d registros (%s)", len(df), armazenamento.base.formato)
+            tempo_carregamento_dados.observe(time.time() - start_time)
+            return df
         except Exception as e:
-            logger.error(f"Erro ao carregar dados: {e}")
+            logger.error("Erro ao carregar dados: %s", e)
             try:
                 span.record_exception(e)
             except Exception:
                 pass
             app_health.set(0)
-            return pd.DataFrame(columns=["Data", "Descrição", "Categoria", "Valor", "Tipo"])
-
-def calcular_metricas(df):
+            return tipar_dados(pd.DataFrame(columns=COLUNAS), colunas)
+
+def obter_repositorio_dados(inquilino=None):
+    """Repositório único do processo (ou do inquilino, com INQUILINOS_MODO): carrega os dados uma vez
+    e é compartilhado entre as sessões"""
+    if INQUILINOS_MODO == "desligado":
+        return obter_repositorio(CSV_FILE, carregador=carregar_dados, logger=logger)
+    return gerenciador_inquilinos.obter(inquilino)
+
+def obter_inquilino():
+    """Usuário da sessão: cabeçalho definido pelo proxy de autenticação ou parâmetro ?usuario= da URL
+    (este só com INQUILINOS_PERMITIR_PARAMETRO=1; vazio nos demais casos)"""
+    if INQUILINOS_MODO == "cabecalho":
+        from streamlit.web.server.websocket_headers import _get_websocket_headers
+        return ((_get_websocket_headers() or {}).get(INQUILINOS_CABECALHO) or "").strip()
+    if not INQUILINOS_PERMITIR_PARAMETRO:
+        return ""
+    if uma_vez("aviso_inquilinos_parametro"):
+        logger.warning("INQUILINOS_MODO=parametro: usuários identificados por ?usuario= sem autenticação; "
+                       "use só em desenvolvimento")
+    return st.query_params.get("usuario", "").strip()
+
+if INQUILINOS_MODO == "desligado":
+    # Saldo, totais e contagens por categoria: lidos do repositório quando /metrics é coletado
+    registrar_coletor(ColetorAgregados(functools.partial(repositorio_existente, CSV_FILE)))
+else:
+    # Só os inquilinos ativos ficam em memória (LRU limitado por quantidade e memória estimada)
+    gerenciador_inquilinos = obter_gerenciador(INQUILINOS_DIRETORIO, os.path.basename(CSV_FILE),
+                                               carregador=carregar_dados, logger=logger)
+    registrar_coletor(ColetorInquilinos(gerenciador_inquilinos))
+
+def intervalo_periodo(periodo, hoje=None, datas=None):
+    """Converte o período da aba Análise em (inicio, fim), datas inclusivas; None = sem limite.
+    Em "Personalizado", datas é o que o st.date_input devolveu (uma ou duas datas)"""
+    hoje = hoje if hoje is not None else pd.Timestamp.now()
+    if periodo == "Personalizado" and datas:
+        # Enquanto o usuário escolhe o intervalo, o seletor devolve só a data inicial
+        inicio, fim = pd.Timestamp(datas[0]), pd.Timestamp(datas[-1])
+        return min(inicio, fim), max(inicio, fim)
+    if periodo == "Este Mês":
+        inicio = hoje.normalize().replace(day=1)
+        return inicio, inicio + pd.offsets.MonthEnd(0)
+    if periodo == "Últimos 3 Meses":
+        return hoje - pd.DateOffset(months=3), hoje
+    return None, None
+
+def calcular_metricas(agregados):
+    """Lê os totais do estado agregado incremental (sem varrer o DataFrame); os gauges do
+    Prometheus são lidos do mesmo estado pelo ColetorAgregados, só no scrape"""
     with tracer.start_as_current_span("calcular_metricas") as span:
         start_time = time.time()
         try:
-            total_despesas = df[df['Tipo'] == 'Despesa']['Valor'].sum() if 'Tipo' in df.columns else 0.0
-            total_receitas = df[df['Tipo'] == 'Receita']['Valor'].sum() if 'Tipo' in df.columns else 0.0
-            saldo = float(total_receitas) - float(total_despesas)
-            total_despesas_gauge.set(float(total_despesas))
-            total_receitas_gauge.set(float(total_receitas))
-            saldo_atual.set(float(saldo))
-            registros_totais.set(len(df))
-            if not df.empty and 'Categoria' in df.columns:
-                categorias = df.groupby('Categoria').size()
-                for categoria, count in categorias.items():
-                    registros_por_categoria.labels(categoria=categoria).set(int(count))
+            total_despesas = agregados.total_despesas
+            total_receitas = agregados.total_receitas
+            saldo = agregados.saldo
             span.set_attribute("total_despesas", float(total_despesas))
             span.set_attribute("total_receitas", float(total_receitas))
             span.set_attribute("saldo", float(saldo))
-            span.set_attribute("total_registros", len(df))
+            span.set_attribute("total_registros", agregados.total_registros)
             duracao = time.time() - start_time
             tempo_processamento.labels(operacao='calcular_metricas').observe(duracao)
-            logger.info(f"Métricas calculadas - Despesas: R$ {float(total_despesas):.2f}, Receitas: R$ {float(total_receitas):.2f}, Saldo: R$ {float(saldo):.2f}")
+            logger.info("Métricas calculadas - Despesas: R$ %.2f, Receitas: R$ %.2f, Saldo: R$ %.2f",
+                        float(total_despesas), float(total_receitas), float(saldo))
             return float(total_despesas), float(total_receitas), float(saldo)
         except Exception as e:
-            logger.error(f"Erro ao calcular métricas: {e}")
+            logger.error("Erro ao calcular métricas: %s", e)
             try:
                 span.record_exception(e)
             except Exception:
@@ -342,25 +259,39 @@ def exibir_metricas(total_despesas, total_receitas, saldo, container=None):
             """, unsafe_allow_html=True)
 
 # ========== Streamlit UI (mantido) ==========
-if 'data' not in st.session_state:
-    st.session_state.data = carregar_dados()
+inquilino = obter_inquilino() if INQUILINOS_MODO != "desligado" else None
+if INQUILINOS_MODO != "desligado" and not inquilino:
+    st.title("💸 Gerenciador Inteligente de Despesas")
+    if INQUILINOS_MODO == "cabecalho":
+        st.error(f"Usuário não identificado: o cabeçalho {INQUILINOS_CABECALHO} não foi enviado pelo proxy.")
+    elif not INQUILINOS_PERMITIR_PARAMETRO:
+        st.error("INQUILINOS_MODO=parametro não autentica os usuários e está desativado. Use "
+                 "INQUILINOS_MODO=cabecalho atrás de um proxy de autenticação, ou defina "
+                 "INQUILINOS_PERMITIR_PARAMETRO=1 em desenvolvimento.")
+    else:
+        st.info("Abra o aplicativo com ?usuario=<seu usuário> na URL para acessar seu livro de despesas.")
+    st.stop()
+
+# Repositório compartilhado (inclui registros de outras sessões do mesmo livro); as abas consultam por ele
+with medir_fase("carregar_dados"):
+    repositorio = obter_repositorio_dados(inquilino)
+    sem_registros = repositorio.obter_agregados().total_registros == 0
 
 if 'dados_atualizados' not in st.session_state:
     st.session_state.dados_atualizados = False
 
 st.title("💸 Gerenciador Inteligente de Despesas")
 metricas_container = st.container()
-total_despesas, total_receitas, saldo = calcular_metricas(st.session_state.data)
+with medir_fase("metricas"):
+    total_despesas, total_receitas, saldo = calcular_metricas(repositorio.obter_agregados())
 
-with metricas_container:
-    if not st.session_state.data.empty:
-        exibir_metricas(total_despesas, total_receitas, saldo)
+    with metricas_container:
+        if not sem_registros:
+            exibir_metricas(total_despesas, total_receitas, saldo)
 
 # ========== Abas principais ==========
-tab1, tab2, tab3 = st.tabs(["📝 Nova Despesa", "📊 Análise", "📋 Registros"])
-
 # === Aba de Nova Despesa ===
-with tab1:
+def exibir_nova_despesa():
     st.markdown('<div class="form-card">', unsafe_allow_html=True)
     
     with st.form("expense_form", clear_on_submit=True):
@@ -376,8 +307,9 @@ with tab1:
         
         # Categorias padrão
         categorias = ["Alimentação", "Transporte", "Entretenimento", "Serviços", "Compras", "Outros"]
-        if 'Categoria' in st.session_state.data.columns and not st.session_state.data.empty:
-            categorias = sorted(list(set(categorias + st.session_state.data['Categoria'].unique().tolist())))
+        if not sem_registros:
+            # Categorias vêm dos agregados, sem varrer as linhas
+            categorias = sorted(set(categorias + repositorio.categorias()))
         
         category = st.selectbox("Categoria", options=categorias)
 
@@ -399,11 +331,10 @@ with tab1:
                         "Tipo": tipo
                     }
                     
-                    # Adicionar ao DataFrame
-                    st.session_state.data = pd.concat([st.session_state.data, pd.DataFrame([new_entry])], ignore_index=True)
-                    
-                    # Salvar no CSV
-                    st.session_state.data.to_csv("despesas_br.csv", index=False)
+                    # Gravar apenas o novo registro no diário e publicá-lo para todas as sessões
+                    repositorio.anexar(new_entry)
+                    # Os gráficos em cache refletem a versão anterior dos dados
+                    cache_graficos.limpar()
                     
                     # Atualizar métricas
                     if tipo == "Despesa":
@@ -432,7 +363,7 @@ with tab1:
                     st.success(f"✅ {tipo} adicionada: {description} - R$ {amount:.2f} ({category})")
                     
                     # Recalcular métricas
-                    novo_total_despesas, novo_total_receitas, novo_saldo = calcular_metricas(st.session_state.data)
+                    novo_total_despesas, novo_total_receitas, novo_saldo = calcular_metricas(repositorio.obter_agregados())
                     
                     # Registrar tempo de processamento
                     duracao = time.time() - start_time
@@ -446,15 +377,65 @@ with tab1:
                     st.rerun()
                         
                 except Exception as e:
-                    logger.error(f"Erro ao adicionar registro: {e}")
+                    logger.error("Erro ao adicionar registro: %s", e)
                     span.record_exception(e)
                     st.error(f"❌ Erro ao adicionar registro: {e}")
     
     st.markdown('</div>', unsafe_allow_html=True)
 
+    exibir_importacao()
+
+def exibir_importacao():
+    """Importação em lote: valida o arquivo, descarta duplicatas e grava tudo em uma única escrita"""
+    # Resumo da importação anterior (a página é recarregada para atualizar as métricas)
+    resumo = st.session_state.pop("resumo_importacao", None)
+    if resumo:
+        st.success(f"📥 {resumo['importados']} registros importados "
+                   f"({resumo['duplicados']} duplicados e {resumo['invalidos']} inválidos ignorados)")
+        if resumo["erros"]:
+            st.dataframe(pd.DataFrame(resumo["erros"][:100], columns=["Linha", "Motivo"]), hide_index=True)
+
+    with st.expander("📥 Importar arquivo CSV"):
+        arquivo = st.file_uploader("Arquivo no formato do aplicativo ou exportação do banco", type=["csv"])
+        if arquivo is not None and st.button("Importar"):
+            with tracer.start_as_current_span("importar_registros") as span:
+                start_time = time.time()
+                try:
+                    resumo = importar(repositorio, ler_arquivo(arquivo))
+                    if resumo["importados"]:
+                        cache_graficos.limpar()
+                    for resultado in ("importados", "duplicados", "invalidos"):
+                        registros_importados.labels(resultado=resultado).inc(resumo[resultado])
+                    span.set_attribute("arquivo", arquivo.name)
+                    span.set_attribute("importados", resumo["importados"])
+                    span.set_attribute("duplicados", resumo["duplicados"])
+                    span.set_attribute("invalidos", resumo["invalidos"])
+                    tempo_processamento.labels(operacao='importar_registros').observe(time.time() - start_time)
+                    logger.info(
+                        "Importação concluída",
+                        arquivo=arquivo.name,
+                        lidos=resumo["lidos"],
+                        importados=resumo["importados"],
+                        duplicados=resumo["duplicados"],
+                        invalidos=resumo["invalidos"]
+                    )
+                    st.session_state.resumo_importacao = resumo
+                    st.rerun()
+                except Exception as e:
+                    logger.error("Erro ao importar arquivo: %s", e)
+                    span.record_exception(e)
+                    st.error(f"❌ Erro ao importar arquivo: {e}")
+
 # === Aba de Análise ===
-with tab2:
-    if st.session_state.data.empty:
+def exibir_grafico(analise, nome):
+    """Gráfico da análise: especificação Vega-Lite desenhada no navegador ou PNG do matplotlib."""
+    if analise["motor"] == "vega":
+        st.vega_lite_chart(spec=analise[nome], use_container_width=True)
+    else:
+        st.image(analise[nome], use_column_width=True)
+
+def exibir_analise():
+    if sem_registros:
         st.info("📊 Adicione algumas despesas para visualizar a análise.")
     else:
         with tracer.start_as_current_span("gerar_analise"):
@@ -465,98 +446,70 @@ with tab2:
             # Filtros
             col1, col2 = st.columns(2)
             with col1:
-                periodo = st.selectbox("Período", ["Tudo", "Este Mês", "Últimos 3 Meses"])
+                periodo = st.selectbox("Período", ["Tudo", "Este Mês", "Últimos 3 Meses", "Personalizado"])
             
             with col2:
                 tipo_analise = st.selectbox("Tipo", ["Despesas", "Receitas", "Ambos"])
+
+            datas = None
+            if periodo == "Personalizado":
+                hoje = datetime.now().date()
+                datas = tuple(st.date_input("Intervalo", value=(hoje - pd.Timedelta(days=30), hoje),
+                                            format="DD/MM/YYYY"))
             
-            # Filtrar dados
-            filtered_data = st.session_state.data.copy()
-            
-            if periodo != "Tudo":
-                filtered_data['Data'] = pd.to_datetime(filtered_data['Data'], format='%d/%m/%Y', errors='coerce')
-                hoje = pd.Timestamp.now()
-                
-                if periodo == "Este Mês":
-                    filtro_data = (filtered_data['Data'].dt.month == hoje.month) & (filtered_data['Data'].dt.year == hoje.year)
-                    filtered_data = filtered_data[filtro_data]
-                elif periodo == "Últimos 3 Meses":
-                    tres_meses_atras = hoje - pd.DateOffset(months=3)
-                    filtro_data = (filtered_data['Data'] >= tres_meses_atras) & (filtered_data['Data'] <= hoje)
-                    filtered_data = filtered_data[filtro_data]
-            
-            if tipo_analise != "Ambos":
-                filtered_data = filtered_data[filtered_data['Tipo'] == tipo_analise.rstrip('s')]
+            # Resultado renderizado compartilhado entre as sessões do mesmo livro enquanto os dados não mudarem
+            chave_cache = (inquilino, periodo, datas, tipo_analise, repositorio.versao, datetime.now().date())
+            encontrado, analise = cache_graficos.obter(chave_cache)
+            cache_graficos_consultas.labels(resultado="acerto" if encontrado else "falha").inc()
+            if not encontrado:
+                # Filtrar e agrupar (no SQLite, vira uma consulta indexada)
+                inicio, fim = intervalo_periodo(periodo, datas=datas)
+                tipo_filtro = tipo_analise.rstrip('s') if tipo_analise != "Ambos" else None
+                with medir_fase("analise_consulta"):
+                    category_totals = repositorio.totais_por_categoria(inicio, fim, tipo_filtro)
+                    tendencia = repositorio.tendencia_mensal(inicio, fim, tipo_filtro)
+                with medir_fase("graficos"):
+                    analise = gerar_analise(category_totals, tendencia) if not category_totals.empty else None
+                cache_graficos.guardar(chave_cache, analise)
             
-            if filtered_data.empty:
+            if analise is None:
                 st.info("Sem dados para o período e tipo selecionados.")
             else:
-                category_totals = filtered_data.groupby('Categoria')['Valor'].sum().sort_values(ascending=False)
-                cores = plt.cm.viridis(np.linspace(0, 1, len(category_totals)))
-                
                 # Gráfico de Barras
-                fig, ax = plt.subplots(figsize=(10, 6))
-                bars = category_totals.plot(kind="bar", ax=ax, color=cores)
-                ax.set_ylabel("Valor (R$)")
-                ax.set_title("Total por Categoria")
-                
-                for i, bar in enumerate(bars.patches):
-                    valor = bar.get_height()
-                    ax.text(bar.get_x() + bar.get_width()/2., valor + 5, f'R$ {valor:.2f}', 
-                           ha='center', va='bottom', fontweight='bold')
-                
-                plt.xticks(rotation=45)
-                plt.tight_layout()
-                st.pyplot(fig)
+                exibir_grafico(analise, "barras")
 
                 # Gráfico de Pizza
                 st.subheader("🥧 Distribuição por Categoria")
-                fig2, ax2 = plt.subplots(figsize=(10, 6))
-                
-                wedges, texts, autotexts = ax2.pie(
-                    category_totals, labels=None, autopct="%1.1f%%",
-                    shadow=True, colors=cores, startangle=90,
-                    wedgeprops={'linewidth': 1, 'edgecolor': 'white'}
-                )
-                
-                for autotext in autotexts:
-                    autotext.set_fontsize(10)
-                    autotext.set_color('white')
-                    autotext.set_fontweight('bold')
-                
-                ax2.set_title("Proporção por Categoria")
-                ax2.legend(wedges, category_totals.index, title="Categorias",
-                          loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
-                
-                plt.tight_layout()
-                st.pyplot(fig2)
+                exibir_grafico(analise, "pizza")
                 
                 # Tabela de resumo
                 st.subheader("📊 Resumo por Categoria")
-                resumo = pd.DataFrame({
-                    'Categoria': category_totals.index,
-                    'Valor Total (R$)': category_totals.values,
-                    'Porcentagem (%)': (category_totals.values / category_totals.values.sum() * 100).round(2)
-                })
-                st.dataframe(resumo, hide_index=True, use_container_width=True)
+                st.dataframe(analise["resumo"], hide_index=True, use_container_width=True)
+
+                # Tendência mensal (só a partir de dois meses)
+                if analise["tendencia"] is not None:
+                    st.subheader("📅 Tendência Mensal")
+                    exibir_grafico(analise, "tendencia")
             
             # Registrar tempo
             duracao = time.time() - start_time
             tempo_processamento.labels(operacao='gerar_analise').observe(duracao)
-            logger.info(f"Análise gerada em {duracao:.2f} segundos")
+            logger.info("Análise gerada em %.2f segundos", duracao)
 
 # === Aba de Registros ===
-with tab3:
+def exibir_registros():
     with tracer.start_as_current_span("exibir_registros"):
         st.subheader("📋 Todos os Registros")
         
-        if st.session_state.data.empty:
+        if sem_registros:
             st.info("📝 Nenhum registro encontrado. Adicione uma despesa ou receita!")
         else:
+            # Busca por prefixo, sem acentos ("metr" encontra "Metrô"), no índice invertido de Descrição
+            busca = st.text_input("🔍 Buscar na descrição", placeholder="Ex.: metro, jantar").strip()
             col1, col2 = st.columns(2)
             
             with col1:
-                categorias_unicas = sorted(st.session_state.data['Categoria'].unique().tolist())
+                categorias_unicas = repositorio.categorias()
                 filtro_categoria = st.multiselect(
                     "Filtrar por Categoria", 
                     options=["Todas"] + categorias_unicas,
@@ -569,50 +522,139 @@ with tab3:
                     options=["Data (mais recente)", "Data (mais antiga)", "Valor (maior)", "Valor (menor)"]
                 )
             
-            filtered_data = st.session_state.data.copy()
+            ordenacoes = {
+                "Data (mais recente)": ("Data", False),
+                "Data (mais antiga)": ("Data", True),
+                "Valor (maior)": ("Valor", False),
+                "Valor (menor)": ("Valor", True),
+            }
+            categorias_filtro = filtro_categoria if "Todas" not in filtro_categoria and filtro_categoria else None
+            por_pagina = st.session_state.get("registros_por_pagina", 50)
             
-            if "Todas" not in filtro_categoria and filtro_categoria:
-                filtered_data = filtered_data[filtered_data['Categoria'].isin(filtro_categoria)]
+            # Volta para a primeira página quando a busca, o filtro, a ordenação ou o tamanho da página mudam
+            assinatura = (busca, tuple(filtro_categoria), ordenar_por, por_pagina)
+            if st.session_state.get("registros_assinatura") != assinatura:
+                st.session_state.registros_assinatura = assinatura
+                st.session_state.pagina_registros = 1
+            pagina = st.session_state.get("pagina_registros", 1)
             
-            if ordenar_por == "Data (mais recente)":
-                filtered_data['Data_temp'] = pd.to_datetime(filtered_data['Data'], format='%d/%m/%Y', errors='coerce')
-                filtered_data = filtered_data.sort_values(by="Data_temp", ascending=False)
-                filtered_data = filtered_data.drop(columns=['Data_temp'])
-            elif ordenar_por == "Data (mais antiga)":
-                filtered_data['Data_temp'] = pd.to_datetime(filtered_data['Data'], format='%d/%m/%Y', errors='coerce')
-                filtered_data = filtered_data.sort_values(by="Data_temp", ascending=True)
-                filtered_data = filtered_data.drop(columns=['Data_temp'])
-            elif ordenar_por == "Valor (maior)":
-                filtered_data = filtered_data.sort_values(by="Valor", ascending=False)
-            elif ordenar_por == "Valor (menor)":
-                filtered_data = filtered_data.sort_values(by="Valor", ascending=True)
+            # Só a página visível é materializada e enviada ao navegador (no SQLite, vira LIMIT/OFFSET)
+            with medir_fase("registros_consulta"):
+                dados_pagina, total = repositorio.pagina_registros(
+                    categorias_filtro, ordenacoes.get(ordenar_por), pagina, por_pagina, busca)
+            total_paginas = max(math.ceil(total / por_pagina), 1)
+            if pagina > total_paginas:
+                # A página pedida deixou de existir (outro filtro ou outra sessão): mostra a última
+                pagina = st.session_state.pagina_registros = total_paginas
+                dados_pagina, total = repositorio.pagina_registros(
+                    categorias_filtro, ordenacoes.get(ordenar_por), pagina, por_pagina, busca)
             
-            if not filtered_data.empty:
+            if total:
                 # Exibir dataframe
-                st.dataframe(
-                    filtered_data,
-                    height=400,
-                    hide_index=True,
-                    use_container_width=True
-                )
+                with medir_fase("registros_tabela"):
+                    st.dataframe(
+                        dados_pagina,
+                        height=400,
+                        hide_index=True,
+                        use_container_width=True,
+                        column_config={
+                            "Data": st.column_config.DateColumn("Data", format="DD/MM/YYYY"),
+                            "Valor": st.column_config.NumberColumn("Valor", format="%.2f"),
+                        }
+                    )
                 
-                # Estatísticas
+                col1, col2, col3 = st.columns([1, 1, 2])
+                with col1:
+                    st.number_input("Página", min_value=1, max_value=total_paginas, step=1, key="pagina_registros")
+                with col2:
+                    st.selectbox("Linhas por página", options=[25, 50, 100, 250], index=1, key="registros_por_pagina")
+                with col3:
+                    primeiro = (pagina - 1) * por_pagina + 1
+                    st.caption(f"Registros {primeiro}–{primeiro + len(dados_pagina) - 1} de {total} "
+                               f"(página {pagina} de {total_paginas})")
+                
+                # Estatísticas (do cubo agregado ou do banco, sem somar as linhas exibidas)
+                estatisticas = repositorio.estatisticas(categorias_filtro, busca)
                 st.subheader("📊 Estatísticas")
                 col1, col2, col3 = st.columns(3)
                 
                 with col1:
-                    st.metric("Total de Registros", len(filtered_data))
+                    st.metric("Total de Registros", estatisticas["registros"])
                 
                 with col2:
-                    total_filtrado = filtered_data['Valor'].sum()
-                    st.metric("Valor Total", f"R$ {total_filtrado:.2f}")
+                    st.metric("Valor Total", f"R$ {estatisticas['soma']:.2f}")
                 
                 with col3:
-                    media = filtered_data['Valor'].mean()
-                    st.metric("Valor Médio", f"R$ {media:.2f}")
+                    st.metric("Valor Médio", f"R$ {estatisticas['media']:.2f}")
+
+                exibir_exportacao(categorias_filtro, ordenacoes.get(ordenar_por), busca)
             else:
                 st.info("Sem registros para mostrar com os filtros selecionados.")
 
+def exibir_exportacao(categorias_filtro, ordenacao, busca):
+    """Exporta a seleção da aba Registros (busca, filtro e ordenação) para um arquivo, em blocos lidos
+    do armazenamento, e oferece o download se o arquivo couber em EXPORTACAO_MAX_DOWNLOAD_MB (o
+    st.download_button guarda o arquivo inteiro em memória)."""
+    with st.expander("⬇️ Exportar seleção"):
+        formato = st.radio("Formato", ["CSV", "Parquet"], horizontal=True, key="exportacao_formato").lower()
+        if st.button("Gerar arquivo", key="exportacao_gerar"):
+            diretorio = os.path.join(EXPORTACAO_DIRETORIO, identificador_seguro(inquilino)) if inquilino \
+                else EXPORTACAO_DIRETORIO
+            caminho = os.path.join(diretorio, nome_exportacao(formato))
+            anterior = st.session_state.get("exportacao_arquivo")
+            inicio = time.perf_counter()
+            with st.spinner("Exportando registros..."), medir_fase("exportacao"):
+                blocos = repositorio.blocos_registros(categorias_filtro, ordenacao, busca, TAMANHO_BLOCO)
+                tamanho = exportar_arquivo(blocos, formato, caminho)
+            duracao = time.perf_counter() - inicio
+            tempo_processamento.labels(operacao='exportar_registros').observe(duracao)
+            # Só o nome do arquivo: o diretório tem o identificador do inquilino, que não vai para os logs
+            logger.info("Exportação %s gravada em %s (%d bytes, %.2f segundos)", formato, os.path.basename(caminho),
+                        tamanho, duracao)
+            # Só o último arquivo de cada sessão fica em disco
+            if anterior and anterior[0] != caminho and os.path.exists(anterior[0]):
+                os.remove(anterior[0])
+            st.session_state.exportacao_arquivo = (caminho, tamanho, formato)
+
+        exportado = st.session_state.get("exportacao_arquivo")
+        if exportado and os.path.exists(exportado[0]):
+            caminho, tamanho, formato_arquivo = exportado
+            if tamanho <= EXPORTACAO_MAX_DOWNLOAD_MB * 2**20:
+                with open(caminho, "rb") as arquivo:
+                    st.download_button(f"📥 Baixar {os.path.basename(caminho)} ({tamanho / 2**20:.1f} MB)", arquivo,
+                                       file_name=os.path.basename(caminho), mime=FORMATOS[formato_arquivo][0])
+            else:
+                st.info(f"Arquivo gravado em `{caminho}` ({tamanho / 2**20:.1f} MB), grande demais para o download "
+                        "pelo navegador. Use o arquivo no servidor ou `GET /exportar` da API.")
+
+ABAS = {
+    "📝 Nova Despesa": ("nova_despesa", exibir_nova_despesa),
+    "📊 Análise": ("analise", exibir_analise),
+    "📋 Registros": ("registros", exibir_registros),
+}
+# "sob_demanda" executa só a aba selecionada; "abas" mantém st.tabs (todas executam a cada interação)
+MODO_ABAS = os.getenv("ABAS_MODO", "sob_demanda")
+
+def executar_aba(nome):
+    """Executa uma aba e registra seu tempo em operacao_duracao_segundos{operacao="aba_<nome>"}"""
+    operacao, exibir = ABAS[nome]
+    start_time = time.time()
+    try:
+        with medir_fase(f"aba_{operacao}"):
+            exibir()
+    finally:
+        tempo_processamento.labels(operacao=f"aba_{operacao}").observe(time.time() - start_time)
+
+if MODO_ABAS == "abas":
+    for aba, nome in zip(st.tabs(list(ABAS)), ABAS):
+        with aba:
+            executar_aba(nome)
+else:
+    # A seleção fica no session_state; as demais abas só são calculadas quando abertas
+    aba_ativa = st.radio("Aba", options=list(ABAS), horizontal=True,
+                         key="aba_ativa", label_visibility="collapsed")
+    executar_aba(aba_ativa)
+
 # ========== Footer ==========
 st.markdown("""
 <div style="text-align: center; padding: 20px; margin-top: 50px; border-top: 1px solid #ddd;">
@@ -620,4 +662,7 @@ st.markdown("""
     📊 Métricas: <a href="http://localhost:8000/metrics" target="_blank">Prometheus</a> | 
     🔍 Traces: Tempo | 📝 Logs: Loki
 </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
+execucao.finalizar()
+# Primeira execução completa do processo: comparada com INICIALIZACAO_ORCAMENTO_SEGUNDOS
+concluir_inicializacao(time.perf_counter() - INICIO_SCRIPT, logger)
@@ -0,0 +1,1547 @@
+import argparse
+import csv
+import io
+import json
+import logging
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from agregados import (CuboAgregado, EstadoAgregado, estatisticas_de_somas, tabela_mensal, valor_registro,
+                       valores_em_reais)
+from busca import IndiceTexto, mascara_busca, termos_busca
+
+COLUNAS = ["Data", "Descrição", "Categoria", "Valor", "Tipo"]
+FORMATO_DATA = "%d/%m/%Y"
+COLUNAS_CATEGORICAS = ["Categoria", "Tipo"]
+# Colunas sempre carregadas: bastam para os totais e filtros; Descrição só quando uma aba pede
+COLUNAS_ESSENCIAIS = ["Data", "Categoria", "Valor", "Tipo"]
+# Tipos usados na leitura do CSV; a Data é convertida depois, com formato explícito
+# Valor fica em float64: float32 não representa centavos acima de ~R$131.072 (1234567.89 viraria 1234567.875)
+TIPOS_CSV = {"Descrição": "object", "Categoria": "category", "Valor": "float64", "Tipo": "category"}
+
+
+def _ordenar_colunas(colunas=None):
+    if colunas is None:
+        return list(COLUNAS)
+    return [coluna for coluna in COLUNAS if coluna in colunas]
+
+
+def tipar_dados(df, colunas=None):
+    """Converte o DataFrame para o esquema em memória: datas datetime64, Categoria/Tipo
+    categóricos e Valor float64 (a economia de memória vem só das colunas categóricas)."""
+    df = df.reindex(columns=_ordenar_colunas(colunas))
+    if "Data" in df.columns and not pd.api.types.is_datetime64_any_dtype(df["Data"]):
+        df["Data"] = pd.to_datetime(df["Data"], format=FORMATO_DATA, errors="coerce")
+    for coluna in COLUNAS_CATEGORICAS:
+        if coluna in df.columns and not isinstance(df[coluna].dtype, pd.CategoricalDtype):
+            df[coluna] = df[coluna].astype("category")
+    if "Valor" in df.columns:
+        df["Valor"] = pd.to_numeric(df["Valor"], errors="coerce").astype("float64")
+    if "Descrição" in df.columns:
+        df["Descrição"] = df["Descrição"].astype("object")
+    return df
+
+
+def concatenar(base, novos):
+    """Concatena mantendo as colunas categóricas (pd.concat viraria object com categorias diferentes)."""
+    if base.empty:
+        return novos
+    base = base.copy(deep=False)
+    novos = novos.copy(deep=False)
+    for coluna in COLUNAS_CATEGORICAS:
+        if coluna not in base.columns:
+            continue
+        categorias = base[coluna].cat.categories.union(novos[coluna].cat.categories, sort=False)
+        base[coluna] = base[coluna].cat.set_categories(categorias)
+        novos[coluna] = novos[coluna].cat.set_categories(categorias)
+    return pd.concat([base, novos], ignore_index=True)
+
+
+def chaves_registros(df):
+    """Hash de cada registro (Data, Descrição, Categoria, Valor em centavos e Tipo), usado para
+    detectar duplicatas. Aceita registros no esquema em memória ou com Data em dd/mm/aaaa."""
+    df = tipar_dados(df)
+    normalizado = pd.DataFrame({
+        "Data": df["Data"].dt.normalize(),
+        "Descrição": df["Descrição"].astype("string").str.strip().fillna(""),
+        "Categoria": df["Categoria"].astype(str),
+        "Valor": (valores_em_reais(df["Valor"]) * 100).round(),
+        "Tipo": df["Tipo"].astype(str),
+    })
+    return pd.util.hash_pandas_object(normalizado, index=False).to_numpy()
+
+
+def _fsync_diretorio(caminho):
+    # Garante que renomeações/remoções sobrevivam a uma queda do processo
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(caminho)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def para_csv(df):
+    """Cópia no formato do CSV em disco: Data em dd/mm/aaaa e Valor em float64, escrito com o texto
+    mais curto que reproduz o valor (1234567.89 continua "1234567.89")."""
+    saida = df.reindex(columns=COLUNAS).copy()
+    saida["Data"] = saida["Data"].dt.strftime(FORMATO_DATA)
+    saida["Valor"] = pd.to_numeric(saida["Valor"], errors="coerce").astype("float64")
+    return saida
+
+
+# ========== Formatos do arquivo principal ==========
+class BaseCSV:
+    """Arquivo principal em CSV (formato original do projeto)."""
+    formato = "csv"
+    extensao = ".csv"
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+
+    def existe(self):
+        return os.path.exists(self.caminho)
+
+    def ler(self, colunas=None):
+        if not self.existe():
+            return tipar_dados(pd.DataFrame(columns=COLUNAS), colunas)
+        colunas = _ordenar_colunas(colunas)
+        tipos = {coluna: tipo for coluna, tipo in TIPOS_CSV.items() if coluna in colunas}
+        return tipar_dados(pd.read_csv(self.caminho, usecols=colunas, dtype=tipos), colunas)
+
+    def escrever_compactado(self, destino, registros):
+        with open(destino, "wb") as destino_bin:
+            # Cópia em blocos do CSV atual: custo de I/O sequencial, sem parse
+            escrever_cabecalho = True
+            if self.existe():
+                with open(self.caminho, "rb") as origem:
+                    shutil.copyfileobj(origem, destino_bin, 1024 * 1024)
+                tamanho = destino_bin.tell()
+                if tamanho:
+                    escrever_cabecalho = False
+                    with open(self.caminho, "rb") as origem:
+                        origem.seek(tamanho - 1)
+                        if origem.read(1) != b"\n":
+                            destino_bin.write(b"\n")
+            destino_txt = io.TextIOWrapper(destino_bin, encoding="utf-8", newline="")
+            escritor = csv.writer(destino_txt, lineterminator="\n")
+            if escrever_cabecalho:
+                escritor.writerow(COLUNAS)
+            for registro in registros:
+                escritor.writerow([registro.get(coluna, "") for coluna in COLUNAS])
+            destino_txt.flush()
+            destino_txt.detach()
+
+    def escrever(self, df, destino):
+        para_csv(df).to_csv(destino, index=False)
+
+
+def _valor_float64(tabela):
+    """Tabela Arrow com Valor em float64. Arquivos gravados antes com Valor em float32 são
+    arredondados aos centavos na leitura (desfaz o ruído da conversão; os centavos já perdidos
+    acima de ~R$131.072 não voltam)."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if "Valor" not in tabela.column_names:
+        return tabela
+    posicao = tabela.column_names.index("Valor")
+    valor = tabela.column(posicao)
+    if pa.types.is_float32(valor.type):
+        valor = pc.round(valor.cast(pa.float64()), 2)
+    elif not pa.types.is_float64(valor.type):
+        valor = valor.cast(pa.float64())
+    return tabela.set_column(posicao, pa.field("Valor", pa.float64()), valor)
+
+
+def _tabela_para_gravar(df):
+    import pyarrow as pa
+    return _valor_float64(pa.Table.from_pandas(tipar_dados(df), preserve_index=False))
+
+
+class BaseArrow(BaseCSV):
+    """Arquivo principal em Arrow IPC (Feather v2) sem compressão, lido com memory mapping."""
+    formato = "arrow"
+    extensao = ".arrow"
+
+    def ler(self, colunas=None):
+        if not self.existe():
+            return tipar_dados(pd.DataFrame(columns=COLUNAS), colunas)
+        from pyarrow import feather
+        # Sem compressão o arquivo é mapeado direto em memória: só as páginas das colunas pedidas são lidas
+        tabela = feather.read_table(self.caminho, columns=_ordenar_colunas(colunas), memory_map=True)
+        return tipar_dados(_valor_float64(tabela).to_pandas(), colunas)
+
+    def escrever_compactado(self, destino, registros):
+        df = concatenar(self.ler(), tipar_dados(pd.DataFrame(registros, columns=COLUNAS)))
+        self.escrever(df, destino)
+
+    def escrever(self, df, destino):
+        from pyarrow import feather
+        feather.write_feather(_tabela_para_gravar(df), destino, compression="uncompressed")
+
+
+class BaseParquet(BaseArrow):
+    """Arquivo principal em Parquet (colunar e comprimido; leitura com memory mapping)."""
+    formato = "parquet"
+    extensao = ".parquet"
+
+    def ler(self, colunas=None):
+        if not self.existe():
+            return tipar_dados(pd.DataFrame(columns=COLUNAS), colunas)
+        import pyarrow.parquet as pq
+        tabela = pq.read_table(self.caminho, columns=_ordenar_colunas(colunas), memory_map=True)
+        return tipar_dados(_valor_float64(tabela).to_pandas(), colunas)
+
+    def escrever(self, df, destino):
+        import pyarrow.parquet as pq
+        pq.write_table(_tabela_para_gravar(df), destino)
+
+
+class BaseSQLite:
+    """Arquivo principal em SQLite (modo WAL) com índices para os filtros das abas."""
+    formato = "sqlite"
+    extensao = ".db"
+    # Nome da coluna no banco para cada coluna do DataFrame
+    COLUNAS_SQL = {"Data": "data", "Descrição": "descricao", "Categoria": "categoria", "Valor": "valor", "Tipo": "tipo"}
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+
+    def existe(self):
+        return os.path.exists(self.caminho)
+
+    def conectar(self, caminho=None):
+        conexao = sqlite3.connect(caminho or self.caminho, timeout=30, check_same_thread=False)
+        conexao.execute("PRAGMA journal_mode=WAL")
+        conexao.execute("PRAGMA synchronous=FULL")
+        tinha_busca = conexao.execute("SELECT 1 FROM sqlite_master WHERE name = 'despesas_busca'").fetchone()
+        conexao.executescript("""
+            CREATE TABLE IF NOT EXISTS despesas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                data TEXT,
+                descricao TEXT,
+                categoria TEXT,
+                valor REAL,
+                tipo TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_despesas_data ON despesas (data);
+            CREATE INDEX IF NOT EXISTS idx_despesas_categoria ON despesas (categoria, data);
+            CREATE INDEX IF NOT EXISTS idx_despesas_tipo ON despesas (tipo, data);
+            CREATE INDEX IF NOT EXISTS idx_despesas_valor ON despesas (valor);
+            -- Índice invertido da descrição (sem acentos), mantido pelo gatilho a cada inserção
+            CREATE VIRTUAL TABLE IF NOT EXISTS despesas_busca USING fts5(
+                descricao, content='despesas', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS despesas_busca_inserir AFTER INSERT ON despesas BEGIN
+                INSERT INTO despesas_busca (rowid, descricao) VALUES (new.id, new.descricao);
+            END;
+        """)
+        if not tinha_busca:
+            # Banco criado antes da busca: indexa os registros existentes uma vez
+            with conexao:
+                conexao.execute("INSERT INTO despesas_busca (despesas_busca) VALUES ('rebuild')")
+        return conexao
+
+    @staticmethod
+    def para_linha(registro):
+        """Converte um registro (Data em dd/mm/aaaa) para a linha do banco (Data ISO, ordenável)."""
+        data = registro.get("Data")
+        if isinstance(data, str):
+            try:
+                data = datetime.strptime(data, FORMATO_DATA).strftime("%Y-%m-%d")
+            except ValueError:
+                data = None
+        elif data is not None and not pd.isna(data):
+            data = pd.Timestamp(data).strftime("%Y-%m-%d")
+        else:
+            data = None
+        valor = pd.to_numeric(registro.get("Valor"), errors="coerce")
+        return (data, registro.get("Descrição"), registro.get("Categoria"),
+                None if pd.isna(valor) else float(valor), registro.get("Tipo"))
+
+    def consultar(self, conexao, colunas=None, where="", parametros=(), order_by="id", limite=None, deslocamento=0,
+                  tamanho_bloco=None):
+        """DataFrame da consulta; com tamanho_bloco, um gerador de DataFrames de até tamanho_bloco
+        linhas lidos do cursor aos poucos."""
+        colunas = _ordenar_colunas(colunas)
+        sql = "SELECT " + ", ".join(self.COLUNAS_SQL[coluna] for coluna in colunas) + " FROM despesas"
+        parametros = list(parametros)
+        if where:
+            sql += " WHERE " + where
+        sql += " ORDER BY " + order_by
+        if limite is not None:
+            sql += " LIMIT ? OFFSET ?"
+            parametros += [limite, deslocamento]
+        if tamanho_bloco is not None:
+            blocos = pd.read_sql_query(sql, conexao, params=parametros, chunksize=tamanho_bloco)
+            return (self._tipar_consulta(df, colunas) for df in blocos)
+        return self._tipar_consulta(pd.read_sql_query(sql, conexao, params=parametros), colunas)
+
+    @staticmethod
+    def _tipar_consulta(df, colunas):
+        df.columns = colunas
+        if "Data" in df.columns:
+            df["Data"] = pd.to_datetime(df["Data"], format="%Y-%m-%d", errors="coerce")
+        return tipar_dados(df, colunas)
+
+    def ler(self, colunas=None):
+        if not self.existe():
+            return tipar_dados(pd.DataFrame(columns=COLUNAS), colunas)
+        conexao = self.conectar()
+        try:
+            return self.consultar(conexao, colunas)
+        finally:
+            conexao.close()
+
+    def escrever(self, df, destino):
+        conexao = self.conectar(destino)
+        try:
+            with conexao:
+                conexao.executemany(
+                    "INSERT INTO despesas (data, descricao, categoria, valor, tipo) VALUES (?, ?, ?, ?, ?)",
+                    (self.para_linha(registro) for registro in df.reindex(columns=COLUNAS).to_dict("records")))
+        finally:
+            conexao.close()
+
+
+class BaseParticionada:
+    """Diretório com uma partição CSV por mês (AAAA-MM.csv) e um manifesto com os totais de cada mês."""
+    formato = "particionado"
+    extensao = ".particoes"
+    SEM_DATA = "sem-data"
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.caminho_manifesto = os.path.join(caminho, "manifesto.json")
+
+    def existe(self):
+        return os.path.isdir(self.caminho)
+
+    def caminho_particao(self, mes, diretorio=None):
+        return os.path.join(diretorio or self.caminho, f"{mes}.csv")
+
+    def particoes(self):
+        if not self.existe():
+            return []
+        return sorted(nome[:-4] for nome in os.listdir(self.caminho) if nome.endswith(".csv"))
+
+    @classmethod
+    def mes_de(cls, data):
+        """Chave da partição (AAAA-MM) para uma data em dd/mm/aaaa ou datetime."""
+        if isinstance(data, str):
+            try:
+                return datetime.strptime(data, FORMATO_DATA).strftime("%Y-%m")
+            except ValueError:
+                return cls.SEM_DATA
+        if data is None or pd.isna(data):
+            return cls.SEM_DATA
+        return pd.Timestamp(data).strftime("%Y-%m")
+
+    @classmethod
+    def intervalo_mes(cls, mes):
+        inicio = pd.Timestamp(mes + "-01")
+        return inicio, inicio + pd.offsets.MonthEnd(0)
+
+    def ler_particao(self, mes, colunas=None):
+        return BaseCSV(self.caminho_particao(mes)).ler(colunas)
+
+    def ler(self, colunas=None):
+        partes = [self.ler_particao(mes, colunas) for mes in self.particoes()]
+        resultado = tipar_dados(pd.DataFrame(columns=COLUNAS), colunas)
+        for parte in partes:
+            resultado = concatenar(resultado, parte)
+        return resultado
+
+    def escrever(self, df, destino):
+        os.makedirs(destino)
+        meses = df["Data"].dt.strftime("%Y-%m").fillna(self.SEM_DATA)
+        saida = para_csv(df)
+        manifesto = {}
+        for mes, parte in saida.groupby(meses, sort=True):
+            caminho = self.caminho_particao(mes, destino)
+            parte.to_csv(caminho, index=False)
+            manifesto[mes] = resumo_particao(tipar_dados(parte), os.path.getsize(caminho))
+        gravar_json_atomico(os.path.join(destino, "manifesto.json"), manifesto)
+
+
+FORMATOS = {base.formato: base for base in (BaseCSV, BaseArrow, BaseParquet, BaseSQLite, BaseParticionada)}
+
+
+def criar_base(caminho_csv, formato=None):
+    """Cria o arquivo principal no formato configurado, ao lado do CSV (mesmo nome, outra extensão)."""
+    formato = (formato or os.getenv("ARMAZENAMENTO_FORMATO", "csv")).lower()
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato de armazenamento desconhecido: {formato}")
+    classe = FORMATOS[formato]
+    return classe(os.path.splitext(caminho_csv)[0] + classe.extensao)
+
+
+class Diario:
+    """Diário append-only: grava só o registro novo e compacta no arquivo principal em segundo plano.
+
+    Arquivos usados ao lado do arquivo principal (CSV, Arrow ou Parquet):
+      - <base>.diario: registros ainda não compactados (uma linha JSON por registro)
+      - <base>.diario.compactando: diário rotacionado durante a compactação
+      - <arquivo>.tmp: novo arquivo principal em construção pela compactação
+    """
+
+    def __init__(self, base, limite_compactacao=1000, logger=None):
+        self.base = base
+        raiz = os.path.splitext(base.caminho)[0]
+        self.caminho_diario = raiz + ".diario"
+        self.caminho_compactando = self.caminho_diario + ".compactando"
+        self.caminho_tmp = base.caminho + ".tmp"
+        self.limite_compactacao = limite_compactacao
+        self.logger = logger or logging.getLogger(__name__)
+
+        # _lock_rotacao: escrita no diário x rotação do diário
+        # _lock_troca: leitura do CSV x troca do CSV compactado
+        self._lock_rotacao = threading.Lock()
+        self._lock_troca = threading.Lock()
+        self._lock_compactacao = threading.Lock()
+        # _lock_fila: novos envios x fechamento (nada entra na fila depois do pedido de fechamento)
+        self._lock_fila = threading.Lock()
+        self._fila = queue.Queue()
+        self._fechado = False
+        self._pedido_compactacao = threading.Event()
+
+        self._registros_no_diario = self._recuperar()
+        self._arquivo = open(self.caminho_diario, "a", encoding="utf-8")
+        self._assinatura_propria = self._assinatura()
+
+        threading.Thread(target=self._escritor, name="diario-escritor", daemon=True).start()
+        threading.Thread(target=self._compactador, name="diario-compactador", daemon=True).start()
+
+        if os.path.exists(self.caminho_compactando) or self._registros_no_diario >= self.limite_compactacao:
+            self._pedido_compactacao.set()
+
+    # ---------- Recuperação ----------
+    def _recuperar(self):
+        """Conclui ou descarta uma compactação interrompida e limpa linha parcial do diário."""
+        if os.path.exists(self.caminho_tmp):
+            if os.path.exists(self.caminho_compactando):
+                # O .tmp pode estar incompleto: refazemos a compactação a partir do diário rotacionado
+                os.unlink(self.caminho_tmp)
+            else:
+                # O diário rotacionado já foi removido, então o .tmp está completo
+                os.replace(self.caminho_tmp, self.base.caminho)
+            _fsync_diretorio(self.base.caminho)
+
+        if not os.path.exists(self.caminho_diario):
+            return 0
+
+        with open(self.caminho_diario, "rb+") as f:
+            conteudo = f.read()
+            fim_valido = conteudo.rfind(b"\n") + 1
+            if fim_valido != len(conteudo):
+                # Última linha truncada por uma queda durante a escrita
+                f.truncate(fim_valido)
+                f.flush()
+                os.fsync(f.fileno())
+                self.logger.warning("Linha parcial descartada do diário: " + self.caminho_diario)
+        return conteudo[:fim_valido].count(b"\n")
+
+    # ---------- Detecção de alterações externas ----------
+    def _assinatura(self):
+        assinatura = []
+        for caminho in (self.base.caminho, self.caminho_diario, self.caminho_compactando):
+            try:
+                info = os.stat(caminho)
+                assinatura.append((info.st_mtime_ns, info.st_size))
+            except OSError:
+                assinatura.append(None)
+        return tuple(assinatura)
+
+    def modificado_externamente(self):
+        """Indica se os arquivos mudaram por algo que não foi este diário (outro processo, edição manual)."""
+        with self._lock_troca, self._lock_rotacao:
+            return self._assinatura() != self._assinatura_propria
+
+    # ---------- Leitura ----------
+    def _ler_linhas(self, caminho):
+        registros = []
+        if not os.path.exists(caminho):
+            return registros
+        with open(caminho, "r", encoding="utf-8") as f:
+            for linha in f:
+                if not linha.endswith("\n"):
+                    break
+                try:
+                    registros.append(json.loads(linha))
+                except ValueError:
+                    self.logger.warning("Registro inválido ignorado no diário: " + caminho)
+        return registros
+
+    def carregar(self, colunas=None):
+        """Retorna o arquivo principal somado aos registros ainda não compactados, já tipado.
+
+        Com `colunas`, só essas colunas são lidas do arquivo principal."""
+        with self._lock_troca:
+            with self._lock_rotacao:
+                pendentes = self._ler_linhas(self.caminho_compactando) + self._ler_linhas(self.caminho_diario)
+                self._assinatura_propria = self._assinatura()
+            df = self.base.ler(colunas)
+        if pendentes:
+            df = concatenar(df, tipar_dados(pd.DataFrame(pendentes, columns=COLUNAS), colunas))
+        return df
+
+    # ---------- Escrita (group commit) ----------
+    def anexar(self, registro):
+        self.anexar_lote([registro])
+
+    def anexar_lote(self, registros):
+        """Grava os registros no diário e só retorna depois do fsync."""
+        pedido = {"registros": list(registros), "feito": threading.Event(), "erro": None}
+        with self._lock_fila:
+            if self._fechado:
+                raise RuntimeError("Diário fechado: " + self.caminho_diario)
+            self._fila.put(pedido)
+        pedido["feito"].wait()
+        if pedido["erro"] is not None:
+            raise pedido["erro"]
+
+    def _escritor(self):
+        while True:
+            pedidos = [self._fila.get()]
+            # Agrupa todos os envios que chegaram durante o último fsync em uma única gravação
+            while True:
+                try:
+                    pedidos.append(self._fila.get_nowait())
+                except queue.Empty:
+                    break
+
+            erro = None
+            gravados = 0
+            try:
+                with self._lock_rotacao:
+                    for pedido in pedidos:
+                        for registro in pedido["registros"]:
+                            self._arquivo.write(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+                            gravados += 1
+                    self._arquivo.flush()
+                    os.fsync(self._arquivo.fileno())
+                    self._registros_no_diario += gravados
+                    self._assinatura_propria = self._assinatura()
+                    precisa_compactar = self._registros_no_diario >= self.limite_compactacao
+            except Exception as e:
+                erro = e
+                precisa_compactar = False
+                self.logger.error("Erro ao gravar no diário: " + str(e))
+
+            fechar = any(pedido.get("fechar") for pedido in pedidos)
+            if fechar:
+                with self._lock_rotacao:
+                    self._arquivo.close()
+            for pedido in pedidos:
+                pedido["erro"] = erro
+                pedido["feito"].set()
+            if fechar:
+                return
+            if precisa_compactar:
+                self._pedido_compactacao.set()
+
+    def fechar(self):
+        """Conclui as gravações na fila, encerra as threads e fecha o diário.
+
+        Registros ainda não compactados ficam no diário e são lidos na próxima abertura."""
+        with self._lock_compactacao:
+            # Com o lock, nenhuma compactação está em andamento nem começa depois
+            with self._lock_fila:
+                if self._fechado:
+                    return
+                self._fechado = True
+                pedido = {"registros": [], "feito": threading.Event(), "erro": None, "fechar": True}
+                self._fila.put(pedido)
+            pedido["feito"].wait()
+        self._pedido_compactacao.set()
+
+    # ---------- Compactação ----------
+    def _compactador(self):
+        while True:
+            self._pedido_compactacao.wait()
+            self._pedido_compactacao.clear()
+            if self._fechado:
+                return
+            try:
+                self.compactar()
+            except Exception as e:
+                self.logger.error("Erro ao compactar diário: " + str(e))
+
+    def compactar(self):
+        """Incorpora o diário ao arquivo principal sem bloquear novas gravações."""
+        with self._lock_compactacao:
+            if self._fechado:
+                return
+            with self._lock_rotacao:
+                if not os.path.exists(self.caminho_compactando):
+                    if self._registros_no_diario == 0:
+                        return
+                    self._arquivo.close()
+                    os.replace(self.caminho_diario, self.caminho_compactando)
+                    self._arquivo = open(self.caminho_diario, "a", encoding="utf-8")
+                    self._registros_no_diario = 0
+                    _fsync_diretorio(self.caminho_diario)
+                    self._assinatura_propria = self._assinatura()
+
+            registros = self._ler_linhas(self.caminho_compactando)
+            self.base.escrever_compactado(self.caminho_tmp, registros)
+            with open(self.caminho_tmp, "rb") as f:
+                os.fsync(f.fileno())
+
+            # A remoção do diário rotacionado marca o .tmp como completo (ver _recuperar)
+            with self._lock_troca:
+                os.unlink(self.caminho_compactando)
+                _fsync_diretorio(self.caminho_compactando)
+                os.replace(self.caminho_tmp, self.base.caminho)
+                _fsync_diretorio(self.base.caminho)
+                with self._lock_rotacao:
+                    self._assinatura_propria = self._assinatura()
+            self.logger.info(f"Diário compactado: {len(registros)} registros incorporados ao arquivo {self.base.formato}")
+
+
+class ArmazenamentoSQLite:
+    """Armazenamento em SQLite: cada inserção é uma transação de uma linha (sem reescrever arquivos),
+    vários processos podem gravar ao mesmo tempo e os filtros das abas viram consultas indexadas."""
+    suporta_consultas = True
+
+    def __init__(self, base, logger=None):
+        self.base = base
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._conexao = base.conectar()
+        self._versao_dados = self._data_version()
+
+    def _data_version(self):
+        # Muda sempre que outra conexão (outro processo/réplica) confirma uma transação
+        return self._conexao.execute("PRAGMA data_version").fetchone()[0]
+
+    def modificado_externamente(self):
+        with self._lock:
+            return self._data_version() != self._versao_dados
+
+    def carregar(self, colunas=None):
+        with self._lock:
+            self._versao_dados = self._data_version()
+            return self.base.consultar(self._conexao, colunas)
+
+    def anexar(self, registro):
+        self.anexar_lote([registro])
+
+    def fechar(self):
+        with self._lock:
+            self._conexao.close()
+
+    def anexar_lote(self, registros):
+        with self._lock, self._conexao:
+            self._conexao.executemany(
+                "INSERT INTO despesas (data, descricao, categoria, valor, tipo) VALUES (?, ?, ?, ?, ?)",
+                [self.base.para_linha(registro) for registro in registros])
+
+    def calcular_agregados(self):
+        with self._lock:
+            self._versao_dados = self._data_version()
+            estado = EstadoAgregado()
+            for tipo, total in self._conexao.execute("SELECT tipo, SUM(valor) FROM despesas GROUP BY tipo"):
+                estado.total_por_tipo[tipo] = float(total or 0.0)
+            for categoria, quantidade in self._conexao.execute(
+                    "SELECT categoria, COUNT(*) FROM despesas GROUP BY categoria"):
+                estado.registros_por_categoria[categoria] = int(quantidade)
+            estado.total_registros = sum(estado.registros_por_categoria.values())
+            return estado
+
+    @staticmethod
+    def _filtro_intervalo(inicio=None, fim=None, tipo=None):
+        condicoes, parametros = [], []
+        if inicio is not None:
+            condicoes.append("data >= ?")
+            parametros.append(inicio.strftime("%Y-%m-%d"))
+        if fim is not None:
+            condicoes.append("data <= ?")
+            parametros.append(fim.strftime("%Y-%m-%d"))
+        if tipo is not None:
+            condicoes.append("tipo = ?")
+            parametros.append(tipo)
+        return condicoes, parametros
+
+    def totais_por_categoria(self, inicio=None, fim=None, tipo=None):
+        condicoes, parametros = self._filtro_intervalo(inicio, fim, tipo)
+        sql = "SELECT categoria, SUM(valor) AS total FROM despesas"
+        if condicoes:
+            sql += " WHERE " + " AND ".join(condicoes)
+        sql += " GROUP BY categoria ORDER BY total DESC"
+        with self._lock:
+            linhas = self._conexao.execute(sql, parametros).fetchall()
+        return pd.Series([float(total) for _, total in linhas], index=pd.Index([c for c, _ in linhas], name="Categoria"),
+                         name="Valor", dtype="float64")
+
+    def tendencia_mensal(self, inicio=None, fim=None, tipo=None):
+        condicoes, parametros = self._filtro_intervalo(inicio, fim, tipo)
+        condicoes += ["data IS NOT NULL", "categoria IS NOT NULL"]
+        sql = ("SELECT substr(data, 1, 7) AS mes, categoria, SUM(valor) FROM despesas WHERE "
+               + " AND ".join(condicoes) + " GROUP BY mes, categoria")
+        with self._lock:
+            linhas = self._conexao.execute(sql, parametros).fetchall()
+        return tabela_mensal({(pd.Timestamp(mes + "-01"), categoria): float(soma or 0.0)
+                              for mes, categoria, soma in linhas}, inicio, fim)
+
+    @staticmethod
+    def _filtro(categorias=None, busca=None):
+        condicoes, parametros = [], []
+        if categorias:
+            condicoes.append("categoria IN (" + ", ".join("?" * len(categorias)) + ")")
+            parametros += list(categorias)
+        termos = termos_busca(busca)
+        if termos:
+            # Cada termo como prefixo ("metr"*), todos obrigatórios
+            condicoes.append("id IN (SELECT rowid FROM despesas_busca WHERE despesas_busca MATCH ?)")
+            parametros.append(" ".join(f'"{termo}"*' for termo in termos))
+        return " AND ".join(condicoes), parametros
+
+    def _ordem_sql(self, ordenacao):
+        if ordenacao is None:
+            return "id"
+        coluna, ascendente = ordenacao
+        return f"{self.base.COLUNAS_SQL[coluna]} {'ASC' if ascendente else 'DESC'}, id"
+
+    def consultar_registros(self, categorias=None, ordenacao=None, busca=None):
+        where, parametros = self._filtro(categorias, busca)
+        with self._lock:
+            return self.base.consultar(self._conexao, COLUNAS, where, parametros, self._ordem_sql(ordenacao))
+
+    def consultar_pagina(self, categorias=None, ordenacao=None, inicio=0, quantidade=50, busca=None):
+        """Só as linhas da página saem do banco (LIMIT/OFFSET sobre os índices de data e valor)."""
+        where, parametros = self._filtro(categorias, busca)
+        with self._lock:
+            total = self._conexao.execute(
+                "SELECT COUNT(*) FROM despesas" + (" WHERE " + where if where else ""), parametros).fetchone()[0]
+            pagina = self.base.consultar(self._conexao, COLUNAS, where, parametros, self._ordem_sql(ordenacao),
+                                         limite=quantidade, deslocamento=inicio)
+        return pagina, total
+
+    def blocos_registros(self, categorias=None, ordenacao=None, busca=None, tamanho=50_000):
+        """Registros filtrados e ordenados em blocos, lidos de uma conexão própria: a leitura
+        enxerga um retrato do banco (WAL) e não segura o lock das gravações."""
+        where, parametros = self._filtro(categorias, busca)
+        conexao = self.base.conectar()
+        try:
+            yield from self.base.consultar(conexao, COLUNAS, where, parametros, self._ordem_sql(ordenacao),
+                                           tamanho_bloco=tamanho)
+        finally:
+            conexao.close()
+
+    def estatisticas(self, categorias=None, busca=None):
+        sql = "SELECT COUNT(*), SUM(valor), SUM(valor * valor) FROM despesas"
+        where, parametros = self._filtro(categorias, busca)
+        if where:
+            sql += " WHERE " + where
+        with self._lock:
+            registros, soma, soma_quadrados = self._conexao.execute(sql, parametros).fetchone()
+        return estatisticas_de_somas(registros, soma or 0.0, soma_quadrados or 0.0)
+
+
+def resumo_particao(df, tamanho):
+    """Entrada do manifesto de uma partição: tamanho do arquivo, contagens e somas por Tipo/Categoria."""
+    totais = {}
+    if not df.empty:
+        somas = valores_em_reais(df["Valor"]).groupby([df["Tipo"], df["Categoria"]], observed=True).sum()
+        for (tipo, categoria), soma in somas.items():
+            totais.setdefault(str(tipo), {})[str(categoria)] = float(soma)
+    contagens = {str(categoria): int(quantidade)
+                 for categoria, quantidade in df.groupby("Categoria", observed=True).size().items()}
+    return {"bytes": tamanho, "registros": len(df), "totais": totais, "contagens": contagens}
+
+
+def gravar_json_atomico(caminho, conteudo):
+    tmp = caminho + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(conteudo, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, caminho)
+    _fsync_diretorio(caminho)
+
+
+class ArmazenamentoParticionado:
+    """Armazenamento particionado por mês: inserções só tocam a partição do mês do registro e
+    consultas por período leem apenas as partições que o intervalo cobre parcialmente (meses
+    inteiros são respondidos pelo manifesto)."""
+    suporta_consultas = True
+
+    def __init__(self, base, logger=None, max_particoes_em_cache=24):
+        self.base = base
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_particoes_em_cache = max_particoes_em_cache
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()
+        os.makedirs(base.caminho, exist_ok=True)
+        self._manifesto = self._recuperar()
+        self._assinatura_propria = self._assinatura()
+
+    # ---------- Manifesto ----------
+    def _recuperar(self):
+        """Confere o manifesto com os arquivos: partições com tamanho diferente (queda entre a
+        gravação da partição e a do manifesto) são relidas e linhas parciais são descartadas."""
+        manifesto = {}
+        if os.path.exists(self.base.caminho_manifesto):
+            with open(self.base.caminho_manifesto, "r", encoding="utf-8") as f:
+                manifesto = json.load(f)
+        alterado = False
+        meses = self.base.particoes()
+        for mes in list(manifesto):
+            if mes not in meses:
+                del manifesto[mes]
+                alterado = True
+        for mes in meses:
+            caminho = self.base.caminho_particao(mes)
+            tamanho = os.path.getsize(caminho)
+            if mes in manifesto and manifesto[mes]["bytes"] == tamanho:
+                continue
+            with open(caminho, "rb+") as f:
+                conteudo = f.read()
+                fim_valido = conteudo.rfind(b"\n") + 1
+                if fim_valido != len(conteudo):
+                    f.truncate(fim_valido)
+                    f.flush()
+                    os.fsync(f.fileno())
+                    self.logger.warning("Linha parcial descartada da partição: " + caminho)
+            manifesto[mes] = resumo_particao(self.base.ler_particao(mes), os.path.getsize(caminho))
+            alterado = True
+        if alterado:
+            gravar_json_atomico(self.base.caminho_manifesto, manifesto)
+        return manifesto
+
+    def _assinatura(self):
+        try:
+            info = os.stat(self.base.caminho_manifesto)
+            return info.st_mtime_ns, info.st_size
+        except OSError:
+            return None
+
+    def modificado_externamente(self):
+        with self._lock:
+            if self._assinatura() == self._assinatura_propria:
+                return False
+            # Outro processo gravou: relê o manifesto (o cache de partições se invalida pelo tamanho)
+            self._manifesto = self._recuperar()
+            self._assinatura_propria = self._assinatura()
+            return True
+
+    # ---------- Leitura ----------
+    def _ler_particao(self, mes):
+        """Partição tipada, em um cache LRU invalidado pelo tamanho do arquivo."""
+        tamanho = self._manifesto.get(mes, {}).get("bytes")
+        em_cache = self._cache.get(mes)
+        if em_cache is not None and em_cache[0] == tamanho:
+            self._cache.move_to_end(mes)
+            return em_cache[1]
+        df = self.base.ler_particao(mes)
+        self._cache[mes] = (tamanho, df)
+        while len(self._cache) > self.max_particoes_em_cache:
+            self._cache.popitem(last=False)
+        return df
+
+    def carregar(self, colunas=None):
+        with self._lock:
+            return self.base.ler(colunas)
+
+    def fechar(self):
+        # Cada gravação já abre e fecha o arquivo da partição; só o cache ocupa memória
+        with self._lock:
+            self._cache.clear()
+
+    # ---------- Escrita ----------
+    def anexar(self, registro):
+        self.anexar_lote([registro])
+
+    def anexar_lote(self, registros):
+        por_mes = {}
+        for registro in registros:
+            por_mes.setdefault(self.base.mes_de(registro.get("Data")), []).append(registro)
+        with self._lock:
+            for mes, linhas in por_mes.items():
+                caminho = self.base.caminho_particao(mes)
+                novo = not os.path.exists(caminho)
+                with open(caminho, "a", encoding="utf-8", newline="") as f:
+                    escritor = csv.writer(f, lineterminator="\n")
+                    if novo:
+                        escritor.writerow(COLUNAS)
+                    for registro in linhas:
+                        escritor.writerow([registro.get(coluna, "") for coluna in COLUNAS])
+                    f.flush()
+                    os.fsync(f.fileno())
+                entrada = self._manifesto.setdefault(mes, {"bytes": 0, "registros": 0, "totais": {}, "contagens": {}})
+                for registro in linhas:
+                    tipo, categoria = str(registro.get("Tipo")), str(registro.get("Categoria"))
+                    totais_tipo = entrada["totais"].setdefault(tipo, {})
+                    totais_tipo[categoria] = totais_tipo.get(categoria, 0.0) + valor_registro(registro)
+                    entrada["contagens"][categoria] = entrada["contagens"].get(categoria, 0) + 1
+                entrada["registros"] += len(linhas)
+                entrada["bytes"] = os.path.getsize(caminho)
+            gravar_json_atomico(self.base.caminho_manifesto, self._manifesto)
+            self._assinatura_propria = self._assinatura()
+
+    # ---------- Consultas ----------
+    def calcular_agregados(self):
+        """Totais gerais somados a partir do manifesto, sem ler nenhuma partição."""
+        with self._lock:
+            estado = EstadoAgregado()
+            for entrada in self._manifesto.values():
+                for tipo, por_categoria in entrada["totais"].items():
+                    estado.total_por_tipo[tipo] += sum(por_categoria.values())
+                for categoria, quantidade in entrada["contagens"].items():
+                    estado.registros_por_categoria[categoria] += quantidade
+                estado.total_registros += entrada["registros"]
+            return estado
+
+    def totais_por_categoria(self, inicio=None, fim=None, tipo=None):
+        totais = defaultdict(float)
+        with self._lock:
+            for mes, entrada in self._manifesto.items():
+                if mes == self.base.SEM_DATA:
+                    if inicio is None and fim is None:
+                        cobertura = "inteiro"
+                    else:
+                        continue
+                else:
+                    inicio_mes, fim_mes = self.base.intervalo_mes(mes)
+                    if (inicio is not None and fim_mes < inicio) or (fim is not None and inicio_mes > fim):
+                        continue
+                    inteiro = (inicio is None or inicio <= inicio_mes) and (fim is None or fim >= fim_mes)
+                    cobertura = "inteiro" if inteiro else "parcial"
+                if cobertura == "inteiro":
+                    for tipo_particao, por_categoria in entrada["totais"].items():
+                        if tipo is None or tipo_particao == tipo:
+                            for categoria, soma in por_categoria.items():
+                                totais[categoria] += soma
+                    continue
+                df = self._ler_particao(mes)
+                mascara = pd.Series(True, index=df.index)
+                if inicio is not None:
+                    mascara &= df["Data"] >= inicio
+                if fim is not None:
+                    mascara &= df["Data"] <= fim
+                if tipo is not None:
+                    mascara &= df["Tipo"] == tipo
+                filtrado = df[mascara]
+                for categoria, soma in valores_em_reais(filtrado["Valor"]).groupby(
+                        filtrado["Categoria"], observed=True).sum().items():
+                    totais[str(categoria)] += float(soma)
+        serie = pd.Series(totais, dtype="float64", name="Valor")
+        serie.index.name = "Categoria"
+        return serie.sort_values(ascending=False)
+
+    def tendencia_mensal(self, inicio=None, fim=None, tipo=None):
+        """Meses inteiros saem do manifesto; só os meses das pontas do intervalo são lidos."""
+        totais = {}
+        with self._lock:
+            for mes in self._manifesto:
+                if mes == self.base.SEM_DATA:
+                    continue
+                inicio_mes, fim_mes = self.base.intervalo_mes(mes)
+                if (inicio is not None and fim_mes < inicio) or (fim is not None and inicio_mes > fim):
+                    continue
+                por_categoria = self.totais_por_categoria(
+                    inicio_mes if inicio is None else max(inicio, inicio_mes),
+                    fim_mes if fim is None else min(fim, fim_mes), tipo)
+                for categoria, soma in por_categoria.items():
+                    totais[(inicio_mes, categoria)] = float(soma)
+        return tabela_mensal(totais, inicio, fim)
+
+    def consultar_registros(self, categorias=None, ordenacao=None, busca=None):
+        with self._lock:
+            meses = list(self._manifesto)
+            if categorias:
+                # Pula partições que não têm nenhuma das categorias pedidas
+                meses = [mes for mes in meses if any(self._manifesto[mes]["contagens"].get(c) for c in categorias)]
+            df = tipar_dados(pd.DataFrame(columns=COLUNAS))
+            for mes in sorted(meses):
+                df = concatenar(df, self._ler_particao(mes))
+        if categorias:
+            df = df[df["Categoria"].isin(categorias)]
+        mascara = mascara_busca(df["Descrição"], busca)
+        if mascara is not None:
+            df = df[mascara]
+        if ordenacao is not None:
+            df = ordenar(df, *ordenacao)
+        return df
+
+    def estatisticas(self, categorias=None, busca=None):
+        """Quantidade e soma pelo manifesto (sem ler partições); o manifesto não guarda a soma
+        dos quadrados, então o desvio padrão não é calculado. Com busca, lê as partições."""
+        if termos_busca(busca):
+            valores = valores_em_reais(self.consultar_registros(categorias, busca=busca)["Valor"])
+            return estatisticas_de_somas(len(valores), valores.sum())
+        registros, soma = 0, 0.0
+        with self._lock:
+            for entrada in self._manifesto.values():
+                for categoria, quantidade in entrada["contagens"].items():
+                    if not categorias or categoria in categorias:
+                        registros += quantidade
+                for por_categoria in entrada["totais"].values():
+                    soma += sum(total for categoria, total in por_categoria.items()
+                                if not categorias or categoria in categorias)
+        return estatisticas_de_somas(registros, soma)
+
+    def consultar_pagina(self, categorias=None, ordenacao=None, inicio=0, quantidade=50, busca=None):
+        """Ordenando por Data, percorre os meses em ordem e só lê as partições que cobrem a página
+        (as contagens do manifesto dizem quantos registros pular); por Valor ou com busca, lê todas."""
+        if termos_busca(busca):
+            df = self.consultar_registros(categorias, ordenacao, busca)
+            return df.iloc[inicio:inicio + quantidade], len(df)
+        with self._lock:
+            contagens = {mes: sum(quantidade_mes for categoria, quantidade_mes in entrada["contagens"].items()
+                                  if not categorias or categoria in categorias)
+                         for mes, entrada in self._manifesto.items()}
+            total = sum(contagens.values())
+            if ordenacao is None or ordenacao[0] != "Data":
+                return self.consultar_registros(categorias, ordenacao).iloc[inicio:inicio + quantidade], total
+            ascendente = ordenacao[1]
+            meses = sorted((mes for mes, quantidade_mes in contagens.items()
+                            if quantidade_mes and mes != self.base.SEM_DATA), reverse=not ascendente)
+            if contagens.get(self.base.SEM_DATA):
+                # Registros sem data ficam por último, como no sort_values do pandas
+                meses.append(self.base.SEM_DATA)
+            partes, pulados, lidos = [], 0, 0
+            for mes in meses:
+                if not partes and pulados + contagens[mes] <= inicio:
+                    pulados += contagens[mes]
+                    continue
+                df = self._ler_particao(mes)
+                if categorias:
+                    df = df[df["Categoria"].isin(categorias)]
+                partes.append(df.sort_values(by="Data", ascending=ascendente, kind="stable"))
+                lidos += len(df)
+                if pulados + lidos >= inicio + quantidade:
+                    break
+        pagina = tipar_dados(pd.DataFrame(columns=COLUNAS))
+        for parte in partes:
+            pagina = concatenar(pagina, parte)
+        return pagina.iloc[inicio - pulados:inicio - pulados + quantidade], total
+
+    def blocos_registros(self, categorias=None, ordenacao=None, busca=None, tamanho=50_000):
+        """Sem ordenação ou por Data, uma partição por vez, na ordem dos meses (meses pequenos são
+        juntados até `tamanho` linhas); por Valor a ordem é global, então a seleção inteira é
+        carregada e dividida em blocos."""
+        if ordenacao is not None and ordenacao[0] != "Data":
+            df = self.consultar_registros(categorias, ordenacao, busca)
+            for inicio in range(0, len(df), tamanho):
+                yield df.iloc[inicio:inicio + tamanho]
+            return
+        with self._lock:
+            meses = [mes for mes, entrada in self._manifesto.items()
+                     if entrada["registros"] and (not categorias or any(entrada["contagens"].get(c) for c in categorias))]
+        if ordenacao is None:
+            meses.sort()
+        else:
+            # Registros sem data ficam por último, como no sort_values do pandas
+            meses = sorted((mes for mes in meses if mes != self.base.SEM_DATA), reverse=not ordenacao[1]) \
+                + [mes for mes in meses if mes == self.base.SEM_DATA]
+        pendente = None
+        for mes in meses:
+            with self._lock:
+                df = self._ler_particao(mes)
+            if categorias:
+                df = df[df["Categoria"].isin(categorias)]
+            mascara = mascara_busca(df["Descrição"], busca)
+            if mascara is not None:
+                df = df[mascara]
+            if ordenacao is not None:
+                df = df.sort_values(by="Data", ascending=ordenacao[1], kind="stable")
+            pendente = concatenar(pendente, df) if pendente is not None else df
+            while len(pendente) >= tamanho:
+                yield pendente.iloc[:tamanho]
+                pendente = pendente.iloc[tamanho:]
+        if pendente is not None and len(pendente):
+            yield pendente
+
+
+_armazenamentos = {}
+_lock_armazenamentos = threading.Lock()
+
+
+def obter_armazenamento(caminho_csv, formato=None, logger=None):
+    """Retorna o armazenamento compartilhado por todas as sessões do processo: o diário sobre o
+    arquivo CSV/Arrow/Parquet, o banco SQLite ou as partições mensais, conforme o formato configurado."""
+    base = criar_base(caminho_csv, formato)
+    with _lock_armazenamentos:
+        armazenamento = _armazenamentos.get(base.caminho)
+        if armazenamento is None:
+            if base.formato == "sqlite":
+                armazenamento = ArmazenamentoSQLite(base, logger=logger)
+            elif base.formato == "particionado":
+                max_cache = int(os.getenv("PARTICOES_MAX_EM_CACHE", "24"))
+                armazenamento = ArmazenamentoParticionado(base, logger=logger, max_particoes_em_cache=max_cache)
+            else:
+                limite = int(os.getenv("DIARIO_LIMITE_COMPACTACAO", "1000"))
+                armazenamento = Diario(base, limite_compactacao=limite, logger=logger)
+            _armazenamentos[base.caminho] = armazenamento
+        return armazenamento
+
+
+class RepositorioDespesas:
+    """Conjunto de dados único do processo, compartilhado por todas as sessões.
+
+    O DataFrame retornado por obter() é compartilhado: as sessões devem tratá-lo
+    como somente leitura (usar .copy() antes de modificar). As colunas são
+    carregadas sob demanda: obter(colunas) garante ao menos as colunas pedidas.
+    Com armazenamentos que suportam consultas (SQLite), totais e listagens são
+    resolvidos no banco e o DataFrame completo nunca precisa ser carregado; nos
+    demais, totais por período e estatísticas vêm de um CuboAgregado incremental.
+    """
+
+    def __init__(self, armazenamento, carregador=None, logger=None, reconciliar_a_cada=10000):
+        self.armazenamento = armazenamento
+        self.carregador = carregador or armazenamento.carregar
+        self.logger = logger or logging.getLogger(__name__)
+        self.reconciliar_a_cada = reconciliar_a_cada
+        self.consultas_no_armazenamento = getattr(armazenamento, "suporta_consultas", False)
+        self.versao = 0
+        self.agregados = None
+        self.cubo = None
+        self._desde_reconciliacao = 0
+        self._lock = threading.RLock()
+        self._sem_gravacoes = threading.Condition(self._lock)
+        self._gravacoes_em_andamento = 0
+        self._df = None
+        self._colunas = set(COLUNAS_ESSENCIAIS)
+        self._novos = []
+        # Quantidade de registros por hash (ver chaves_registros), criado na primeira importação
+        self._indice_registros = None
+        self._chaves_pendentes = []
+        # (coluna, ascendente) -> (posições em ordem, chaves ordenadas) sobre as linhas de _df
+        self._ordens = {}
+        # Medido uma vez por carga em memoria_bytes(): memory_usage(deep=True) percorre todas as strings
+        self._bytes_por_linha = None
+        # Índice invertido de Descrição sobre as linhas de _df, criado na primeira busca
+        self._indice_texto = None
+
+    def _aguardar_gravacoes(self):
+        # Uma gravação em andamento poderia ficar duplicada (ou perdida) na releitura
+        self._sem_gravacoes.wait_for(lambda: self._gravacoes_em_andamento == 0)
+
+    def _carregar_df(self):
+        self._aguardar_gravacoes()
+        self._df = self.carregador(colunas=_ordenar_colunas(self._colunas))
+        self._novos = []
+        self._ordens = {}
+        self._bytes_por_linha = None
+        self._indice_texto = None
+
+    def _construir_agregados(self):
+        if self.consultas_no_armazenamento:
+            self._aguardar_gravacoes()
+            return self.armazenamento.calcular_agregados()
+        return EstadoAgregado.construir(self.obter(COLUNAS_ESSENCIAIS))
+
+    def _atualizar(self):
+        """Carrega o estado inicial e descarta tudo se os dados mudaram fora do processo."""
+        if self.agregados is not None and self.armazenamento.modificado_externamente():
+            self.logger.info("Arquivos de dados alterados externamente, recarregando")
+            self._df = None
+            self._novos = []
+            self.agregados = None
+            self.cubo = None
+            self._indice_registros = None
+            self._chaves_pendentes = []
+        if self.agregados is None:
+            # Estado provisório: o obter() chamado durante a construção não deve reentrar aqui
+            self.agregados = EstadoAgregado()
+            self.agregados = self._construir_agregados()
+            self._desde_reconciliacao = 0
+            self.versao += 1
+
+    def obter(self, colunas=None):
+        """Retorna a versão atual dos dados, recarregando só se os arquivos mudaram fora do processo
+        ou se alguma coluna pedida ainda não foi lida (colunas=None pede todas)."""
+        with self._lock:
+            self._atualizar()
+            faltantes = set(colunas if colunas is not None else COLUNAS) - self._colunas
+            if faltantes:
+                self._colunas |= faltantes
+                self._df = None
+            if self._df is None:
+                self._carregar_df()
+            if self._novos:
+                # Materializa uma vez por versão, para todas as sessões
+                novos = tipar_dados(pd.DataFrame(self._novos, columns=COLUNAS), self._colunas)
+                self._estender_ordens(novos, len(self._df))
+                if self._indice_texto is not None:
+                    self._indice_texto.adicionar(novos["Descrição"])
+                self._df = concatenar(self._df, novos)
+                self._novos = []
+            return self._df
+
+    def obter_agregados(self):
+        """Totais atuais mantidos incrementalmente; só varre os dados na reconciliação periódica."""
+        with self._lock:
+            self._atualizar()
+            if self.reconciliar_a_cada and self._desde_reconciliacao >= self.reconciliar_a_cada:
+                self.reconciliar()
+            return self.agregados
+
+    def agregados_carregados(self):
+        """Cópia dos totais atuais sem carregar nem recarregar nada (None se ainda não foram carregados).
+        Usada na coleta de métricas, que não deve esperar por leituras de arquivo."""
+        if not self._lock.acquire(timeout=1):
+            return None
+        try:
+            return self.agregados.copiar() if self.agregados is not None else None
+        finally:
+            self._lock.release()
+
+    def reconciliar(self):
+        """Recalcula os agregados com uma varredura completa e corrige divergências."""
+        with self._lock:
+            self._atualizar()
+            completo = self._construir_agregados()
+            divergencias = self.agregados.divergencias(completo)
+            if divergencias:
+                self.logger.warning("Agregados divergentes corrigidos na reconciliação: " + ", ".join(divergencias))
+            self.agregados = completo
+            # O cubo é refeito na próxima consulta, a partir da mesma varredura
+            self.cubo = None
+            self._desde_reconciliacao = 0
+            return divergencias
+
+    def memoria_bytes(self):
+        """Estimativa dos bytes mantidos em memória: DataFrame, índices de ordenação e cubo."""
+        with self._lock:
+            total = 0
+            if self._df is not None:
+                if self._bytes_por_linha is None:
+                    self._bytes_por_linha = self._df.memory_usage(deep=True).sum() / max(len(self._df), 1)
+                total += self._bytes_por_linha * (len(self._df) + len(self._novos))
+            total += sum(posicoes.nbytes + chaves.nbytes for posicoes, chaves in self._ordens.values())
+            if self.cubo is not None:
+                total += self.cubo.memoria_bytes()
+            if self._indice_registros is not None:
+                total += self._indice_registros.memory_usage(deep=False)
+            if self._indice_texto is not None:
+                total += self._indice_texto.memoria_bytes()
+            return int(total)
+
+    def fechar(self):
+        """Espera as gravações em andamento, descarta os dados em memória e fecha o armazenamento."""
+        with self._lock:
+            self._aguardar_gravacoes()
+            self._df = None
+            self._novos = []
+            self._ordens = {}
+            self._indice_texto = None
+            self.agregados = None
+            self.cubo = None
+            self._indice_registros = None
+            self._chaves_pendentes = []
+            self.armazenamento.fechar()
+
+    def _obter_cubo(self):
+        if self.cubo is None:
+            self.cubo = CuboAgregado.construir(self.obter(COLUNAS_ESSENCIAIS))
+        return self.cubo
+
+    # ---------- Consultas usadas pelas abas ----------
+    def categorias(self):
+        """Categorias existentes, a partir dos agregados (sem varrer os registros)."""
+        return sorted(str(categoria) for categoria, quantidade in self.obter_agregados().registros_por_categoria.items()
+                      if quantidade and not pd.isna(categoria))
+
+    def totais_por_categoria(self, inicio=None, fim=None, tipo=None):
+        """Soma de Valor por Categoria no intervalo [inicio, fim] (datas inclusivas), em ordem decrescente."""
+        inicio = inicio.ceil("D") if inicio is not None else None
+        fim = fim.floor("D") if fim is not None else None
+        with self._lock:
+            self._atualizar()
+            if self.consultas_no_armazenamento:
+                return self.armazenamento.totais_por_categoria(inicio, fim, tipo)
+            return self._obter_cubo().totais_por_categoria(inicio, fim, tipo)
+
+    def tendencia_mensal(self, inicio=None, fim=None, tipo=None):
+        """Soma de Valor por mês (linhas) e Categoria (colunas) no intervalo [inicio, fim]; sem limites,
+        do primeiro ao último mês com registros."""
+        inicio = inicio.ceil("D") if inicio is not None else None
+        fim = fim.floor("D") if fim is not None else None
+        with self._lock:
+            self._atualizar()
+            if self.consultas_no_armazenamento:
+                return self.armazenamento.tendencia_mensal(inicio, fim, tipo)
+            return self._obter_cubo().tendencia_mensal(inicio, fim, tipo)
+
+    def estatisticas(self, categorias=None, busca=None):
+        """Quantidade, soma e média de Valor dos registros (filtrados por categoria), sem varrer as linhas.
+        Com busca, somam-se só as linhas encontradas pelo índice de Descrição."""
+        with self._lock:
+            self._atualizar()
+            if self.consultas_no_armazenamento:
+                return self.armazenamento.estatisticas(categorias, busca)
+            if not termos_busca(busca):
+                return self._obter_cubo().estatisticas(categorias)
+            df = self.obter()
+            mascara = self._mascara_busca(busca)
+        if categorias:
+            mascara &= df["Categoria"].isin(categorias).to_numpy()
+        valores = valores_em_reais(df["Valor"][mascara])
+        return estatisticas_de_somas(len(valores), valores.sum(), (valores * valores).sum())
+
+    def consultar_registros(self, categorias=None, ordenacao=None, busca=None):
+        """Registros completos filtrados por categoria e busca em Descrição e ordenados por (coluna, ascendente)."""
+        with self._lock:
+            self._atualizar()
+            if self.consultas_no_armazenamento:
+                return self.armazenamento.consultar_registros(categorias, ordenacao, busca)
+            df = self.obter()
+            mascara = self._mascara_busca(busca)
+        if mascara is not None:
+            df = df[mascara]
+        if categorias:
+            df = df[df["Categoria"].isin(categorias)]
+        if ordenacao is not None:
+            df = ordenar(df, *ordenacao)
+        return df
+
+    # ---------- Busca e paginação ----------
+    def _mascara_busca(self, busca):
+        """Linhas de _df encontradas pela busca (None sem termos); chamado com o lock, após obter()."""
+        if not termos_busca(busca):
+            return None
+        if self._indice_texto is None:
+            self._indice_texto = IndiceTexto()
+            self._indice_texto.adicionar(self._df["Descrição"])
+        return self._indice_texto.mascara(busca)
+
+    def _ordem(self, ordenacao):
+        """Posições de _df na ordem pedida (empates pela ordem de inserção), calculadas uma vez."""
+        if ordenacao not in self._ordens:
+            chaves = _chaves_ordenacao(self._df[ordenacao[0]], ordenacao[1])
+            posicoes = np.argsort(chaves, kind="stable")
+            self._ordens[ordenacao] = (posicoes, chaves[posicoes])
+        return self._ordens[ordenacao][0]
+
+    def _estender_ordens(self, novos, inicio):
+        # Intercala as linhas novas nas ordens já calculadas, sem reordenar tudo: O(n) por lote.
+        # As chaves de texto são posições entre os valores da coluna inteira: essas ordens são refeitas
+        for ordenacao in [ordenacao for ordenacao in self._ordens if _coluna_texto(novos[ordenacao[0]])]:
+            del self._ordens[ordenacao]
+        for ordenacao, (posicoes, chaves) in self._ordens.items():
+            chaves_novas = _chaves_ordenacao(novos[ordenacao[0]], ordenacao[1])
+            ordem_novas = np.argsort(chaves_novas, kind="stable")
+            chaves_novas = chaves_novas[ordem_novas]
+            pontos = np.searchsorted(chaves, chaves_novas, side="right")
+            self._ordens[ordenacao] = (np.insert(posicoes, pontos, ordem_novas + inicio),
+                                       np.insert(chaves, pontos, chaves_novas))
+
+    def pagina_registros(self, categorias=None, ordenacao=None, pagina=1, por_pagina=50, busca=None):
+        """Uma página dos registros filtrados (categorias e busca em Descrição) e ordenados por
+        (coluna, ascendente), e o total de registros que passam no filtro. Só as linhas da página
+        são materializadas."""
+        inicio = max(pagina - 1, 0) * por_pagina
+        with self._lock:
+            self._atualizar()
+            if self.consultas_no_armazenamento:
+                return self.armazenamento.consultar_pagina(categorias, ordenacao, inicio, por_pagina, busca)
+            df, posicoes = self._posicoes_selecao(categorias, ordenacao, busca)
+            return df.iloc[posicoes[inicio:inicio + por_pagina]], len(posicoes)
+
+    def blocos_registros(self, categorias=None, ordenacao=None, busca=None, tamanho=50_000):
+        """Gerador dos registros filtrados e ordenados como em pagina_registros(), em DataFrames de
+        até `tamanho` linhas. Em memória, cada bloco é uma cópia só das suas linhas (a seleção é
+        um vetor de posições); no SQLite e nas partições, os blocos são lidos aos poucos."""
+        with self._lock:
+            self._atualizar()
+            if not self.consultas_no_armazenamento:
+                df, posicoes = self._posicoes_selecao(categorias, ordenacao, busca)
+        if self.consultas_no_armazenamento:
+            yield from self.armazenamento.blocos_registros(categorias, ordenacao, busca, tamanho)
+            return
+        # Inserções posteriores criam outro DataFrame: os blocos saem do retrato tirado acima
+        for inicio in range(0, len(posicoes), tamanho):
+            yield df.iloc[posicoes[inicio:inicio + tamanho]]
+
+    def _posicoes_selecao(self, categorias, ordenacao, busca):
+        """(DataFrame, posições das linhas filtradas na ordem pedida); chamado com o lock."""
+        df = self.obter()
+        posicoes = self._ordem(ordenacao) if ordenacao is not None else np.arange(len(df))
+        mascara = self._mascara_busca(busca)
+        if mascara is not None:
+            posicoes = posicoes[mascara[posicoes]]
+        if categorias:
+            posicoes = posicoes[df["Categoria"].isin(categorias).to_numpy()[posicoes]]
+        return df, posicoes
+
+    def anexar(self, registro):
+        """Grava o registro e o torna visível para todas as sessões."""
+        self.anexar_lote([registro])
+
+    def anexar_lote(self, registros):
+        """Grava os registros em uma única escrita, com uma única atualização dos agregados."""
+        registros = list(registros)
+        with self._lock:
+            self._atualizar()
+            self._gravacoes_em_andamento += 1
+        self._gravar(registros)
+
+    def _indice(self):
+        """Índice de duplicatas: quantidade de registros existentes por hash."""
+        if self._indice_registros is None:
+            self._chaves_pendentes = []
+            self._indice_registros = pd.Series(chaves_registros(self.obter())).value_counts()
+        if self._chaves_pendentes:
+            pendentes = pd.Series(np.concatenate(self._chaves_pendentes)).value_counts()
+            self._indice_registros = self._indice_registros.add(pendentes, fill_value=0).astype("int64")
+            self._chaves_pendentes = []
+        return self._indice_registros
+
+    def importar(self, registros):
+        """Grava em um único lote os registros (DataFrame no esquema de COLUNAS) que ainda não existem.
+
+        A comparação é pelo hash de cada registro e conta repetições: reimportar o mesmo extrato
+        não duplica nada, mas dois lançamentos iguais no mesmo arquivo continuam entrando se
+        ainda não existirem. Retorna (quantidade gravada, quantidade de duplicatas)."""
+        chaves = chaves_registros(registros)
+        with self._lock:
+            self._atualizar()
+            # n-ésima ocorrência de cada hash no lote x quantas já existem
+            ocorrencia = pd.Series(chaves).groupby(chaves).cumcount().to_numpy()
+            existentes = self._indice().reindex(chaves, fill_value=0).to_numpy()
+            novos = ocorrencia >= existentes
+            if not novos.any():
+                return 0, len(registros)
+            # Reserva as chaves antes de gravar: uma importação simultânea do mesmo arquivo vê o lote
+            self._chaves_pendentes.append(chaves[novos])
+            self._gravacoes_em_andamento += 1
+        lote = registros[novos].to_dict("records")
+        self._gravar(lote, indexado=True)
+        return len(lote), int((~novos).sum())
+
+    def _gravar(self, registros, indexado=False):
+        # Chamado com _gravacoes_em_andamento já incrementado; grava fora do lock,
+        # para que envios simultâneos sejam agrupados pelo diário
+        gravado = False
+        try:
+            self.armazenamento.anexar_lote(registros)
+            gravado = True
+        finally:
+            with self._lock:
+                if gravado:
+                    if self._df is not None:
+                        self._novos.extend(registros)
+                    if len(registros) == 1:
+                        self.agregados.aplicar(registros[0])
+                    else:
+                        self.agregados.aplicar_lote(registros)
+                    if self.cubo is not None:
+                        self.cubo.aplicar_lote(tipar_dados(pd.DataFrame(registros, columns=COLUNAS), COLUNAS_ESSENCIAIS))
+                    if self._indice_registros is not None and not indexado:
+                        self._chaves_pendentes.append(chaves_registros(pd.DataFrame(registros, columns=COLUNAS)))
+                    self._desde_reconciliacao += len(registros)
+                    self.versao += 1
+                elif indexado:
+                    # As chaves reservadas não foram gravadas
+                    self._indice_registros = None
+                self._gravacoes_em_andamento -= 1
+                self._sem_gravacoes.notify_all()
+
+
+def _chaves_ordenacao(serie, ascendente):
+    """Chaves numéricas em que a ordem crescente é a ordem pedida, com valores ausentes por último."""
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        valores = serie.to_numpy(dtype="datetime64[ns]").view("int64")
+        ausentes = serie.isna().to_numpy()
+        chaves = valores if ascendente else -valores
+        return np.where(ausentes, np.iinfo("int64").max, chaves)
+    if _coluna_texto(serie):
+        # Posição de cada texto entre os valores distintos em ordem de código (a mesma do SQLite);
+        # depende da coluna inteira, então não serve para intercalar linhas novas
+        codigos, _ = pd.factorize(serie.astype("object"), sort=True)
+        valores = codigos.astype("float64")
+        return np.where(codigos < 0, np.inf, valores if ascendente else -valores)
+    valores = pd.to_numeric(serie, errors="coerce").to_numpy(dtype="float64")
+    return np.where(np.isnan(valores), np.inf, valores if ascendente else -valores)
+
+
+def _coluna_texto(serie):
+    return not pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_datetime64_any_dtype(serie)
+
+
+def ordenar(df, coluna, ascendente):
+    """df ordenado por uma coluna, com empates na ordem atual e valores ausentes por último. Texto
+    (inclusive categórico) segue a ordem dos caracteres, não a ordem das categorias."""
+    return df.iloc[np.argsort(_chaves_ordenacao(df[coluna], ascendente), kind="stable")]
+
+
+_repositorios = {}
+
+
+def obter_repositorio(caminho_csv, carregador=None, logger=None):
+    """Retorna o repositório compartilhado do processo para o arquivo (carregado uma única vez)."""
+    armazenamento = obter_armazenamento(caminho_csv, logger=logger)
+    with _lock_armazenamentos:
+        repositorio = _repositorios.get(armazenamento.base.caminho)
+        if repositorio is None:
+            reconciliar_a_cada = int(os.getenv("AGREGADOS_RECONCILIAR_A_CADA", "10000"))
+            repositorio = RepositorioDespesas(armazenamento, carregador=carregador, logger=logger,
+                                              reconciliar_a_cada=reconciliar_a_cada)
+            _repositorios[armazenamento.base.caminho] = repositorio
+        return repositorio
+
+
+def repositorio_existente(caminho_csv):
+    """Repositório já criado por obter_repositorio() para o arquivo, ou None; nunca abre arquivos."""
+    caminho = criar_base(caminho_csv).caminho
+    with _lock_armazenamentos:
+        return _repositorios.get(caminho)
+
+
+def descartar_repositorio(repositorio):
+    """Fecha o repositório e seu armazenamento e os retira do processo; o próximo
+    obter_repositorio() do mesmo arquivo lê tudo de novo."""
+    caminho = repositorio.armazenamento.base.caminho
+    with _lock_armazenamentos:
+        if _repositorios.get(caminho) is repositorio:
+            del _repositorios[caminho]
+        if _armazenamentos.get(caminho) is repositorio.armazenamento:
+            del _armazenamentos[caminho]
+    repositorio.fechar()
+
+
+# ========== Migração ==========
+def migrar_csv(caminho_csv, formato, logger=None):
+    """Converte o CSV (incluindo registros pendentes no diário) para o formato indicado.
+
+    Deve ser executada com o aplicativo parado. O CSV original é mantido como cópia de segurança.
+    """
+    logger = logger or logging.getLogger(__name__)
+    origem = Diario(BaseCSV(caminho_csv), logger=logger)
+    # Incorpora o diário ao CSV: o diário fica vazio e pode ser usado pelo novo formato
+    origem.compactar()
+    destino = criar_base(caminho_csv, formato)
+    df = origem.base.ler()
+    destino.escrever(df, destino.caminho + ".tmp")
+    os.replace(destino.caminho + ".tmp", destino.caminho)
+    _fsync_diretorio(destino.caminho)
+    logger.info(f"Migração concluída: {len(df)} registros de {caminho_csv} para {destino.caminho}")
+    return destino.caminho
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ferramentas de armazenamento do Gerenciador de Despesas")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+    migrar = subcomandos.add_parser("migrar", help="Converter o CSV para Arrow IPC, Parquet, SQLite ou partições mensais")
+    migrar.add_argument("--csv", default=os.getenv("DESPESAS_CSV", "despesas_br.csv"))
+    migrar.add_argument("--formato", choices=["arrow", "parquet", "sqlite", "particionado"], default="arrow")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.comando == "migrar":
+        print(f"Arquivo criado: {migrar_csv(args.csv, args.formato)}")
@@ -0,0 +1,340 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import agregacao_paralela  # noqa: E402
+from agregados import CuboAgregado, EstadoAgregado  # noqa: E402
+from armazenamento import RepositorioDespesas, migrar_csv, obter_armazenamento  # noqa: E402
+from convert_csv import converter_csv  # noqa: E402
+from exportacao import exportar_arquivo  # noqa: E402
+from graficos import gerar_analise  # noqa: E402
+from gerar_dados import gerar_exportacao_banco, gerar_registros, gravar_csv  # noqa: E402
+
+DIRETORIO = os.path.dirname(os.path.abspath(__file__))
+TAMANHOS_PADRAO = [1_000, 10_000, 100_000]
+# Ordenações e filtros da aba Registros, na ordem do selectbox do aplicativo
+ORDENACOES = [("Data", False), ("Data", True), ("Valor", False), ("Valor", True)]
+FILTRO_CATEGORIAS = ["Alimentação", "Transporte"]
+REGISTROS_ADICIONADOS = 100
+
+logger = logging.getLogger("benchmarks")
+
+
+def _periodos(hoje):
+    # Mesmos intervalos de intervalo_periodo() no app.py, relativos à última data da massa gerada
+    inicio_mes = hoje.normalize().replace(day=1)
+    return [(inicio_mes, inicio_mes + pd.offsets.MonthEnd(0)), (hoje - pd.DateOffset(months=3), hoje), (None, None),
+            # "Personalizado": intervalo arbitrário no meio da massa
+            (hoje - pd.DateOffset(days=400), hoje - pd.DateOffset(days=45))]
+
+
+def _arquivo_gerado(diretorio, prefixo, gerador, quantidade, semente):
+    """Gera a massa uma vez por (tamanho, semente) e reaproveita nas execuções seguintes."""
+    caminho = os.path.join(diretorio, f"{prefixo}_{quantidade}_{semente}.csv")
+    if not os.path.exists(caminho):
+        gravar_csv(gerador(quantidade, semente), caminho + ".tmp")
+        os.replace(caminho + ".tmp", caminho)
+    return caminho
+
+
+def _cronometrar(funcao, *args):
+    inicio = time.perf_counter()
+    funcao(*args)
+    return time.perf_counter() - inicio
+
+
+# ========== Casos ==========
+# Cada caso recebe o contexto do tamanho atual e retorna a duração de uma repetição em segundos
+
+def caso_carregar_dados(ctx):
+    # O mesmo que carregar_dados() faz no app.py: arquivo principal + registros pendentes, tipados
+    return _cronometrar(ctx["armazenamento"].carregar)
+
+
+def caso_construir_agregados(ctx):
+    return _cronometrar(EstadoAgregado.construir, ctx["df"])
+
+
+def caso_calcular_metricas(ctx):
+    # Leitura dos totais em uma interação (estado incremental já construído)
+    def calcular():
+        agregados = ctx["repositorio"].obter_agregados()
+        return agregados.total_despesas, agregados.total_receitas, agregados.saldo
+    return _cronometrar(calcular)
+
+
+def caso_analise_primeira(ctx):
+    # Primeira análise de um repositório novo: inclui a construção do cubo
+    repositorio = RepositorioDespesas(ctx["armazenamento"], logger=logger)
+    repositorio.obter_agregados()
+    inicio, fim = ctx["periodos"][0]
+    return _cronometrar(repositorio.totais_por_categoria, inicio, fim, "Despesa")
+
+
+def caso_cubo_serial(ctx):
+    return _cronometrar(CuboAgregado.construir, ctx["df"], 1)
+
+
+def caso_cubo_paralelo(ctx):
+    # Fatias em AGREGACAO_PROCESSOS processos, mesmo abaixo de AGREGACAO_MIN_REGISTROS
+    return _cronometrar(CuboAgregado.construir, ctx["df"], agregacao_paralela.PROCESSOS, 0)
+
+
+def caso_analise(ctx):
+    def consultar():
+        for inicio, fim in ctx["periodos"]:
+            ctx["repositorio"].totais_por_categoria(inicio, fim, "Despesa")
+    return _cronometrar(consultar) / len(ctx["periodos"])
+
+
+def caso_analise_pandas(ctx):
+    # Referência: filtro + groupby direto no DataFrame, sem o cubo
+    df = ctx["df"]
+
+    def consultar():
+        for inicio, fim in ctx["periodos"]:
+            mascara = df["Tipo"] == "Despesa"
+            if inicio is not None:
+                mascara &= (df["Data"] >= inicio.ceil("D")) & (df["Data"] <= fim.floor("D"))
+            df[mascara].groupby("Categoria", observed=True)["Valor"].sum().sort_values(ascending=False)
+    return _cronometrar(consultar) / len(ctx["periodos"])
+
+
+def caso_tendencia_mensal(ctx):
+    def consultar():
+        for inicio, fim in ctx["periodos"]:
+            ctx["repositorio"].tendencia_mensal(inicio, fim, "Despesa")
+    return _cronometrar(consultar) / len(ctx["periodos"])
+
+
+def caso_adicionar_retroativo(ctx):
+    # Registro com data antiga seguido de uma consulta que o inclui: atualização incremental dos índices
+    repositorio = ctx["repositorio"]
+    inicio, fim = ctx["periodos"][-1]
+
+    def adicionar():
+        for i in range(REGISTROS_ADICIONADOS):
+            repositorio.anexar({"Data": (inicio + pd.DateOffset(days=i)).strftime("%d/%m/%Y"),
+                                "Descrição": f"Benchmark retroativo {i}", "Categoria": "Outros",
+                                "Valor": 10.0 + i, "Tipo": "Despesa"})
+            repositorio.totais_por_categoria(inicio, fim, "Despesa")
+    return _cronometrar(adicionar) / REGISTROS_ADICIONADOS
+
+
+def _caso_graficos(motor):
+    # Gráficos da aba Análise (período "Tudo") a partir das séries já agregadas, no motor dado
+    def caso(ctx):
+        totais = ctx["repositorio"].totais_por_categoria(None, None, "Despesa")
+        tendencia = ctx["repositorio"].tendencia_mensal(None, None, "Despesa")
+        return _cronometrar(gerar_analise, totais, tendencia, motor)
+    return caso
+
+
+def caso_registros_primeira_pagina(ctx):
+    # Primeira página de um repositório novo: inclui a ordenação completa
+    repositorio = RepositorioDespesas(ctx["armazenamento"], logger=logger)
+    repositorio.obter()
+    return _cronometrar(repositorio.pagina_registros, None, ORDENACOES[0], 1, 50)
+
+
+def caso_registros_pagina(ctx):
+    def consultar():
+        for ordenacao in ORDENACOES:
+            ctx["repositorio"].pagina_registros(FILTRO_CATEGORIAS, ordenacao, 2, 50)
+            ctx["repositorio"].estatisticas(FILTRO_CATEGORIAS)
+    return _cronometrar(consultar) / len(ORDENACOES)
+
+
+def caso_adicionar_registro(ctx):
+    # Caminho do formulário: gravação durável de um registro + atualização dos agregados
+    repositorio = ctx["repositorio"]
+    data = ctx["hoje"].strftime("%d/%m/%Y")
+
+    def adicionar():
+        for i in range(REGISTROS_ADICIONADOS):
+            repositorio.anexar({"Data": data, "Descrição": f"Benchmark {i}", "Categoria": "Outros",
+                                "Valor": 10.0 + i, "Tipo": "Despesa"})
+    return _cronometrar(adicionar) / REGISTROS_ADICIONADOS
+
+
+def _caso_exportar(formato):
+    # Seleção filtrada e ordenada da aba Registros gravada em blocos (exportacao.py)
+    def caso(ctx):
+        return _cronometrar(lambda: exportar_arquivo(
+            ctx["repositorio"].blocos_registros(FILTRO_CATEGORIAS, ORDENACOES[0]), formato,
+            os.path.join(ctx["trabalho"], f"exportacao.{formato}")))
+    return caso
+
+
+def caso_convert_csv(ctx):
+    return _cronometrar(converter_csv, ctx["exportacao_banco"], os.path.join(ctx["trabalho"], "convertido.csv"))
+
+
+CASOS = {
+    "carregar_dados": caso_carregar_dados,
+    "construir_agregados": caso_construir_agregados,
+    "calcular_metricas": caso_calcular_metricas,
+    "analise_primeira": caso_analise_primeira,
+    "cubo_serial": caso_cubo_serial,
+    "cubo_paralelo": caso_cubo_paralelo,
+    "analise": caso_analise,
+    "analise_pandas": caso_analise_pandas,
+    "tendencia_mensal": caso_tendencia_mensal,
+    "graficos_vega": _caso_graficos("vega"),
+    "graficos_matplotlib": _caso_graficos("matplotlib"),
+    "registros_primeira_pagina": caso_registros_primeira_pagina,
+    "registros_pagina": caso_registros_pagina,
+    "adicionar_registro": caso_adicionar_registro,
+    "adicionar_retroativo": caso_adicionar_retroativo,
+    "exportar_csv": _caso_exportar("csv"),
+    "exportar_parquet": _caso_exportar("parquet"),
+    "convert_csv": caso_convert_csv,
+}
+
+
+def executar(tamanhos, formato="csv", repeticoes=3, semente=42, casos=None, dados=None):
+    """Executa os casos para cada tamanho e retorna a lista de resultados (um por caso e tamanho)."""
+    dados = dados or os.path.join(DIRETORIO, "dados")
+    os.makedirs(dados, exist_ok=True)
+    casos = casos or list(CASOS)
+    if "cubo_paralelo" in casos:
+        # Sobe o pool antes de medir (o spawn dos processos acontece uma vez por processo do aplicativo)
+        agregacao_paralela.agregar(*(np.zeros(2, dtype=tipo) for tipo in ("int32", "int32", "int32", "float64")),
+                                   1, 1, 1, agregacao_paralela.PROCESSOS, 0)
+    resultados = []
+    for quantidade in tamanhos:
+        registros = _arquivo_gerado(dados, "registros", gerar_registros, quantidade, semente)
+        with tempfile.TemporaryDirectory() as trabalho:
+            # Cópia de trabalho: adicionar_registro grava nela
+            caminho = os.path.join(trabalho, "despesas.csv")
+            shutil.copyfile(registros, caminho)
+            if formato != "csv":
+                migrar_csv(caminho, formato, logger=logger)
+            armazenamento = obter_armazenamento(caminho, formato, logger=logger)
+            repositorio = RepositorioDespesas(armazenamento, logger=logger)
+            repositorio.obter_agregados()
+            df = armazenamento.carregar()
+            hoje = df["Data"].max()
+            ctx = {
+                "trabalho": trabalho, "armazenamento": armazenamento, "repositorio": repositorio, "df": df,
+                "hoje": hoje, "periodos": _periodos(hoje),
+            }
+            if "convert_csv" in casos:
+                ctx["exportacao_banco"] = _arquivo_gerado(dados, "banco", gerar_exportacao_banco, quantidade, semente)
+
+            for nome in casos:
+                tempos = [CASOS[nome](ctx) for _ in range(repeticoes)]
+                resultado = {
+                    "caso": nome,
+                    "registros": quantidade,
+                    "segundos_min": min(tempos),
+                    "segundos_mediana": statistics.median(tempos),
+                    "segundos": tempos,
+                }
+                resultados.append(resultado)
+                print(f"{nome:<28}{quantidade:>12,}{resultado['segundos_mediana'] * 1000:>14.3f} ms")
+    return resultados
+
+
+def aceleracoes(resultados):
+    """Razão entre a construção serial e a paralela do cubo, por tamanho (quando os dois casos rodaram)."""
+    medianas = {(r["caso"], r["registros"]): r["segundos_mediana"] for r in resultados}
+    return [{"registros": registros, "serial": serial, "paralelo": medianas[("cubo_paralelo", registros)],
+             "aceleracao": serial / medianas[("cubo_paralelo", registros)]}
+            for (caso, registros), serial in medianas.items()
+            if caso == "cubo_serial" and ("cubo_paralelo", registros) in medianas]
+
+
+def _commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=DIRETORIO, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        alterado = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=DIRETORIO,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        return commit + ("-modificado" if alterado else "")
+    except Exception:
+        return "desconhecido"
+
+
+def comparar(base, atual, tolerancia=1.25):
+    """Compara as medianas de dois arquivos de resultados. Retorna os casos mais lentos que base × tolerância."""
+    anteriores = {(r["caso"], r["registros"]): r["segundos_mediana"] for r in base["resultados"]}
+    regressoes = []
+    print(f"{'caso':<28}{'registros':>12}{'base (ms)':>14}{'atual (ms)':>14}{'razão':>9}")
+    for resultado in atual["resultados"]:
+        chave = (resultado["caso"], resultado["registros"])
+        if chave not in anteriores:
+            continue
+        razao = resultado["segundos_mediana"] / anteriores[chave] if anteriores[chave] else float("inf")
+        marca = " <-- regressão" if razao > tolerancia else ""
+        print(f"{chave[0]:<28}{chave[1]:>12,}{anteriores[chave] * 1000:>14.3f}"
+              f"{resultado['segundos_mediana'] * 1000:>14.3f}{razao:>9.2f}{marca}")
+        if razao > tolerancia:
+            regressoes.append(chave)
+    return regressoes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks do Gerenciador de Despesas com massas sintéticas")
+    parser.add_argument("--tamanhos", default=",".join(str(t) for t in TAMANHOS_PADRAO),
+                        help="Quantidades de registros separadas por vírgula (ex.: 1000,100000,10000000)")
+    parser.add_argument("--formato", default=os.getenv("ARMAZENAMENTO_FORMATO", "csv"),
+                        help="csv, arrow, parquet, sqlite ou particionado")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--casos", help=f"Casos separados por vírgula (padrão: todos): {', '.join(CASOS)}")
+    parser.add_argument("--saida", help="Arquivo JSON de resultados (padrão: benchmarks/resultados/<data>_<commit>.json)")
+    parser.add_argument("--comparar", help="Resultados anteriores para comparar; sai com código 1 se houver regressão")
+    parser.add_argument("--tolerancia", type=float, default=1.25, help="Razão atual/base acima da qual há regressão")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    tamanhos = [int(t) for t in args.tamanhos.split(",")]
+    casos = args.casos.split(",") if args.casos else None
+    desconhecidos = set(casos or []) - set(CASOS)
+    if desconhecidos:
+        parser.error("casos desconhecidos: " + ", ".join(sorted(desconhecidos)))
+
+    momento = datetime.now(timezone.utc)
+    commit = _commit()
+    relatorio = {
+        "commit": commit,
+        "data": momento.isoformat(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "processadores": os.cpu_count(),
+        "processos_agregacao": agregacao_paralela.PROCESSOS,
+        "formato": args.formato,
+        "semente": args.semente,
+        "repeticoes": args.repeticoes,
+        "resultados": executar(tamanhos, args.formato, args.repeticoes, args.semente, casos),
+    }
+    relatorio["aceleracoes"] = aceleracoes(relatorio["resultados"])
+    for item in relatorio["aceleracoes"]:
+        print(f"cubo em {relatorio['processos_agregacao']} processos, {item['registros']:,} registros: "
+              f"{item['aceleracao']:.2f}x")
+    saida = args.saida or os.path.join(DIRETORIO, "resultados", f"{momento:%Y%m%d-%H%M%S}_{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(saida)), exist_ok=True)
+    with open(saida, "w", encoding="utf-8") as arquivo:
+        json.dump(relatorio, arquivo, ensure_ascii=False, indent=2)
+    print(f"Resultados gravados em '{saida}'")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            base = json.load(arquivo)
+        if comparar(base, relatorio, args.tolerancia):
+            sys.exit(1)
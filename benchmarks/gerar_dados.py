@@ -0,0 +1,138 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from armazenamento import COLUNAS, FORMATO_DATA  # noqa: E402
+from convert_csv import categoria_traducao, tipo_traducao  # noqa: E402
+
+# Linhas geradas por bloco; cada bloco tem sua própria semente, então o resultado para um
+# tamanho não depende da memória disponível nem de quantos blocos são gravados por vez
+TAMANHO_BLOCO = 1_000_000
+DATA_INICIAL = "2020-01-01"
+DIAS = 5 * 365
+
+# Categoria -> descrições (com acentos, para exercitar buscas e ordenações por texto)
+DESCRICOES_DESPESA = {
+    "Alimentação": ["Supermercado", "Padaria", "Almoço", "Jantar", "Café da manhã", "Açougue", "Feira", "Lanche"],
+    "Transporte": ["Ônibus", "Metrô", "Uber", "Gasolina", "Estacionamento", "Pedágio"],
+    "Moradia": ["Aluguel", "Condomínio", "Conta de luz", "Conta de água", "Internet", "Gás"],
+    "Saúde": ["Farmácia", "Consulta médica", "Academia", "Exame", "Dentista"],
+    "Lazer": ["Cinema", "Show", "Viagem", "Restaurante", "Streaming"],
+    "Educação": ["Mensalidade", "Livros", "Curso online", "Material escolar"],
+    "Vestuário": ["Roupas", "Sapatos", "Lavanderia"],
+    "Outros": ["Presente", "Doação", "Tarifa bancária", "Diversos"],
+}
+DESCRICOES_RECEITA = {
+    "Salário": ["Salário", "Décimo terceiro", "Bônus"],
+    "Investimentos": ["Dividendos", "Rendimento poupança", "Juros"],
+    "Freelance": ["Projeto freelance", "Consultoria"],
+}
+# Complemento da descrição, para ter milhares de textos distintos e não só o vocabulário acima
+LOCAIS = ["centro", "bairro", "shopping", "online", "São Paulo", "Niterói", "Belém", "Goiânia", "Florianópolis",
+          "Maceió", "Ribeirão Preto", "Vitória", "Curitiba", "Brasília", "Porto Alegre", "Recife"]
+PROPORCAO_RECEITAS = 0.1
+# Horário no formato da exportação do banco (" 9:05", " 18:56")
+HORARIOS = np.array([f" {minuto // 60}:{minuto % 60:02d}" for minuto in range(24 * 60)], dtype=object)
+
+
+def _vocabulario(descricoes):
+    categorias, textos = [], []
+    for categoria, opcoes in descricoes.items():
+        for descricao in opcoes:
+            for local in LOCAIS:
+                categorias.append(categoria)
+                textos.append(f"{descricao} {local}")
+    return np.array(categorias, dtype=object), np.array(textos, dtype=object)
+
+
+def _bloco(indice, quantidade, semente):
+    """Sorteia um bloco: dias (deslocamento desde DATA_INICIAL), descrições, categorias, valores e tipos."""
+    rng = np.random.default_rng([semente, indice])
+    receita = rng.random(quantidade) < PROPORCAO_RECEITAS
+    dias = rng.integers(0, DIAS, quantidade)
+
+    categorias = np.empty(quantidade, dtype=object)
+    descricoes = np.empty(quantidade, dtype=object)
+    for mascara, vocabulario in ((~receita, _vocabulario(DESCRICOES_DESPESA)),
+                                 (receita, _vocabulario(DESCRICOES_RECEITA))):
+        escolhas = rng.integers(0, len(vocabulario[0]), int(mascara.sum()))
+        categorias[mascara] = vocabulario[0][escolhas]
+        descricoes[mascara] = vocabulario[1][escolhas]
+
+    # Despesas pequenas e frequentes, receitas maiores (log-normal), sempre positivas
+    valores = np.where(receita, rng.lognormal(7.5, 0.6, quantidade), rng.lognormal(3.5, 1.0, quantidade))
+    valores = np.maximum(valores, 0.01).round(2)
+    tipos = np.where(receita, "Receita", "Despesa").astype(object)
+    return dias, descricoes, categorias, valores, tipos
+
+
+def _datas(dias, formato):
+    # Formata cada dia distinto uma vez (há no máximo DIAS datas diferentes)
+    textos = (pd.Timestamp(DATA_INICIAL) + pd.to_timedelta(np.arange(DIAS), unit="D")).strftime(formato)
+    return textos.to_numpy(dtype=object)[dias]
+
+
+def gerar_registros(quantidade, semente=42):
+    """Gera os registros no esquema do aplicativo (Data/Descrição/Categoria/Valor/Tipo), bloco a bloco.
+
+    O resultado depende apenas de (quantidade, semente). Retorna um iterador de DataFrames.
+    """
+    for indice, inicio in enumerate(range(0, quantidade, TAMANHO_BLOCO)):
+        dias, descricoes, categorias, valores, tipos = _bloco(indice, min(TAMANHO_BLOCO, quantidade - inicio), semente)
+        yield pd.DataFrame({
+            "Data": _datas(dias, FORMATO_DATA),
+            "Descrição": descricoes,
+            "Categoria": categorias,
+            "Valor": valores,
+            "Tipo": tipos,
+        }, columns=COLUNAS)
+
+
+def gerar_exportacao_banco(quantidade, semente=42):
+    """Gera a mesma massa no formato da exportação do banco lida pelo convert_csv.py."""
+    # Categorias sem equivalente na exportação viram "Other" (que o convert_csv.py traduz para "Outros")
+    categorias_banco = {valor: chave for chave, valor in categoria_traducao.items()}
+    tipos_banco = {valor: chave for chave, valor in tipo_traducao.items()}
+    for indice, inicio in enumerate(range(0, quantidade, TAMANHO_BLOCO)):
+        dias, descricoes, categorias, valores, tipos = _bloco(indice, min(TAMANHO_BLOCO, quantidade - inicio), semente)
+        rng = np.random.default_rng([semente, indice, 1])
+        yield pd.DataFrame({
+            "Date": _datas(dias, "%m/%d/%Y") + HORARIOS[rng.integers(0, len(HORARIOS), len(dias))],
+            "Account": "CUB - online payment",
+            "Category": pd.Series(categorias).map(categorias_banco).fillna("Other").to_numpy(dtype=object),
+            "Subcategory": "",
+            "Note": descricoes,
+            "INR": valores,
+            "Income/Expense": pd.Series(tipos).map(tipos_banco).to_numpy(dtype=object),
+            "Amount": valores,
+            "Currency": "INR",
+            "Description": "",
+        })
+
+
+def gravar_csv(blocos, caminho):
+    """Grava os blocos em um CSV (cabeçalho só no primeiro). Retorna o número de linhas."""
+    total = 0
+    with open(caminho, "w", encoding="utf-8", newline="") as destino:
+        for indice, bloco in enumerate(blocos):
+            bloco.to_csv(destino, header=indice == 0, index=False)
+            total += len(bloco)
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gerar um livro de despesas sintético e determinístico")
+    parser.add_argument("quantidade", type=int, help="Número de registros")
+    parser.add_argument("saida", help="Arquivo CSV de saída")
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--banco", action="store_true", help="Gerar no formato da exportação do banco (convert_csv.py)")
+    args = parser.parse_args()
+
+    gerador = gerar_exportacao_banco if args.banco else gerar_registros
+    total = gravar_csv(gerador(args.quantidade, args.semente), args.saida)
+    print(f"{total} registros gravados em '{args.saida}'")
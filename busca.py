@@ -0,0 +1,99 @@
+import bisect
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+# Letras e dígitos, como o tokenizador unicode61 do FTS5 usado no SQLite
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def dobrar(texto):
+    """Texto em minúsculas e sem acentos ("Metrô" -> "metro")."""
+    decomposto = unicodedata.normalize("NFKD", str(texto))
+    return "".join(c for c in decomposto if not unicodedata.combining(c)).casefold()
+
+
+def termos_busca(consulta):
+    """Termos da consulta já dobrados; cada um casa com qualquer palavra que comece por ele."""
+    return _TOKEN.findall(dobrar(consulta or ""))
+
+
+def mascara_busca(descricoes, consulta):
+    """Máscara das descrições que têm todos os termos como prefixo de alguma palavra, sem índice
+    (para conjuntos pequenos ou já filtrados). None se a consulta não tem termos."""
+    termos = termos_busca(consulta)
+    if not termos:
+        return None
+    codigos, textos = pd.factorize(pd.Series(descricoes))
+    casa = np.array([all(any(palavra.startswith(termo) for palavra in _TOKEN.findall(dobrar(texto)))
+                         for termo in termos) for texto in textos.tolist()] + [False], dtype=bool)
+    return casa[codigos]
+
+
+class IndiceTexto:
+    """Índice invertido das descrições, atualizado a cada lote de linhas novas.
+
+    Cada palavra dobrada aponta para as descrições distintas que a contêm, e cada linha guarda só
+    o código da sua descrição (int32): o índice cresce com o vocabulário, não com o número de
+    registros. Uma busca percorre as palavras com o prefixo pedido (bisect no vocabulário
+    ordenado) e marca as linhas com uma consulta vetorizada aos códigos.
+    """
+
+    def __init__(self):
+        # descrição -> código
+        self._codigos = {}
+        # palavra -> códigos das descrições que a contêm
+        self._palavras = {}
+        self._vocabulario = []
+        # Código da descrição de cada linha, na ordem do DataFrame (-1 = sem descrição)
+        self._linhas = np.empty(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self._linhas)
+
+    def memoria_bytes(self):
+        """Estimativa: códigos das linhas mais ~100 bytes por descrição e por palavra do vocabulário."""
+        return self._linhas.nbytes + 100 * (len(self._codigos) + len(self._vocabulario))
+
+    def adicionar(self, descricoes):
+        """Indexa as linhas seguintes às já indexadas (descrições na ordem do DataFrame)."""
+        codigos_lote, textos = pd.factorize(pd.Series(descricoes))
+        mapa = np.empty(len(textos) + 1, dtype=np.int32)
+        mapa[-1] = -1
+        for posicao, texto in enumerate(textos.tolist()):
+            codigo = self._codigos.get(texto)
+            if codigo is None:
+                codigo = self._codigos[texto] = len(self._codigos)
+                for palavra in set(_TOKEN.findall(dobrar(texto))):
+                    if palavra not in self._palavras:
+                        self._palavras[palavra] = set()
+                        bisect.insort(self._vocabulario, palavra)
+                    self._palavras[palavra].add(codigo)
+            mapa[posicao] = codigo
+        self._linhas = np.concatenate([self._linhas, mapa[codigos_lote]])
+
+    def _codigos_com_prefixo(self, termo):
+        codigos = set()
+        posicao = bisect.bisect_left(self._vocabulario, termo)
+        while posicao < len(self._vocabulario) and self._vocabulario[posicao].startswith(termo):
+            codigos |= self._palavras[self._vocabulario[posicao]]
+            posicao += 1
+        return codigos
+
+    def mascara(self, consulta):
+        """Máscara das linhas cujas descrições têm todos os termos da consulta (como prefixo de
+        alguma palavra). None se a consulta não tem termos."""
+        termos = termos_busca(consulta)
+        if not termos:
+            return None
+        codigos = None
+        for termo in termos:
+            codigos = self._codigos_com_prefixo(termo) if codigos is None else codigos & self._codigos_com_prefixo(termo)
+            if not codigos:
+                break
+        # Última posição: linhas sem descrição (código -1), nunca encontradas
+        casa = np.zeros(len(self._codigos) + 1, dtype=bool)
+        casa[list(codigos)] = True
+        return casa[self._linhas]
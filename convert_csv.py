@@ -1,18 +1,13 @@
-import pandas as pd
-import locale
-from datetime import datetime
+import argparse
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-# Tentar configurar o locale para português do Brasil
-try:
-    locale.setlocale(locale.LC_ALL, 'pt_BR.utf8')
-except:
-    try:
-        locale.setlocale(locale.LC_ALL, 'pt_BR.UTF-8')
-    except:
-        print("Não foi possível configurar o locale para português.")
+import numpy as np
+import pandas as pd
 
-# Carregar os dados
-df = pd.read_csv('expense_data_1.csv')
+from armazenamento import COLUNAS, FORMATO_DATA
 
 # Dicionário de tradução para categorias
 categoria_traducao = {
@@ -37,78 +32,93 @@ tipo_traducao = {
     'Income': 'Receita'
 }
 
-# Nova estrutura do DataFrame
-novo_df = pd.DataFrame(columns=[
-    "Data", "Descrição", "Categoria", "Valor", "Tipo"
-])
+# Formato de data do extrato do banco
+FORMATO_DATA_ORIGEM = "%m/%d/%Y %H:%M"
+# Colunas lidas da exportação (as demais são descartadas já na leitura)
+COLUNAS_ENTRADA = ["Date", "Category", "Note", "Amount", "Income/Expense", "Description",
+                   "Data", "Descrição", "Categoria", "Valor"]
+
+
+def converter_bloco(df):
+    """Converte um bloco da exportação para o formato do aplicativo, coluna a coluna."""
+    df = df.reindex(columns=COLUNAS_ENTRADA)
+
+    # Data em formato brasileiro; se não for possível converter, mantém o texto original
+    datas = pd.to_datetime(df["Date"], format=FORMATO_DATA_ORIGEM, errors="coerce")
+    # Formata cada dia distinto uma vez só (um extrato repete poucos dias em muitas linhas)
+    codigos, dias = pd.factorize(datas.dt.normalize())
+    textos = np.append(dias.strftime(FORMATO_DATA).to_numpy(dtype=object), None)
+    data = pd.Series(textos[codigos], index=df.index).fillna(df["Date"])
+
+    convertido = pd.DataFrame({
+        "Data": data,
+        # Pegar a descrição da nota ou descrição
+        "Descrição": df["Note"].fillna(df["Description"]).fillna("Sem descrição"),
+        "Categoria": df["Category"].map(categoria_traducao).fillna("Outros"),
+        "Valor": pd.to_numeric(df["Amount"], errors="coerce").fillna(0.0),
+        "Tipo": df["Income/Expense"].map(tipo_traducao).fillna("Despesa"),
+    }, index=df.index)
+
+    # Se já tiver dados em português, use-os (assumindo despesa por padrão)
+    em_portugues = df["Data"].notna() & df["Descrição"].notna()
+    if em_portugues.any():
+        convertido = convertido.astype(object)
+        convertido.loc[em_portugues, ["Data", "Descrição", "Categoria", "Valor"]] = (
+            df.loc[em_portugues, ["Data", "Descrição", "Categoria", "Valor"]].to_numpy())
+        convertido.loc[em_portugues, "Tipo"] = "Despesa"
+    return convertido[COLUNAS]
 
-# Converter e adicionar cada linha
-for _, row in df.iterrows():
+
+def _blocos_convertidos(blocos, processos):
+    """Converte os blocos em ordem; com processos > 1, mantém no máximo 2 blocos por processo em voo."""
+    if processos <= 1:
+        for bloco in blocos:
+            yield converter_bloco(bloco)
+        return
+    with ProcessPoolExecutor(max_workers=processos) as executor:
+        pendentes = deque()
+        for bloco in blocos:
+            pendentes.append(executor.submit(converter_bloco, bloco))
+            if len(pendentes) >= 2 * processos:
+                yield pendentes.popleft().result()
+        while pendentes:
+            yield pendentes.popleft().result()
+
+
+def converter_csv(entrada, saida, tamanho_bloco=100_000, processos=1):
+    """Converte a exportação do banco em blocos, gravando cada bloco assim que fica pronto.
+
+    A memória usada depende do tamanho do bloco, não do arquivo. A saída é escrita em um
+    arquivo temporário e só substitui o destino no final. Retorna o número de registros.
+    """
+    blocos = pd.read_csv(entrada, chunksize=tamanho_bloco, dtype=str,
+                         usecols=lambda coluna: coluna in COLUNAS_ENTRADA)
+    temporario = saida + ".tmp"
+    total = 0
     try:
-        # Se já tiver dados em português, use-os
-        if pd.notna(row.get('Data')) and pd.notna(row.get('Descrição')):
-            nova_linha = {
-                "Data": row.get('Data'),
-                "Descrição": row.get('Descrição'),
-                "Categoria": row.get('Categoria'),
-                "Valor": row.get('Valor'),
-                "Tipo": "Despesa"  # Assumindo despesa por padrão
-            }
-        else:
-            # Converter a data para formato brasileiro
-            data = None
-            if pd.notna(row.get('Date')):
-                try:
-                    # Tentar converter a data
-                    data_obj = datetime.strptime(str(row.get('Date')), '%m/%d/%Y %H:%M')
-                    data = data_obj.strftime('%d/%m/%Y')
-                except:
-                    # Se falhar, manter o valor original
-                    data = str(row.get('Date'))
-            
-            # Pegar a descrição da nota ou descrição
-            descricao = row.get('Note') if pd.notna(row.get('Note')) else row.get('Description')
-            if not pd.notna(descricao):
-                descricao = "Sem descrição"
-            
-            # Converter categoria
-            categoria = row.get('Category')
-            if pd.notna(categoria) and categoria in categoria_traducao:
-                categoria = categoria_traducao[categoria]
-            else:
-                categoria = "Outros"
-            
-            # Valor e tipo
-            valor = row.get('Amount') if pd.notna(row.get('Amount')) else 0.0
-            tipo = row.get('Income/Expense')
-            if pd.notna(tipo) and tipo in tipo_traducao:
-                tipo = tipo_traducao[tipo]
-            else:
-                tipo = "Despesa"  # Padrão
-            
-            # Criar nova linha
-            nova_linha = {
-                "Data": data,
-                "Descrição": descricao,
-                "Categoria": categoria,
-                "Valor": valor,
-                "Tipo": tipo
-            }
-        
-        # Adicionar ao novo DataFrame
-        novo_df = pd.concat([novo_df, pd.DataFrame([nova_linha])], ignore_index=True)
-    
-    except Exception as e:
-        print(f"Erro ao processar linha: {e}")
-        continue
-
-# Ordenar por data (mais recente primeiro)
-novo_df = novo_df.sort_values(by="Data", ascending=False)
-
-# Salvar em um novo arquivo
-novo_df.to_csv('despesas_br.csv', index=False)
-print(f"Arquivo 'despesas_br.csv' criado com sucesso com {len(novo_df)} registros.")
-
-# Mostrar as primeiras linhas para verificação
-print("\nPrimeiras linhas do novo arquivo:")
-print(novo_df.head())
\ No newline at end of file
+        with open(temporario, "w", encoding="utf-8", newline="") as destino:
+            # O cabeçalho vai sempre, mesmo que a entrada não tenha linhas
+            pd.DataFrame(columns=COLUNAS).to_csv(destino, index=False)
+            for convertido in _blocos_convertidos(blocos, processos):
+                convertido.to_csv(destino, header=False, index=False)
+                total += len(convertido)
+            destino.flush()
+            os.fsync(destino.fileno())
+        os.replace(temporario, saida)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converter a exportação do banco para o CSV do Gerenciador de Despesas")
+    parser.add_argument("entrada", nargs="?", default="expense_data_1.csv")
+    parser.add_argument("saida", nargs="?", default=os.getenv("DESPESAS_CSV", "despesas_br.csv"))
+    parser.add_argument("--tamanho-bloco", type=int, default=100_000, help="Linhas lidas e convertidas por vez")
+    parser.add_argument("--processos", type=int, default=1, help="Processos para converter blocos em paralelo")
+    args = parser.parse_args()
+
+    inicio = time.time()
+    total = converter_csv(args.entrada, args.saida, args.tamanho_bloco, args.processos)
+    print(f"Arquivo '{args.saida}' criado com sucesso com {total} registros em {time.time() - inicio:.2f}s.")
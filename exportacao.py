@@ -0,0 +1,141 @@
+import os
+import time
+
+import pandas as pd
+
+from agregados import valores_em_reais
+from armazenamento import COLUNAS, FORMATO_DATA
+from telemetria import get_or_create_counter, get_or_create_histogram
+
+exportacao_duracao = get_or_create_histogram('exportacao_duracao_segundos', 'Tempo de cada exportação de registros',
+                                             ['formato', 'destino'])
+exportacao_bytes = get_or_create_histogram(
+    'exportacao_bytes', 'Tamanho de cada exportação de registros', ['formato', 'destino'],
+    buckets=(2**10, 2**14, 2**17, 2**20, 2**23, 2**26, 2**28, 2**30, 2**32, float("inf")))
+exportacao_registros = get_or_create_counter('exportacao_registros_total', 'Registros exportados', ['formato', 'destino'])
+
+# Linhas por bloco lido do armazenamento (e por row group no Parquet)
+TAMANHO_BLOCO = int(os.getenv("EXPORTACAO_BLOCO_REGISTROS", "50000"))
+
+# formato -> (tipo MIME, extensão)
+FORMATOS = {
+    "csv": ("text/csv", ".csv"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+}
+
+
+def _para_saida(bloco):
+    """Cópia do bloco no formato do arquivo do aplicativo: Valor em reais (float64) e categorias como texto."""
+    saida = bloco.reindex(columns=COLUNAS).copy()
+    saida["Valor"] = valores_em_reais(saida["Valor"])
+    for coluna in ("Categoria", "Tipo"):
+        saida[coluna] = saida[coluna].astype("object")
+    return saida
+
+
+def _csv(blocos):
+    # Mesmo formato do CSV do aplicativo (Data em dd/mm/aaaa), então o arquivo pode ser reimportado
+    cabecalho = True
+    for bloco in blocos:
+        saida = _para_saida(bloco)
+        saida["Data"] = saida["Data"].dt.strftime(FORMATO_DATA)
+        yield saida.to_csv(index=False, header=cabecalho).encode("utf-8")
+        cabecalho = False
+    if cabecalho:
+        yield (",".join(COLUNAS) + "\n").encode("utf-8")
+
+
+class _Acumulador:
+    """Arquivo só de escrita em que o ParquetWriter grava; os bytes são retirados a cada row group."""
+
+    def __init__(self):
+        self.partes = []
+        self.closed = False
+        self._posicao = 0
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self._posicao
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def retirar(self):
+        dados = b"".join(self.partes)
+        self.partes = []
+        return dados
+
+
+def _parquet(blocos):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    esquema = pa.schema([("Data", pa.timestamp("ns")), ("Descrição", pa.string()), ("Categoria", pa.string()),
+                         ("Valor", pa.float64()), ("Tipo", pa.string())])
+    acumulador = _Acumulador()
+    with pq.ParquetWriter(acumulador, esquema) as escritor:
+        for bloco in blocos:
+            # Um row group por bloco: só o bloco atual fica em memória
+            escritor.write_table(pa.Table.from_pandas(_para_saida(bloco), schema=esquema, preserve_index=False))
+            dados = acumulador.retirar()
+            if dados:
+                yield dados
+    yield acumulador.retirar()
+
+
+_SERIALIZADORES = {"csv": _csv, "parquet": _parquet}
+
+
+def exportar(blocos, formato, destino):
+    """Gerador dos bytes do arquivo exportado a partir de um iterável de DataFrames (ex.:
+    RepositorioDespesas.blocos_registros()), um bloco por vez.
+
+    Duração, bytes e registros são registrados nas métricas exportacao_* ao final, rotulados por
+    formato e destino ("arquivo" ou "api").
+    """
+    if formato not in _SERIALIZADORES:
+        raise ValueError(f"Formato de exportação desconhecido: {formato}")
+    inicio = time.perf_counter()
+    contagem = {"registros": 0, "bytes": 0}
+
+    def contar(blocos):
+        for bloco in blocos:
+            contagem["registros"] += len(bloco)
+            yield bloco
+
+    for parte in _SERIALIZADORES[formato](contar(blocos)):
+        contagem["bytes"] += len(parte)
+        yield parte
+    exportacao_duracao.labels(formato=formato, destino=destino).observe(time.perf_counter() - inicio)
+    exportacao_bytes.labels(formato=formato, destino=destino).observe(contagem["bytes"])
+    exportacao_registros.labels(formato=formato, destino=destino).inc(contagem["registros"])
+
+
+def exportar_arquivo(blocos, formato, caminho, destino="arquivo"):
+    """Grava a exportação em `caminho` (via arquivo temporário, trocado ao final) e retorna o tamanho em bytes."""
+    os.makedirs(os.path.dirname(os.path.abspath(caminho)), exist_ok=True)
+    tmp = caminho + ".tmp"
+    tamanho = 0
+    try:
+        with open(tmp, "wb") as arquivo:
+            for parte in exportar(blocos, formato, destino):
+                arquivo.write(parte)
+                tamanho += len(parte)
+        os.replace(tmp, caminho)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return tamanho
+
+
+def nome_exportacao(formato, agora=None):
+    """Nome do arquivo exportado: registros_<aaaammdd_hhmmss>.<extensão>."""
+    agora = agora if agora is not None else pd.Timestamp.now()
+    return f"registros_{agora.strftime('%Y%m%d_%H%M%S')}{FORMATOS[formato][1]}"
@@ -0,0 +1,236 @@
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from log_estruturado import StructuredLogger
+
+logger = StructuredLogger(__name__, contexto={"service": os.getenv("DD_SERVICE", "gerenciador-despesas"),
+                                              "componente": "graficos"})
+
+# "matplotlib" (padrão): PNGs renderizados no servidor; "vega": o navegador desenha os gráficos a
+# partir das séries agregadas (Vega-Lite)
+MOTORES = ("matplotlib", "vega")
+MOTOR = os.getenv("GRAFICOS_MOTOR", "matplotlib")
+if MOTOR not in MOTORES:
+    logger.warning("GRAFICOS_MOTOR=%s desconhecido; usando matplotlib", MOTOR)
+    MOTOR = "matplotlib"
+
+
+def _para_png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", bbox_inches="tight")
+    return buffer.getvalue()
+
+
+def gerar_analise(category_totals, tendencia=None, motor=None):
+    """Gráficos e tabela de resumo da aba Análise no motor configurado (GRAFICOS_MOTOR); o campo
+    "motor" do resultado diz como exibir os gráficos (especificação Vega-Lite ou PNG)."""
+    motor = motor or MOTOR
+    if motor == "vega":
+        analise = especificar_analise(category_totals, tendencia)
+    else:
+        analise = renderizar_analise(category_totals, tendencia)
+    analise["motor"] = motor
+    return analise
+
+
+def _resumo(category_totals):
+    return pd.DataFrame({
+        'Categoria': category_totals.index,
+        'Valor Total (R$)': category_totals.values,
+        'Porcentagem (%)': (category_totals.values / category_totals.values.sum() * 100).round(2)
+    })
+
+
+def _principais(tendencia, max_categorias):
+    """Tendência só com as max_categorias de maior total; as demais somadas em "Demais"."""
+    if len(tendencia.columns) <= max_categorias:
+        return tendencia
+    principais = tendencia.iloc[:, :max_categorias - 1]
+    return principais.assign(Demais=tendencia.iloc[:, max_categorias - 1:].sum(axis=1))
+
+
+def especificar_analise(category_totals, tendencia=None, max_categorias=8):
+    """Especificações Vega-Lite dos gráficos da aba Análise, com os dados embutidos.
+
+    Só as séries agregadas (uma linha por categoria e, na tendência, por mês) vão para o navegador,
+    que desenha os gráficos; o servidor não importa o matplotlib nem codifica PNGs.
+    """
+    total = float(category_totals.sum())
+    dados = [{"Categoria": str(categoria), "Valor": round(float(valor), 2), "Rótulo": f"R$ {valor:.2f}",
+              "Porcentagem": f"{valor / total * 100:.1f}%" if total else "", "Ordem": ordem}
+             for ordem, (categoria, valor) in enumerate(category_totals.items())]
+    # Mesma paleta dos gráficos do matplotlib, na ordem decrescente de valor
+    cor = {"field": "Categoria", "type": "nominal", "sort": None, "scale": {"scheme": "viridis"}}
+
+    barras = {
+        "data": {"values": dados},
+        "title": "Total por Categoria",
+        "height": 400,
+        "encoding": {
+            "x": {"field": "Categoria", "type": "nominal", "sort": None, "title": None, "axis": {"labelAngle": -45}},
+            "y": {"field": "Valor", "type": "quantitative", "title": "Valor (R$)"},
+        },
+        "layer": [
+            {"mark": "bar", "encoding": {"color": dict(cor, legend=None),
+                                         "tooltip": [{"field": "Categoria"}, {"field": "Rótulo", "title": "Valor"}]}},
+            {"mark": {"type": "text", "dy": -8, "fontWeight": "bold"}, "encoding": {"text": {"field": "Rótulo"}}},
+        ],
+    }
+
+    pizza = {
+        "data": {"values": dados},
+        "title": "Proporção por Categoria",
+        "height": 400,
+        "encoding": {
+            "theta": {"field": "Valor", "type": "quantitative", "stack": True},
+            "color": dict(cor, legend={"title": "Categorias"}),
+            "order": {"field": "Ordem", "type": "quantitative"},
+            "tooltip": [{"field": "Categoria"}, {"field": "Rótulo", "title": "Valor"}, {"field": "Porcentagem"}],
+        },
+        "layer": [
+            {"mark": {"type": "arc", "outerRadius": 150, "stroke": "white"}},
+            {"mark": {"type": "text", "radius": 120, "fill": "white", "fontWeight": "bold"},
+             "encoding": {"text": {"field": "Porcentagem"}}},
+        ],
+    }
+
+    return {"barras": barras, "pizza": pizza, "resumo": _resumo(category_totals),
+            "tendencia": especificar_tendencia(tendencia, max_categorias) if tendencia is not None else None}
+
+
+def especificar_tendencia(tendencia, max_categorias=8):
+    """Especificação Vega-Lite da tendência mensal (None com menos de dois meses, como em renderizar_tendencia())."""
+    if len(tendencia.index) < 2 or tendencia.empty:
+        return None
+    tendencia = _principais(tendencia, max_categorias)
+    dados = [{"Mês": mes.strftime("%Y-%m-%d"), "Categoria": str(categoria), "Valor": round(float(valor), 2)}
+             for categoria in tendencia.columns for mes, valor in tendencia[categoria].items()]
+    return {
+        "data": {"values": dados},
+        "title": "Total por Mês",
+        "height": 350,
+        "mark": {"type": "line", "point": True},
+        "encoding": {
+            "x": {"field": "Mês", "type": "temporal", "timeUnit": "yearmonth", "title": None},
+            "y": {"field": "Valor", "type": "quantitative", "title": "Valor (R$)"},
+            "color": {"field": "Categoria", "type": "nominal", "sort": [str(c) for c in tendencia.columns],
+                      "scale": {"scheme": "viridis"}, "legend": {"title": "Categorias"}},
+            "tooltip": [{"field": "Mês", "type": "temporal", "timeUnit": "yearmonth", "format": "%m/%Y"},
+                        {"field": "Categoria"}, {"field": "Valor", "type": "quantitative", "format": ",.2f"}],
+        },
+    }
+
+
+def renderizar_analise(category_totals, tendencia=None):
+    """Renderiza os gráficos de barras, pizza e tendência mensal e a tabela de resumo da aba Análise.
+
+    Usa Figure diretamente (sem o estado global do pyplot), então é seguro entre sessões. O matplotlib
+    só é importado aqui, na primeira análise renderizada, e não na inicialização do aplicativo.
+    """
+    from matplotlib import colormaps
+    from matplotlib.figure import Figure
+
+    cores = colormaps["viridis"](np.linspace(0, 1, len(category_totals)))
+
+    # Gráfico de Barras
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    bars = category_totals.plot(kind="bar", ax=ax, color=cores)
+    ax.set_ylabel("Valor (R$)")
+    ax.set_title("Total por Categoria")
+
+    for bar in bars.patches:
+        valor = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width()/2., valor + 5, f'R$ {valor:.2f}',
+                ha='center', va='bottom', fontweight='bold')
+
+    ax.tick_params(axis="x", labelrotation=45)
+    fig.tight_layout()
+    png_barras = _para_png(fig)
+
+    # Gráfico de Pizza
+    fig2 = Figure(figsize=(10, 6))
+    ax2 = fig2.subplots()
+
+    wedges, texts, autotexts = ax2.pie(
+        category_totals, labels=None, autopct="%1.1f%%",
+        shadow=True, colors=cores, startangle=90,
+        wedgeprops={'linewidth': 1, 'edgecolor': 'white'}
+    )
+
+    for autotext in autotexts:
+        autotext.set_fontsize(10)
+        autotext.set_color('white')
+        autotext.set_fontweight('bold')
+
+    ax2.set_title("Proporção por Categoria")
+    ax2.legend(wedges, category_totals.index, title="Categorias",
+               loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
+
+    fig2.tight_layout()
+    png_pizza = _para_png(fig2)
+
+    return {"barras": png_barras, "pizza": png_pizza, "resumo": _resumo(category_totals),
+            "tendencia": renderizar_tendencia(tendencia) if tendencia is not None else None}
+
+
+def renderizar_tendencia(tendencia, max_categorias=8):
+    """Gráfico de linhas da tendência mensal (meses x categorias, como em tabela_mensal()).
+
+    As categorias além das max_categorias de maior total são somadas em "Demais". None se houver
+    menos de dois meses ou nenhuma categoria.
+    """
+    if len(tendencia.index) < 2 or tendencia.empty:
+        return None
+    from matplotlib.figure import Figure
+
+    tendencia = _principais(tendencia, max_categorias)
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    tendencia.plot(ax=ax, marker="o", colormap="viridis")
+    ax.set_ylabel("Valor (R$)")
+    ax.set_xlabel("")
+    ax.set_title("Total por Mês")
+    ax.legend(title="Categorias", loc="center left", bbox_to_anchor=(1, 0, 0.5, 1))
+    fig.tight_layout()
+    return _para_png(fig)
+
+
+class CacheGraficos:
+    """LRU limitado de análises renderizadas, compartilhado por todas as sessões do processo."""
+
+    def __init__(self, max_itens=32):
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        """Retorna (encontrado, valor)."""
+        with self._lock:
+            if chave not in self._itens:
+                return False, None
+            self._itens.move_to_end(chave)
+            return True, self._itens[chave]
+
+    def guardar(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+    def __len__(self):
+        return len(self._itens)
+
+
+# Instância única do processo (o módulo é importado uma vez; o script do Streamlit é reexecutado)
+cache_graficos = CacheGraficos(max_itens=int(os.getenv("GRAFICOS_CACHE_MAX", "32")))
@@ -0,0 +1,102 @@
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from armazenamento import COLUNAS, FORMATO_DATA, obter_repositorio
+from convert_csv import COLUNAS_ENTRADA, converter_bloco
+
+TIPOS_VALIDOS = ["Despesa", "Receita"]
+# Colunas sem as quais o arquivo é rejeitado; as demais recebem o mesmo padrão do convert_csv.py
+COLUNAS_OBRIGATORIAS = ["Data", "Valor"]
+
+
+def ler_arquivo(arquivo):
+    """Lê um CSV (caminho ou arquivo enviado) mantendo todos os campos como texto."""
+    return pd.read_csv(arquivo, dtype=str, skipinitialspace=True)
+
+
+def _valores(coluna):
+    # Aceita "12.50", "12,50", "1.234,56" e "R$ 10,00"
+    texto = coluna.astype("string").str.replace("R$", "", regex=False).str.strip()
+    virgula = texto.str.contains(",", regex=False, na=False)
+    texto = texto.where(~virgula, texto.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    return pd.to_numeric(texto, errors="coerce").astype("float64")
+
+
+def exportacao_do_banco(colunas):
+    """True se as colunas indicam uma exportação do banco (Date, Amount, ...), que precisa ser convertida."""
+    return bool(set(colunas) & (set(COLUNAS_ENTRADA) - set(COLUNAS)))
+
+
+def normalizar_registros(df):
+    """Valida e normaliza os registros para o esquema do aplicativo.
+
+    Aceita o CSV do próprio aplicativo (COLUNAS) ou uma exportação do banco no formato do
+    convert_csv.py. Retorna (registros válidos, lista de (linha, motivo) dos rejeitados).
+    """
+    if exportacao_do_banco(df.columns):
+        # Colunas da exportação do banco (Date, Amount, ...): converte antes de validar
+        df = converter_bloco(df)
+    faltantes = [coluna for coluna in COLUNAS_OBRIGATORIAS if coluna not in df.columns]
+    if faltantes:
+        raise ValueError("Colunas obrigatórias ausentes: " + ", ".join(faltantes))
+    df = df.reindex(columns=COLUNAS)
+
+    texto_data = df["Data"].astype("string").str.strip()
+    datas = pd.to_datetime(texto_data, format=FORMATO_DATA, errors="coerce")
+    iso = datas.isna() & texto_data.notna()
+    if iso.any():
+        datas[iso] = pd.to_datetime(texto_data[iso], format="%Y-%m-%d", errors="coerce")
+    valores = _valores(df["Valor"]).round(2)
+    descricoes = df["Descrição"].astype("string").str.strip().replace("", pd.NA).fillna("Sem descrição")
+    categorias = df["Categoria"].astype("string").str.strip().replace("", pd.NA).fillna("Outros")
+    tipos = df["Tipo"].astype("string").str.strip().str.capitalize().replace("", pd.NA).fillna("Despesa")
+
+    motivos = pd.Series(np.select(
+        [datas.isna().to_numpy(), valores.isna().to_numpy(), (valores <= 0).to_numpy(),
+         ~tipos.isin(TIPOS_VALIDOS).to_numpy(dtype=bool)],
+        ["Data inválida", "Valor inválido", "Valor deve ser maior que zero", "Tipo deve ser Despesa ou Receita"],
+        default=""), index=df.index)
+    validos = motivos == ""
+
+    registros = pd.DataFrame({
+        "Data": datas.dt.strftime(FORMATO_DATA),
+        "Descrição": descricoes.astype(object),
+        "Categoria": categorias.astype(object),
+        "Valor": valores,
+        "Tipo": tipos.astype(object),
+    })[validos].reset_index(drop=True)
+    # Número da linha no arquivo (a linha 1 é o cabeçalho)
+    erros = [(int(posicao) + 2, motivo)
+             for posicao, motivo in zip(np.flatnonzero(~validos.to_numpy()), motivos[~validos])]
+    return registros, erros
+
+
+def importar(repositorio, df):
+    """Normaliza, remove duplicatas e grava o lote inteiro de uma vez. Retorna um resumo."""
+    registros, erros = normalizar_registros(df)
+    importados, duplicados = repositorio.importar(registros) if not registros.empty else (0, 0)
+    return {
+        "lidos": len(df),
+        "importados": importados,
+        "duplicados": duplicados,
+        "invalidos": len(erros),
+        "erros": erros,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importar registros em lote para o Gerenciador de Despesas")
+    parser.add_argument("arquivo", help="CSV no formato do aplicativo ou exportação do banco")
+    parser.add_argument("--csv", default=os.getenv("DESPESAS_CSV", "despesas_br.csv"))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    resumo = importar(obter_repositorio(args.csv), ler_arquivo(args.arquivo))
+    print(f"{resumo['lidos']} lidos, {resumo['importados']} importados, "
+          f"{resumo['duplicados']} duplicados, {resumo['invalidos']} inválidos")
+    for linha, motivo in resumo["erros"][:20]:
+        print(f"  linha {linha}: {motivo}")
@@ -0,0 +1,158 @@
+import functools
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from armazenamento import descartar_repositorio, obter_repositorio
+from telemetria import get_or_create_counter, get_or_create_histogram
+
+inquilinos_carregamento = get_or_create_histogram('inquilinos_carregamento_segundos',
+                                                  'Tempo de carga do livro de um inquilino')
+inquilinos_retirados = get_or_create_counter('inquilinos_retirados_total', 'Inquilinos retirados da memória pelo LRU',
+                                             ['motivo'])
+
+# Identificadores usados como estão no nome do diretório; os demais viram hash
+_IDENTIFICADOR_SEGURO = re.compile(r"[a-z0-9][a-z0-9_.@+-]{0,99}")
+
+
+def _normalizar(inquilino):
+    normalizado = str(inquilino).strip().lower()
+    if not normalizado:
+        raise ValueError("Identificador de inquilino vazio")
+    return normalizado
+
+
+def _hash(normalizado):
+    return hashlib.sha256(normalizado.encode("utf-8")).hexdigest()[:16]
+
+
+def identificador_seguro(inquilino):
+    """Nome do diretório do inquilino: o identificador em minúsculas, ou um hash se tiver outros caracteres."""
+    normalizado = _normalizar(inquilino)
+    if _IDENTIFICADOR_SEGURO.fullmatch(normalizado):
+        return normalizado
+    # "_" não inicia identificadores seguros, então hashes e nomes nunca colidem
+    return "_" + _hash(normalizado)
+
+
+def rotulo_inquilino(inquilino):
+    """Hash estável do inquilino para rótulos de métricas e logs: o identificador (ex.: um e-mail)
+    só aparece no nome do diretório."""
+    return _hash(_normalizar(inquilino))
+
+
+class _Inquilino:
+    def __init__(self, repositorio, rotulo):
+        self.repositorio = repositorio
+        self.rotulo = rotulo
+        self.lock = threading.Lock()
+        self.carregamento_segundos = None
+        self.memoria_bytes = 0
+        self.ultimo_acesso = time.monotonic()
+
+
+class GerenciadorInquilinos:
+    """Livros separados por inquilino (usuário), carregados sob demanda e mantidos em um LRU.
+
+    Cada inquilino tem seus arquivos em <diretorio>/<inquilino>/<nome_arquivo>, no formato
+    configurado para o aplicativo, e um RepositorioDespesas próprio. Ao passar de max_carregados
+    inquilinos ou de max_memoria_bytes estimados, os usados há mais tempo têm as gravações
+    concluídas, os dados descartados e os arquivos fechados. Inquilinos usados nos últimos
+    protecao_segundos não são retirados (uma sessão pode estar no meio de uma execução com o
+    repositório em mãos), então os limites podem ser excedidos enquanto todos estão ativos.
+    """
+
+    def __init__(self, diretorio, nome_arquivo, carregador=None, logger=None, max_carregados=50,
+                 max_memoria_bytes=1024 * 2**20, protecao_segundos=60):
+        self.diretorio = diretorio
+        self.nome_arquivo = nome_arquivo
+        # carregador(colunas=..., caminho=...): o mesmo do repositório, com o arquivo do inquilino
+        self.carregador = carregador
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_carregados = max_carregados
+        self.max_memoria_bytes = max_memoria_bytes
+        self.protecao_segundos = protecao_segundos
+        self._lock = threading.Lock()
+        # identificador -> _Inquilino, do menos para o mais recente
+        self._carregados = OrderedDict()
+
+    def obter(self, inquilino):
+        """Repositório do inquilino, carregado na primeira vez; marca o uso e aplica os limites do LRU."""
+        chave = identificador_seguro(inquilino)
+        with self._lock:
+            entrada = self._carregados.get(chave)
+            if entrada is None:
+                caminho = os.path.join(self.diretorio, chave, self.nome_arquivo)
+                os.makedirs(os.path.dirname(caminho), exist_ok=True)
+                carregador = functools.partial(self.carregador, caminho=caminho) if self.carregador else None
+                entrada = _Inquilino(obter_repositorio(caminho, carregador=carregador, logger=self.logger),
+                                     rotulo_inquilino(inquilino))
+                self._carregados[chave] = entrada
+            self._carregados.move_to_end(chave)
+            entrada.ultimo_acesso = time.monotonic()
+
+        with entrada.lock:
+            if entrada.carregamento_segundos is None:
+                inicio = time.perf_counter()
+                entrada.repositorio.obter_agregados()
+                entrada.carregamento_segundos = time.perf_counter() - inicio
+                inquilinos_carregamento.observe(entrada.carregamento_segundos)
+                self.logger.info("Inquilino %s carregado em %.3f s", entrada.rotulo, entrada.carregamento_segundos)
+        # Atualizada a cada uso: índices e cubo são construídos depois da carga, nas abas
+        entrada.memoria_bytes = entrada.repositorio.memoria_bytes()
+        self._aplicar_limites(chave)
+        return entrada.repositorio
+
+    def _aplicar_limites(self, atual):
+        with self._lock:
+            agora = time.monotonic()
+            memoria = sum(entrada.memoria_bytes for entrada in self._carregados.values())
+            for chave in list(self._carregados):
+                excesso_quantidade = len(self._carregados) > self.max_carregados
+                if not excesso_quantidade and memoria <= self.max_memoria_bytes:
+                    break
+                entrada = self._carregados[chave]
+                if chave == atual or agora - entrada.ultimo_acesso < self.protecao_segundos:
+                    continue
+                # Fecha ainda com o lock: um novo obter() do mesmo inquilino não pode abrir os
+                # arquivos enquanto o diário antigo conclui as gravações
+                del self._carregados[chave]
+                memoria -= entrada.memoria_bytes
+                motivo = "quantidade" if excesso_quantidade else "memoria"
+                descartar_repositorio(entrada.repositorio)
+                inquilinos_retirados.labels(motivo=motivo).inc()
+                self.logger.info("Inquilino %s retirado da memória (%s, %.1f MB)", entrada.rotulo, motivo,
+                                 entrada.memoria_bytes / 2**20)
+
+    def resumo(self):
+        """[(rótulo do inquilino, segundos da carga, bytes estimados)] dos inquilinos carregados, sem carregar nada.
+        Usado na coleta de métricas, que não deve esperar por cargas (None se o LRU estiver ocupado)."""
+        if not self._lock.acquire(timeout=1):
+            return None
+        try:
+            return [(entrada.rotulo, entrada.carregamento_segundos, entrada.memoria_bytes)
+                    for entrada in self._carregados.values() if entrada.carregamento_segundos is not None]
+        finally:
+            self._lock.release()
+
+
+_gerenciadores = {}
+_lock_gerenciadores = threading.Lock()
+
+
+def obter_gerenciador(diretorio, nome_arquivo, carregador=None, logger=None):
+    """Gerenciador compartilhado do processo para o diretório de inquilinos (limites lidos do ambiente)."""
+    with _lock_gerenciadores:
+        gerenciador = _gerenciadores.get((diretorio, nome_arquivo))
+        if gerenciador is None:
+            gerenciador = GerenciadorInquilinos(
+                diretorio, nome_arquivo, carregador=carregador, logger=logger,
+                max_carregados=int(os.getenv("INQUILINOS_MAX_CARREGADOS", "50")),
+                max_memoria_bytes=int(float(os.getenv("INQUILINOS_MAX_MEMORIA_MB", "1024")) * 2**20),
+                protecao_segundos=float(os.getenv("INQUILINOS_PROTECAO_SEGUNDOS", "60")))
+            _gerenciadores[(diretorio, nome_arquivo)] = gerenciador
+        return gerenciador
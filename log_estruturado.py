@@ -0,0 +1,173 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+from opentelemetry import trace
+
+from telemetria import get_or_create_counter
+
+# Descartes por fila cheia
+logs_descartados = get_or_create_counter('logs_descartados_total', 'Mensagens de log descartadas por fila cheia', ['nivel'])
+
+
+def _campos_trace(trace_id, span_id):
+    fields = {}
+    if trace_id:
+        fields["dd.trace_id"] = format(trace_id, "032x")
+    if span_id:
+        fields["dd.span_id"] = format(span_id, "016x")
+    return fields
+
+
+class EscritorLogs:
+    """Fila limitada + thread que formata e serializa as mensagens fora da thread de quem loga.
+
+    Cada linha JSON é entregue ao logging.Logger de origem (handle()), então handlers e filtros
+    configurados no logging (basicConfig, OpenTelemetry) veem as mensagens como no modo síncrono.
+    Com `saida`, as linhas vão direto para esse arquivo, uma escrita por lote, sem passar pelos handlers.
+    Com a fila cheia, a mensagem é descartada e contada em logs_descartados_total: quem loga
+    nunca espera pela saída.
+    """
+
+    def __init__(self, capacidade=10000, lote_max=500, saida=None):
+        self.lote_max = lote_max
+        self.saida = saida
+        self.descartados = 0
+        self._fila = queue.Queue(maxsize=capacidade)
+        threading.Thread(target=self._escritor, name="logs-escritor", daemon=True).start()
+
+    def enviar(self, item):
+        try:
+            self._fila.put_nowait(item)
+        except queue.Full:
+            self.descartados += 1
+            logs_descartados.labels(nivel=item[1]).inc()
+
+    def _escritor(self):
+        while True:
+            itens = [self._fila.get()]
+            while len(itens) < self.lote_max:
+                try:
+                    itens.append(self._fila.get_nowait())
+                except queue.Empty:
+                    break
+            linhas = []
+            for item in itens:
+                try:
+                    linhas.append(_serializar(*item))
+                except Exception as e:
+                    linhas.append(json.dumps({"level": "ERROR", "message": f"Falha ao serializar log: {e}"}))
+            try:
+                if self.saida is not None:
+                    self.saida.write("\n".join(linhas) + "\n")
+                    self.saida.flush()
+                else:
+                    for item, linha in zip(itens, linhas):
+                        _emitir(item, linha)
+            except Exception:
+                pass
+            for _ in itens:
+                self._fila.task_done()
+
+    def esvaziar(self, timeout=5.0):
+        """Espera as mensagens já enfileiradas serem gravadas (usado na saída do processo)."""
+        with self._fila.all_tasks_done:
+            return self._fila.all_tasks_done.wait_for(lambda: self._fila.unfinished_tasks == 0, timeout=timeout)
+
+
+def _serializar(contexto, level, logger_name, message, args, momento, trace_id, span_id, campos):
+    # Executado na thread do escritor: formatação da mensagem, datas e JSON saem do caminho da requisição
+    if args:
+        message = message % args
+    log_data = {"timestamp": datetime.fromtimestamp(momento, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f") + "Z"}
+    log_data.update(contexto)
+    log_data.update({"level": level.upper(), "logger": logger_name, "message": message})
+    log_data.update(_campos_trace(trace_id, span_id))
+    log_data.update(campos)
+    return json.dumps(log_data, default=str)
+
+
+def _emitir(item, linha):
+    # Registro com a hora da chamada original, entregue aos handlers do logger de origem
+    _, level, logger_name, _, _, momento, _, _, _ = item
+    logger = logging.getLogger(logger_name)
+    registro = logger.makeRecord(logger_name, getattr(logging, level.upper()), "(log_estruturado)", 0, linha,
+                                 None, None)
+    registro.created = momento
+    registro.msecs = (momento - int(momento)) * 1000
+    logger.handle(registro)
+
+
+_escritor = None
+_lock_escritor = threading.Lock()
+
+
+def obter_escritor():
+    """Escritor único do processo (criado no primeiro log assíncrono)."""
+    global _escritor
+    if _escritor is not None:
+        return _escritor
+    with _lock_escritor:
+        if _escritor is None:
+            _escritor = EscritorLogs(capacidade=int(os.getenv("LOG_FILA_MAX", "10000")),
+                                     lote_max=int(os.getenv("LOG_LOTE_MAX", "500")))
+            atexit.register(_escritor.esvaziar)
+        return _escritor
+
+
+class StructuredLogger:
+    """Logger que emite JSON com metadata + trace ids quando disponíveis.
+
+    A mensagem aceita argumentos no estilo do logging (`logger.info("Total: %.2f", total)`), formatados
+    só se o nível estiver habilitado. No modo assíncrono (LOG_MODO=assincrono, padrão) a formatação e a
+    serialização acontecem em segundo plano e a linha pronta passa pelos handlers do logging; campos
+    extras são serializados depois, então não devem ser alterados após a chamada.
+    """
+    def __init__(self, name, contexto=None, assincrono=None):
+        self.logger = logging.getLogger(name)
+        self.contexto = dict(contexto or {})
+        if assincrono is None:
+            assincrono = os.getenv("LOG_MODO", "assincrono") == "assincrono"
+        self.assincrono = assincrono
+
+    def _current_trace_ids(self):
+        try:
+            ctx = trace.get_current_span().get_span_context()
+            if ctx is None:
+                return 0, 0
+            return getattr(ctx, "trace_id", 0), getattr(ctx, "span_id", 0)
+        except Exception:
+            return 0, 0
+
+    def _log(self, level, message, args, kwargs):
+        # O nível é verificado antes de qualquer formatação
+        if not self.logger.isEnabledFor(getattr(logging, level.upper())):
+            return
+        # accept `extra` key to be compatible with previous calls
+        extra = kwargs.pop("extra", {})
+        campos = dict(extra) if isinstance(extra, dict) else {}
+        campos.update(kwargs)
+        trace_id, span_id = self._current_trace_ids()
+        item = (self.contexto, level, self.logger.name, message, args, time.time(), trace_id, span_id, campos)
+        if self.assincrono:
+            obter_escritor().enviar(item)
+        else:
+            # Emitir JSON (uma linha)
+            getattr(self.logger, level)(_serializar(*item))
+
+    def info(self, message, *args, **kwargs):
+        self._log("info", message, args, kwargs)
+
+    def error(self, message, *args, **kwargs):
+        self._log("error", message, args, kwargs)
+
+    def warning(self, message, *args, **kwargs):
+        self._log("warning", message, args, kwargs)
+
+    def debug(self, message, *args, **kwargs):
+        self._log("debug", message, args, kwargs)
@@ -0,0 +1,102 @@
+from prometheus_client import REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+
+
+class ColetorAgregados:
+    """Saldo e totais lidos do estado agregado só quando /metrics é coletado.
+
+    Substitui os gauges atualizados a cada interação: os valores são os mesmos para todas as
+    sessões e a interface não gasta nada para mantê-los. A coleta nunca dispara leitura de arquivo:
+    repositorio_existente() devolve o repositório só se ele já foi criado (None caso contrário), e
+    enquanto não houver repositório ou os dados não tiverem sido carregados, as métricas saem sem amostras.
+    """
+
+    def __init__(self, repositorio_existente):
+        self.repositorio_existente = repositorio_existente
+
+    @staticmethod
+    def _familias():
+        return {
+            "total_despesas": GaugeMetricFamily('total_despesas_reais', 'Total de despesas em reais'),
+            "total_receitas": GaugeMetricFamily('total_receitas_reais', 'Total de receitas em reais'),
+            "saldo": GaugeMetricFamily('saldo_atual_reais', 'Saldo atual em reais'),
+            "registros": GaugeMetricFamily('registros_totais', 'Total de registros no sistema'),
+            "por_categoria": GaugeMetricFamily('registros_por_categoria', 'Registros por categoria',
+                                               labels=['categoria']),
+        }
+
+    def describe(self):
+        # Sem describe(), o registro chamaria collect() só para descobrir os nomes
+        return list(self._familias().values())
+
+    def collect(self):
+        familias = self._familias()
+        try:
+            repositorio = self.repositorio_existente()
+            agregados = repositorio.agregados_carregados() if repositorio is not None else None
+        except Exception:
+            agregados = None
+        if agregados is not None:
+            familias["total_despesas"].add_metric([], float(agregados.total_despesas))
+            familias["total_receitas"].add_metric([], float(agregados.total_receitas))
+            familias["saldo"].add_metric([], float(agregados.saldo))
+            familias["registros"].add_metric([], agregados.total_registros)
+            for categoria, quantidade in sorted(agregados.registros_por_categoria.items(), key=lambda item: str(item[0])):
+                familias["por_categoria"].add_metric([str(categoria)], int(quantidade))
+        return list(familias.values())
+
+
+class ColetorInquilinos:
+    """Tempo de carga e memória estimada de cada inquilino carregado, lidos do LRU no scrape.
+
+    Só os inquilinos em memória geram séries, então o número de séries é limitado pelo tamanho
+    do LRU e não pela quantidade de usuários. O rótulo inquilino é um hash (rotulo_inquilino),
+    nunca o identificador do usuário.
+    """
+
+    def __init__(self, gerenciador):
+        self.gerenciador = gerenciador
+
+    @staticmethod
+    def _familias():
+        return {
+            "carregados": GaugeMetricFamily('inquilinos_carregados', 'Inquilinos com o livro em memória'),
+            "memoria_total": GaugeMetricFamily('inquilinos_memoria_bytes',
+                                               'Memória estimada somada dos inquilinos carregados'),
+            "memoria": GaugeMetricFamily('inquilino_memoria_bytes', 'Memória estimada do livro do inquilino',
+                                         labels=['inquilino']),
+            "carregamento": GaugeMetricFamily('inquilino_carregamento_segundos',
+                                              'Tempo da última carga do livro do inquilino', labels=['inquilino']),
+        }
+
+    def describe(self):
+        return list(self._familias().values())
+
+    def collect(self):
+        familias = self._familias()
+        resumo = self.gerenciador.resumo()
+        if resumo is not None:
+            familias["carregados"].add_metric([], len(resumo))
+            familias["memoria_total"].add_metric([], sum(memoria for _, _, memoria in resumo))
+            for inquilino, carregamento, memoria in resumo:
+                familias["memoria"].add_metric([inquilino], memoria)
+                familias["carregamento"].add_metric([inquilino], carregamento)
+        return list(familias.values())
+
+
+def registrar_coletor(coletor, registro=REGISTRY):
+    """Registra o coletor uma única vez por processo (o script do Streamlit é reexecutado a cada interação).
+
+    O registro já existente é encontrado pelos nomes das métricas no próprio REGISTRY, então a
+    deduplicação continua valendo quando o Streamlit reimporta este módulo.
+    """
+    nome = coletor.describe()[0].name
+    existente = registro._names_to_collectors.get(nome)
+    if existente is not None:
+        return existente
+    try:
+        registro.register(coletor)
+    except ValueError:
+        # Outra sessão registrou as mesmas métricas entre a consulta e o registro
+        return registro._names_to_collectors[nome]
+    return coletor
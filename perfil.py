@@ -0,0 +1,164 @@
+import contextlib
+import contextvars
+import cProfile
+import heapq
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+from opentelemetry import trace
+
+from telemetria import get_or_create_counter, get_or_create_histogram
+
+execucao_fase_segundos = get_or_create_histogram('execucao_fase_segundos', 'Tempo de cada fase das execuções do script',
+                                                 ['fase'])
+execucao_script_segundos = get_or_create_histogram('execucao_script_segundos', 'Duração total de cada execução do script')
+perfis_gravados = get_or_create_counter('perfis_gravados_total', 'Dumps do cProfile gravados para as execuções mais lentas')
+
+# Fração das execuções perfiladas com cProfile (0 desliga); só as mais lentas são gravadas
+AMOSTRAGEM = float(os.getenv("PERFIL_AMOSTRAGEM", "0"))
+DIRETORIO = os.getenv("PERFIL_DIRETORIO", "perfis")
+MAX_ARQUIVOS = int(os.getenv("PERFIL_MAX_ARQUIVOS", "20"))
+
+tracer = trace.get_tracer(__name__)
+_execucao_atual = contextvars.ContextVar("execucao_perfilada", default=None)
+# (duração, caminho) dos dumps mantidos, a mais rápida no topo do heap
+_mais_lentas = []
+_perfiladas_ativas = set()
+_lock_perfis = threading.Lock()
+# Uma execução perfilada por vez: no Python 3.12+ o cProfile usa sys.monitoring, mede todas as threads
+# do processo e só admite um perfilador ativo. Execuções sorteadas enquanto outra é perfilada seguem sem perfil
+_vez_do_perfilador = threading.Lock()
+
+
+class ExecucaoPerfilada:
+    """Tempos das fases de uma execução do script.
+
+    As fases de primeiro nível somadas ao restante ("outros") fecham a duração total; fases
+    aninhadas (dentro de uma aba, por exemplo) detalham a fase que as contém. Cada fase vai para
+    execucao_fase_segundos{fase} e vira um evento do span "execucao_script".
+    """
+
+    def __init__(self, inicio=None, perfilador=None):
+        self.inicio = inicio if inicio is not None else time.perf_counter()
+        self.inicio_ns = time.time_ns() - int((time.perf_counter() - self.inicio) * 1e9)
+        self.perfilador = perfilador
+        self.thread = threading.current_thread()
+        self.fases = []
+        self.finalizada = False
+        self._nivel = 0
+        self._ultima_marca = self.inicio
+
+    def _registrar(self, nome, inicio, duracao, nivel):
+        self.fases.append((nome, inicio, duracao, nivel))
+        execucao_fase_segundos.labels(fase=nome).observe(duracao)
+
+    @contextlib.contextmanager
+    def fase(self, nome):
+        inicio = time.perf_counter()
+        self._nivel += 1
+        try:
+            yield
+        finally:
+            self._nivel -= 1
+            fim = time.perf_counter()
+            self._registrar(nome, inicio, fim - inicio, self._nivel)
+            if self._nivel == 0:
+                self._ultima_marca = fim
+
+    def marcar(self, nome):
+        """Fecha uma fase de primeiro nível que começou no fim da anterior (ou no início da execução)."""
+        fim = time.perf_counter()
+        self._registrar(nome, self._ultima_marca, fim - self._ultima_marca, 0)
+        self._ultima_marca = fim
+
+    def finalizar(self):
+        if self.finalizada:
+            return
+        self.finalizada = True
+        if self.perfilador is not None:
+            _encerrar_perfil(self)
+        total = time.perf_counter() - self.inicio
+        contabilizado = sum(duracao for _, _, duracao, nivel in self.fases if nivel == 0)
+        outros = max(total - contabilizado, 0.0)
+        execucao_fase_segundos.labels(fase="outros").observe(outros)
+        execucao_script_segundos.observe(total)
+
+        span = tracer.start_span("execucao_script", start_time=self.inicio_ns)
+        for nome, inicio, duracao, nivel in self.fases:
+            span.add_event(nome, {"duracao_ms": round(duracao * 1000, 3), "nivel": nivel},
+                           timestamp=self.inicio_ns + int((inicio - self.inicio) * 1e9))
+        span.set_attribute("duracao_ms", round(total * 1000, 3))
+        span.set_attribute("outros_ms", round(outros * 1000, 3))
+        span.set_attribute("perfilada", self.perfilador is not None)
+        span.end(end_time=self.inicio_ns + int(total * 1e9))
+
+        if self.perfilador is not None:
+            _guardar_perfil(self.perfilador, total)
+
+
+def _guardar_perfil(perfilador, duracao):
+    """Grava o dump se a execução estiver entre as MAX_ARQUIVOS mais lentas, apagando a mais rápida."""
+    with _lock_perfis:
+        if len(_mais_lentas) >= MAX_ARQUIVOS and duracao <= _mais_lentas[0][0]:
+            return
+        os.makedirs(DIRETORIO, exist_ok=True)
+        caminho = os.path.join(DIRETORIO, f"execucao_{datetime.now():%Y%m%d-%H%M%S-%f}_{duracao * 1000:.0f}ms.prof")
+        perfilador.dump_stats(caminho)
+        perfis_gravados.inc()
+        heapq.heappush(_mais_lentas, (duracao, caminho))
+        while len(_mais_lentas) > MAX_ARQUIVOS:
+            _, removido = heapq.heappop(_mais_lentas)
+            with contextlib.suppress(OSError):
+                os.remove(removido)
+
+
+def _encerrar_perfil(execucao):
+    """Desliga o perfilador da execução e libera a vez para a próxima execução perfilada."""
+    with contextlib.suppress(Exception):
+        execucao.perfilador.disable()
+    with _lock_perfis:
+        if execucao not in _perfiladas_ativas:
+            return
+        _perfiladas_ativas.discard(execucao)
+    _vez_do_perfilador.release()
+
+
+def _novo_perfilador():
+    # Execuções interrompidas (st.rerun, exceção) não chegam ao finalizar(): encerra as que ficaram para trás
+    with _lock_perfis:
+        abandonadas = [e for e in _perfiladas_ativas if not e.thread.is_alive()]
+    for abandonada in abandonadas:
+        _encerrar_perfil(abandonada)
+    if not _vez_do_perfilador.acquire(blocking=False):
+        return None
+    perfilador = cProfile.Profile()
+    try:
+        perfilador.enable()
+    except ValueError:
+        # Perfilador ativo fora deste módulo
+        _vez_do_perfilador.release()
+        return None
+    return perfilador
+
+
+def iniciar_execucao(inicio=None):
+    """Começa a medir a execução atual do script (uma por sessão/thread do Streamlit)."""
+    anterior = _execucao_atual.get()
+    if anterior is not None and not anterior.finalizada and anterior.perfilador is not None:
+        _encerrar_perfil(anterior)
+    perfilador = _novo_perfilador() if AMOSTRAGEM > 0 and random.random() < AMOSTRAGEM else None
+    execucao = ExecucaoPerfilada(inicio, perfilador)
+    if perfilador is not None:
+        with _lock_perfis:
+            _perfiladas_ativas.add(execucao)
+    _execucao_atual.set(execucao)
+    return execucao
+
+
+def medir_fase(nome):
+    """Mede uma fase da execução atual; sem execução iniciada (fora do script), não mede nada."""
+    execucao = _execucao_atual.get()
+    return execucao.fase(nome) if execucao is not None and not execucao.finalizada else contextlib.nullcontext()
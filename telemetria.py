@@ -0,0 +1,184 @@
+import logging
+import os
+import threading
+import time
+
+from opentelemetry import metrics, trace
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram, Info, start_http_server
+
+ORCAMENTO_INICIALIZACAO = float(os.getenv("INICIALIZACAO_ORCAMENTO_SEGUNDOS", "3"))
+
+_executadas = set()
+_lock_executadas = threading.Lock()
+
+
+def uma_vez(nome):
+    """True só na primeira chamada com esse nome no processo (o script do Streamlit é reexecutado)."""
+    with _lock_executadas:
+        if nome in _executadas:
+            return False
+        _executadas.add(nome)
+        return True
+
+
+def registrar_fase(fase, segundos):
+    """Registra a duração de uma fase da inicialização; chamadas seguintes para a mesma fase são ignoradas."""
+    if uma_vez(f"fase:{fase}"):
+        inicializacao_segundos.labels(fase=fase).set(segundos)
+        return True
+    return False
+
+
+def concluir_inicializacao(segundos, logger):
+    """Registra a primeira execução completa do script e avisa se passou do orçamento."""
+    if registrar_fase("primeira_execucao", segundos) and segundos > ORCAMENTO_INICIALIZACAO:
+        logger.warning("Primeira execução levou %.2fs (orçamento de %.2fs)", segundos, ORCAMENTO_INICIALIZACAO,
+                       inicializacao_segundos=round(segundos, 3))
+
+
+# ========== Métricas Prometheus (criação segura) ==========
+def safe_get(name):
+    try:
+        return REGISTRY._names_to_collectors.get(name)
+    except Exception:
+        return None
+
+def get_or_create_counter(name, description, labelnames=None):
+    existing = safe_get(name)
+    if existing:
+        return existing
+    return Counter(name, description, labelnames or [])
+
+def get_or_create_histogram(name, description, labelnames=None, buckets=None):
+    existing = safe_get(name)
+    if existing:
+        return existing
+    if buckets is not None:
+        return Histogram(name, description, labelnames or [], buckets=buckets)
+    return Histogram(name, description, labelnames or [])
+
+def get_or_create_gauge(name, description, labelnames=None):
+    existing = safe_get(name)
+    if existing:
+        return existing
+    return Gauge(name, description, labelnames or [])
+
+def get_or_create_info(name, description):
+    existing = safe_get(name)
+    if existing:
+        return existing
+    return Info(name, description)
+
+
+# Tempo de cada fase da inicialização do processo (medido uma vez) e o orçamento configurado
+inicializacao_segundos = get_or_create_gauge('inicializacao_segundos', 'Duração das fases de inicialização do processo',
+                                             ['fase'])
+inicializacao_orcamento = get_or_create_gauge('inicializacao_orcamento_segundos',
+                                              'Orçamento para a primeira execução do script')
+inicializacao_orcamento.set(ORCAMENTO_INICIALIZACAO)
+
+
+# ========== Servidor de métricas ==========
+def iniciar_servidor_metricas(logger, ao_falhar=None):
+    """Sobe o endpoint /metrics (METRICS_PORT) em segundo plano, uma vez por processo."""
+    if not uma_vez("servidor_metricas"):
+        return
+
+    def iniciar():
+        try:
+            port = int(os.getenv("METRICS_PORT", "8000"))
+            start_http_server(port)
+            logger.info("Servidor de métricas Prometheus iniciado", metrics_port=port)
+        except Exception as e:
+            logger.error("Erro ao iniciar servidor de métricas: %s", e)
+            if ao_falhar is not None:
+                ao_falhar()
+
+    threading.Thread(target=iniciar, name="metricas-servidor", daemon=True).start()
+
+
+# ========== OpenTelemetry (traces + optional metrics export via OTLP) ==========
+def sanitize_otlp_endpoint(raw: str) -> str:
+    if not raw:
+        return ""
+    # OTLP gRPC exporter expects host:port; strip scheme if present
+    if raw.startswith("http://") or raw.startswith("https://"):
+        return raw.split("://", 1)[1]
+    return raw
+
+
+def _configurar_opentelemetry(atributos, endpoint, logger):
+    # SDK, exportadores gRPC e o instrumentor só são importados aqui, fora do caminho da primeira página
+    inicio = time.perf_counter()
+    try:
+        from opentelemetry.instrumentation.logging import LoggingInstrumentor
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+
+        # Não deixar o LoggingInstrumentor alterar o formato do logging (evita KeyError)
+        # iremos enriquecer logs manualmente
+        LoggingInstrumentor().instrument(set_logging_format=False)
+
+        resource = Resource.create(atributos)
+
+        # Tracing
+        trace.set_tracer_provider(TracerProvider(resource=resource))
+        if endpoint:
+            try:
+                from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+                from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+                otlp_trace_exporter = OTLPSpanExporter(endpoint=endpoint, insecure=True)
+                span_processor = BatchSpanProcessor(otlp_trace_exporter)
+                trace.get_tracer_provider().add_span_processor(span_processor)
+                logger.info("OTLP trace exporter configurado", otlp_endpoint=endpoint)
+            except Exception as e:
+                logger.warning("Falha ao configurar OTLP trace exporter, continuando sem exporter", error=str(e))
+        else:
+            logger.warning("OTLP endpoint vazio — traces serão coletados localmente sem exportação")
+
+        # Metrics (optional OTLP export); we still expose Prometheus via start_http_server
+        if endpoint:
+            try:
+                from opentelemetry.exporter.otlp.proto.grpc.metric_exporter import OTLPMetricExporter
+                from opentelemetry.sdk.metrics import MeterProvider
+                from opentelemetry.sdk.metrics.export import PeriodicExportingMetricReader
+
+                otlp_metric_exporter = OTLPMetricExporter(endpoint=endpoint, insecure=True)
+                metric_reader = PeriodicExportingMetricReader(otlp_metric_exporter)
+                metrics.set_meter_provider(MeterProvider(resource=resource, metric_readers=[metric_reader]))
+                logger.info("OTLP metric exporter configurado", otlp_endpoint=endpoint)
+            except Exception as me:
+                logger.warning("Não foi possível configurar OTLP metric exporter", error=str(me))
+
+    except Exception as e:
+        logger.error("Erro ao configurar OpenTelemetry", error=str(e))
+    finally:
+        registrar_fase("telemetria", time.perf_counter() - inicio)
+
+
+def configurar_telemetria(atributos, endpoint, logger, modo=None):
+    """Configura logging e OpenTelemetry uma vez por processo.
+
+    modo (TELEMETRIA_INICIALIZACAO): "segundo_plano" (padrão) não bloqueia a primeira página;
+    spans criados antes do fim vêm do provider proxy e passam a ser exportados quando ele é
+    trocado. "imediata" configura antes de seguir e "desligada" mantém só os traces no-op.
+    """
+    if not uma_vez("telemetria"):
+        return
+    modo = modo or os.getenv("TELEMETRIA_INICIALIZACAO", "segundo_plano")
+
+    # Emitir sempre uma única linha JSON para stdout (facilita scraping por promtail)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(message)s",
+        handlers=[logging.StreamHandler()]
+    )
+
+    if modo == "desligada":
+        logger.info("Telemetria OpenTelemetry desligada", telemetria_modo=modo)
+    elif modo == "imediata":
+        _configurar_opentelemetry(atributos, endpoint, logger)
+    else:
+        threading.Thread(target=_configurar_opentelemetry, args=(atributos, endpoint, logger),
+                         name="telemetria-configuracao", daemon=True).start()
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from api import AgrupadorGravacoes, ApiDespesas, ErroRequisicao
+from armazenamento import RepositorioDespesas, descartar_repositorio, obter_armazenamento
+
+
+def test_lote_invalido_recusa_so_a_propria_requisicao(tmp_path):
+    repositorio = RepositorioDespesas(obter_armazenamento(str(tmp_path / "despesas.csv"), "csv"))
+
+    async def cenario():
+        agrupador = AgrupadorGravacoes(repositorio, janela=0.01)
+        tarefa = asyncio.create_task(agrupador.executar())
+        bom = [{"Data": "01/03/2024", "Descrição": "Café", "Categoria": "Alimentação", "Valor": "5", "Tipo": "Despesa"},
+               {"Data": "xx", "Valor": "1"}]
+        # Exportação do banco com uma categoria que não pode ser traduzida
+        ruim = [{"Date": "01/03/2024", "Amount": "10", "Category": ["lista"]}]
+        resultados = await asyncio.gather(agrupador.gravar(bom), agrupador.gravar(ruim), return_exceptions=True)
+        tarefa.cancel()
+        return resultados
+
+    try:
+        resultado_bom, resultado_ruim = asyncio.run(cenario())
+        assert resultado_bom == (1, [(1, "Data inválida")])
+        assert isinstance(resultado_ruim, ErroRequisicao) and resultado_ruim.status == 400
+        assert repositorio.obter()["Descrição"].tolist() == ["Café"]
+    finally:
+        descartar_repositorio(repositorio)
+
+
+@pytest.mark.parametrize("tamanho", ["abc", "-5", "1.5", "²"])
+def test_content_length_invalido_responde_400(tmp_path, tamanho):
+    repositorio = RepositorioDespesas(obter_armazenamento(str(tmp_path / "despesas.csv"), "csv"))
+
+    async def cenario():
+        servidor = await asyncio.start_server(ApiDespesas(repositorio).atender, "127.0.0.1", 0)
+        porta = servidor.sockets[0].getsockname()[1]
+        async with servidor:
+            leitor, escritor = await asyncio.open_connection("127.0.0.1", porta)
+            escritor.write(f"POST /registros HTTP/1.1\r\nHost: teste\r\nContent-Length: {tamanho}\r\n\r\n"
+                           .encode("latin-1"))
+            resposta = await leitor.read()
+            escritor.close()
+            return resposta
+
+    try:
+        assert asyncio.run(cenario()).startswith(b"HTTP/1.1 400 ")
+    finally:
+        descartar_repositorio(repositorio)
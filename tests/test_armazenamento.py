@@ -0,0 +1,85 @@
+import pandas as pd
+import pytest
+
+from armazenamento import (BaseArrow, BaseParquet, RepositorioDespesas, criar_base, descartar_repositorio, migrar_csv,
+                          obter_armazenamento)
+
+# Acima de ~R$131.072 o float32 já não representa os centavos
+VALORES_GRANDES = [1234567.89, 250000.37, 131072.01, 12.3]
+
+
+def _csv_com_valores_grandes(caminho):
+    linhas = [f"0{i + 1}/03/2024,Registro {i},Moradia,{valor},Despesa" for i, valor in enumerate(VALORES_GRANDES)]
+    caminho.write_text("Data,Descrição,Categoria,Valor,Tipo\n" + "\n".join(linhas) + "\n", encoding="utf-8")
+    return str(caminho)
+
+
+@pytest.mark.parametrize("formato", ["arrow", "parquet"])
+def test_migracao_arrow_parquet_preserva_centavos(tmp_path, formato):
+    caminho_csv = _csv_com_valores_grandes(tmp_path / "despesas.csv")
+    migrar_csv(caminho_csv, formato)
+    base = criar_base(caminho_csv, formato)
+    df = base.ler()
+    assert df["Valor"].dtype == "float64"
+    assert df["Valor"].tolist() == VALORES_GRANDES
+
+    # Compactação: regrava o arquivo com um registro novo
+    base.escrever_compactado(base.caminho + ".novo", [
+        {"Data": "10/03/2024", "Descrição": "Novo", "Categoria": "Moradia", "Valor": "987654.32", "Tipo": "Despesa"}])
+    assert type(base)(base.caminho + ".novo").ler()["Valor"].tolist() == VALORES_GRANDES + [987654.32]
+
+
+@pytest.mark.parametrize("classe", [BaseArrow, BaseParquet])
+def test_arquivo_antigo_em_float32_arredonda_centavos(tmp_path, classe):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from pyarrow import feather
+
+    caminho = str(tmp_path / ("antigo" + classe.extensao))
+    tabela = pa.table({"Data": pd.to_datetime(["2024-03-01"]), "Descrição": ["Café"], "Categoria": ["Alimentação"],
+                       "Valor": pa.array([12.3], type=pa.float32()), "Tipo": ["Despesa"]})
+    if classe is BaseArrow:
+        feather.write_feather(tabela, caminho, compression="uncompressed")
+    else:
+        pq.write_table(tabela, caminho)
+    assert classe(caminho).ler()["Valor"].tolist() == [12.3]
+
+
+def test_migracao_particionada_preserva_texto_dos_valores(tmp_path):
+    caminho_csv = _csv_com_valores_grandes(tmp_path / "despesas.csv")
+    migrar_csv(caminho_csv, "particionado")
+    base = criar_base(caminho_csv, "particionado")
+    with open(base.caminho_particao("2024-03"), encoding="utf-8") as particao:
+        linhas = particao.read().splitlines()
+    assert linhas[0] == "Data,Descrição,Categoria,Valor,Tipo"
+    assert linhas[1:] == [f"0{i + 1}/03/2024,Registro {i},Moradia,{valor},Despesa"
+                          for i, valor in enumerate(VALORES_GRANDES)]
+    assert base.ler()["Valor"].tolist() == VALORES_GRANDES
+
+
+@pytest.mark.parametrize("formato", ["csv", "parquet", "particionado", "sqlite"])
+def test_ordenacao_por_coluna_de_texto(tmp_path, formato):
+    caminho_csv = str(tmp_path / "despesas.csv")
+    linhas = ["01/03/2024,Pão,Alimentação,9.5,Despesa", "02/03/2024,Zebra,Zeta,1,Receita",
+              "03/03/2024,Metrô,Transporte,4.4,Despesa", "04/03/2024,Aluguel,Moradia,1500,Despesa"]
+    with open(caminho_csv, "w", encoding="utf-8") as arquivo:
+        arquivo.write("Data,Descrição,Categoria,Valor,Tipo\n" + "\n".join(linhas) + "\n")
+    if formato != "csv":
+        migrar_csv(caminho_csv, formato)
+    repositorio = RepositorioDespesas(obter_armazenamento(caminho_csv, formato))
+    try:
+        pagina, total = repositorio.pagina_registros(None, ("Categoria", True))
+        assert pagina["Categoria"].tolist() == ["Alimentação", "Moradia", "Transporte", "Zeta"]
+        pagina, _ = repositorio.pagina_registros(None, ("Descrição", False))
+        assert pagina["Descrição"].tolist() == ["Zebra", "Pão", "Metrô", "Aluguel"]
+
+        # Registro novo com uma categoria que fica no meio da ordem
+        repositorio.anexar({"Data": "05/03/2024", "Descrição": "Cinema", "Categoria": "Lazer", "Valor": 30.0,
+                            "Tipo": "Despesa"})
+        pagina, total = repositorio.pagina_registros(None, ("Categoria", True))
+        assert total == 5
+        assert pagina["Categoria"].tolist() == ["Alimentação", "Lazer", "Moradia", "Transporte", "Zeta"]
+        blocos = list(repositorio.blocos_registros(None, ("Tipo", False), tamanho=2))
+        assert pd.concat(blocos)["Tipo"].tolist() == ["Receita"] + ["Despesa"] * 4
+    finally:
+        descartar_repositorio(repositorio)
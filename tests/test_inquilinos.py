@@ -0,0 +1,15 @@
+from armazenamento import descartar_repositorio
+from inquilinos import GerenciadorInquilinos, identificador_seguro, rotulo_inquilino
+
+
+def test_metricas_e_logs_nao_expoem_o_identificador(tmp_path, caplog):
+    gerenciador = GerenciadorInquilinos(str(tmp_path), "despesas.csv")
+    with caplog.at_level("INFO"):
+        repositorio = gerenciador.obter("Ana@Exemplo.com")
+    descartar_repositorio(repositorio)
+    # O diretório usa o identificador; rótulos e logs, só o hash
+    assert (tmp_path / identificador_seguro("Ana@Exemplo.com")).is_dir()
+    rotulo = rotulo_inquilino("ana@exemplo.com")
+    assert rotulo == rotulo_inquilino(" Ana@Exemplo.com ") and "@" not in rotulo
+    assert [inquilino for inquilino, _, _ in gerenciador.resumo()] == [rotulo]
+    assert "exemplo.com" not in caplog.text and rotulo in caplog.text
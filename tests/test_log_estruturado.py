@@ -0,0 +1,34 @@
+import json
+import logging
+
+from log_estruturado import StructuredLogger, obter_escritor
+
+
+class _Coletor(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.registros = []
+
+    def emit(self, record):
+        self.registros.append(record)
+
+
+def test_modo_assincrono_passa_pelos_handlers_e_filtros():
+    base = logging.getLogger("teste_assincrono")
+    base.setLevel(logging.INFO)
+    coletor = _Coletor()
+    coletor.addFilter(lambda registro: "descartar" not in registro.getMessage())
+    base.addHandler(coletor)
+    try:
+        logger = StructuredLogger("teste_assincrono", contexto={"service": "teste"}, assincrono=True)
+        logger.info("Total: %.2f", 12.5, categoria="Moradia")
+        logger.warning("descartar esta")
+        assert obter_escritor().esvaziar()
+    finally:
+        base.removeHandler(coletor)
+
+    assert len(coletor.registros) == 1
+    registro = coletor.registros[0]
+    assert registro.levelno == logging.INFO
+    dados = json.loads(registro.getMessage())
+    assert dados["message"] == "Total: 12.50" and dados["categoria"] == "Moradia" and dados["service"] == "teste"
@@ -0,0 +1,24 @@
+from armazenamento import descartar_repositorio, obter_repositorio, repositorio_existente
+from metricas import ColetorAgregados
+
+
+def _amostras(coletor):
+    return {amostra.name: amostra.value for familia in coletor.collect() for amostra in familia.samples}
+
+
+def test_coleta_sem_repositorio_nao_abre_arquivos(tmp_path):
+    caminho_csv = str(tmp_path / "despesas.csv")
+    with open(caminho_csv, "w", encoding="utf-8") as arquivo:
+        arquivo.write("Data,Descrição,Categoria,Valor,Tipo\n01/03/2024,Café,Alimentação,5,Despesa\n")
+    coletor = ColetorAgregados(lambda: repositorio_existente(caminho_csv))
+
+    assert _amostras(coletor) == {}
+    assert repositorio_existente(caminho_csv) is None
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["despesas.csv"]
+
+    repositorio = obter_repositorio(caminho_csv)
+    try:
+        repositorio.obter_agregados()
+        assert _amostras(coletor)["total_despesas_reais"] == 5.0
+    finally:
+        descartar_repositorio(repositorio)
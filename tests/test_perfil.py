@@ -0,0 +1,34 @@
+import threading
+
+import perfil
+
+
+def test_uma_execucao_perfilada_por_vez(tmp_path, monkeypatch):
+    monkeypatch.setattr(perfil, "AMOSTRAGEM", 1.0)
+    monkeypatch.setattr(perfil, "DIRETORIO", str(tmp_path))
+    iniciada, liberar = threading.Event(), threading.Event()
+    resultados = {}
+
+    def primeira():
+        resultados["primeira"] = perfil.iniciar_execucao()
+        iniciada.set()
+        liberar.wait(5)
+        resultados["primeira"].finalizar()
+
+    thread = threading.Thread(target=primeira)
+    thread.start()
+    iniciada.wait(5)
+    # Outra sessão sorteada enquanto a primeira é perfilada: segue sem perfilador
+    segunda = threading.Thread(target=lambda: resultados.setdefault("segunda", perfil.iniciar_execucao()))
+    segunda.start()
+    segunda.join()
+    liberar.set()
+    thread.join()
+
+    assert resultados["primeira"].perfilador is not None
+    assert resultados["segunda"].perfilador is None
+    assert len(list(tmp_path.glob("*.prof"))) == 1
+    # A vez foi liberada: a próxima execução é perfilada
+    terceira = perfil.iniciar_execucao()
+    assert terceira.perfilador is not None
+    terceira.finalizar()